@@ -0,0 +1,661 @@
+# -*- coding: utf-8 -*-
+"""
+Constrained genetic programming for the diffusion scaling law
+"""
+
+'''
+A small typed genetic programming in the style of gplearn: programs are
+prefix lists of function names, feature indices (X0, X1) and constants,
+evolved by tournament selection, crossover and mutations.
+
+Every node carries the unit of its value, as a power of eV, and its sign
+(positive, non-negative or any). Candidates that are not dimensionally
+consistent, such as Ebind - sqrt(Ebind), or that take the sqrt/log/inverse
+of a value that may be negative or zero are rejected before they are
+evaluated, instead of being protected as in gplearn. Crossover only swaps
+subtrees of the same unit and at least the same sign, so offspring of
+valid parents stay valid.
+
+The output of a program f is linearly scaled, y = a*f(X) + b, so the
+program only has to find the form (e.g. Ebind^2/Ec) and its constants are
+dimensionless. With strict_units the program itself must have the unit of
+the target, so a is dimensionless too.
+'''
+
+import bisect
+import hashlib
+import time
+import re
+from fractions import Fraction
+
+import numpy as np
+import pandas as pd
+from sklearn.utils import check_random_state
+
+# Sign types, ordered from the weakest to the strongest
+ANY, NONNEG, POS = 0, 1, 2
+
+# Function name -> arity
+functions = {'add': 2, 'sub': 2, 'mul': 2, 'div': 2,
+             'sqrt': 1, 'square': 1, 'inv': 1, 'log': 1, 'neg': 1}
+
+_numpy_functions = {'add': np.add, 'sub': np.subtract, 'mul': np.multiply, 'div': np.divide,
+                    'sqrt': np.sqrt, 'square': np.square, 'inv': np.reciprocal, 'log': np.log,
+                    'neg': np.negative}
+
+
+def node_type(name, args):
+
+    '''
+    Unit and sign of a function node from the (unit, sign) of its arguments
+    return None if the node is not valid
+    '''
+    if name in ('add', 'sub'):
+        (u0, s0), (u1, s1) = args
+        if u0 != u1: return None
+        return (u0, min(s0, s1)) if name == 'add' else (u0, ANY)
+    if name == 'mul':
+        (u0, s0), (u1, s1) = args
+        return u0 + u1, min(s0, s1)
+    if name == 'div':
+        (u0, s0), (u1, s1) = args
+        if s1 != POS: return None
+        return u0 - u1, s0
+
+    u0, s0 = args[0]
+    if name == 'sqrt':
+        if s0 < NONNEG: return None
+        return u0 / 2, s0
+    if name == 'square':
+        return 2 * u0, max(s0, NONNEG)
+    if name == 'inv':
+        if s0 != POS: return None
+        return -u0, POS
+    if name == 'log':
+        if s0 != POS or u0 != 0: return None
+        return Fraction(0), ANY
+    if name == 'neg':
+        return u0, ANY
+
+    raise ValueError('Unknown function {}'.format(name))
+
+
+def terminal_type(node, feature_types):
+
+    if isinstance(node, str): raise ValueError('{} is not a terminal'.format(node))
+    if isinstance(node, (int, np.integer)): return feature_types[node]
+    return Fraction(0), POS if node > 0 else ANY
+
+
+def subtree_end(program, start):
+
+    '''
+    Index one past the end of the subtree starting at start
+    '''
+    need, end = 1, start
+    while need > 0:
+        node = program[end]
+        need += functions[node] - 1 if isinstance(node, str) else -1
+        end += 1
+    return end
+
+
+def parse_program(expression):
+
+    '''
+    Program from a gplearn style S-expression, e.g. 'div(square(X1), X0)'
+    '''
+    program = []
+    for token in re.findall(r'X\d+|[A-Za-z_]+|-?\d+\.?\d*(?:[eE]-?\d+)?', expression):
+        if token[0] == 'X' and token[1:].isdigit(): program.append(int(token[1:]))
+        elif token in functions: program.append(token)
+        else: program.append(float(token))
+
+    if not program or subtree_end(program, 0) != len(program):
+        raise ValueError('{} is not a complete program'.format(expression))
+    return program
+
+
+def canonical_form(program, start = 0):
+
+    '''
+    Canonical S-expression of the subtree at start, with the arguments of
+    add and mul sorted and constants rounded to 6 significant digits,
+    so that e.g. mul(X0, X1) and mul(X1, X0) are the same structure
+    return the canonical string and the end of the subtree
+    '''
+    node = program[start]
+    if not isinstance(node, str):
+        return ('X{}'.format(node) if isinstance(node, (int, np.integer)) else '{:.6g}'.format(node)), start + 1
+    args, end = [], start + 1
+    for _ in range(functions[node]):
+        arg, end = canonical_form(program, end)
+        args.append(arg)
+    if node in ('add', 'mul'): args.sort()
+    return node + '(' + ', '.join(args) + ')', end
+
+
+def structural_hash(program):
+
+    '''
+    64-bit hash of the canonical form, used to intern programs
+    '''
+    return hashlib.blake2b(canonical_form(program)[0].encode(), digest_size = 8).hexdigest()
+
+
+def linear_scale(f, y):
+
+    '''
+    Least squares a, b of y = a*f + b
+    return a, b and the RMSE, or None if f is not finite or constant
+    '''
+    if not np.all(np.isfinite(f)): return None
+    f_mean = f.mean()
+    f_var = np.mean((f - f_mean)**2)
+    if f_var <= 1e-12 * max(1.0, f_mean**2): return None
+    a = np.mean((f - f_mean) * (y - y.mean())) / f_var
+    b = y.mean() - a * f_mean
+    return a, b, np.sqrt(np.mean((a * f + b - y)**2))
+
+
+def execute_jacobian(program, X):
+
+    '''
+    Value of the program and its analytic derivatives with respect to its
+    constants (samples x constants), by forward accumulation through the tree
+    '''
+    constants = [i for i, node in enumerate(program) if not isinstance(node, (str, int, np.integer))]
+    position = {ci: k for k, ci in enumerate(constants)}
+    n, k = len(X), len(constants)
+
+    stack = []
+    with np.errstate(all = 'ignore'):
+        for i in range(len(program) - 1, -1, -1):
+            node = program[i]
+            if isinstance(node, str):
+                args = [stack.pop() for _ in range(functions[node])]
+                v0, g0 = args[0]
+                if node == 'add': v, g = v0 + args[1][0], g0 + args[1][1]
+                elif node == 'sub': v, g = v0 - args[1][0], g0 - args[1][1]
+                elif node == 'mul':
+                    v1, g1 = args[1]
+                    v, g = v0 * v1, g0 * v1[:, None] + v0[:, None] * g1
+                elif node == 'div':
+                    v1, g1 = args[1]
+                    v, g = v0 / v1, (g0 * v1[:, None] - v0[:, None] * g1) / (v1**2)[:, None]
+                elif node == 'sqrt':
+                    v = np.sqrt(v0)
+                    g = g0 / (2 * v)[:, None]
+                elif node == 'square': v, g = v0**2, 2 * v0[:, None] * g0
+                elif node == 'inv': v, g = 1 / v0, -g0 / (v0**2)[:, None]
+                elif node == 'log': v, g = np.log(v0), g0 / v0[:, None]
+                elif node == 'neg': v, g = -v0, -g0
+                stack.append((v, g))
+            elif isinstance(node, (int, np.integer)):
+                stack.append((X[:, node], np.zeros((n, k))))
+            else:
+                g = np.zeros((n, k))
+                g[:, position[i]] = 1.0
+                stack.append((np.full(n, node), g))
+
+    return stack[0][0], stack[0][1], constants
+
+
+def optimize_constants(program, X, y, linear_scaling = True, max_iter = 20, tol = 1e-8):
+
+    '''
+    Levenberg-Marquardt fit of the constants of a program to the training data,
+    jointly with a, b of the linear scaling (if used)
+    Constants keep their sign, so a valid program stays valid
+    return the refined program and its training RMSE
+    '''
+    X = np.asarray(X, dtype = float)
+    y = np.asarray(y, dtype = float)
+    program = list(program)
+
+    def residuals(program):
+        f, J_f, constants = execute_jacobian(program, X)
+        if linear_scaling:
+            scaled = linear_scale(f, y)
+            if scaled is None: return None
+            a, b, _ = scaled
+            return a * f + b - y, np.column_stack([a * J_f, f, np.ones(len(y))]), constants
+        if not np.all(np.isfinite(f)): return None
+        return f - y, J_f, constants
+
+    current = residuals(program)
+    if current is None: return program, np.inf
+    r, J, constants = current
+    cost = np.mean(r**2)
+    if not constants: return program, np.sqrt(cost)
+
+    damping = 1e-3
+    for _ in range(max_iter):
+        JTJ = np.dot(J.T, J)
+        JTr = np.dot(J.T, r)
+        step = np.linalg.lstsq(JTJ + damping * np.diag(np.diag(JTJ) + 1e-12), -JTr, rcond = None)[0]
+
+        c_old = np.array([program[ci] for ci in constants])
+        c_new = c_old + step[:len(constants)]
+        trial = list(program)
+        for ci, vi in zip(constants, c_new): trial[ci] = float(vi)
+        evaluated = None if np.any(np.sign(c_new) != np.sign(c_old)) else residuals(trial)
+
+        if evaluated is not None and np.mean(evaluated[0]**2) < cost:
+            improvement = cost - np.mean(evaluated[0]**2)
+            program, (r, J, _) = trial, evaluated
+            cost = np.mean(r**2)
+            damping = max(damping / 10, 1e-12)
+            if improvement <= tol * cost: break
+        else:
+            damping *= 10
+            if damping > 1e8: break
+
+    return program, np.sqrt(cost)
+
+
+class Program(object):
+
+    '''
+    One candidate expression, with the printing and graphviz export of gplearn programs
+    '''
+    def __init__(self, program):
+        self.program = list(program)
+
+    def __str__(self):
+        terminals = [0]
+        output = ''
+        for i, node in enumerate(self.program):
+            if isinstance(node, str):
+                terminals.append(functions[node])
+                output += node + '('
+            else:
+                output += 'X{}'.format(node) if isinstance(node, (int, np.integer)) else '{:.3f}'.format(node)
+                terminals[-1] -= 1
+                while terminals[-1] == 0:
+                    terminals.pop()
+                    terminals[-1] -= 1
+                    output += ')'
+                if i != len(self.program) - 1:
+                    output += ', '
+        return output
+
+    def __len__(self):
+        return len(self.program)
+
+    def types(self, feature_types):
+
+        '''
+        (unit, sign) of every node, None for the nodes that are not valid
+        return the list of node types and the type of the program (None if not valid)
+        '''
+        types = [None] * len(self.program)
+        stack = []
+        for i in range(len(self.program) - 1, -1, -1):
+            node = self.program[i]
+            if isinstance(node, str):
+                args = [stack.pop() for _ in range(functions[node])]
+                types[i] = None if any(ai is None for ai in args) else node_type(node, args)
+            else:
+                types[i] = terminal_type(node, feature_types)
+            stack.append(types[i])
+        return types, stack[0]
+
+    def depth(self):
+        stack = []
+        for node in reversed(self.program):
+            if isinstance(node, str):
+                stack.append(1 + max([stack.pop() for _ in range(functions[node])]))
+            else:
+                stack.append(0)
+        return stack[0]
+
+    def execute(self, X):
+
+        '''
+        Evaluate the program on the rows of X (samples x features)
+        '''
+        stack = []
+        with np.errstate(all = 'ignore'):
+            for node in reversed(self.program):
+                if isinstance(node, str):
+                    stack.append(_numpy_functions[node](*[stack.pop() for _ in range(functions[node])]))
+                elif isinstance(node, (int, np.integer)):
+                    stack.append(X[:, node])
+                else:
+                    stack.append(np.full(len(X), node))
+        return stack[0]
+
+    def export_graphviz(self):
+
+        '''
+        Syntax tree in the graphviz dot format
+        '''
+        output = 'digraph program {\nnode [style=filled]\n'
+        stack = []
+        for i in range(len(self.program) - 1, -1, -1):
+            node = self.program[i]
+            if isinstance(node, str):
+                output += '{} [label="{}", fillcolor="#136ed4"] ;\n'.format(i, node)
+                for _ in range(functions[node]):
+                    output += '{} -> {} ;\n'.format(i, stack.pop())
+            else:
+                label = 'X{}'.format(node) if isinstance(node, (int, np.integer)) else '{:.3f}'.format(node)
+                output += '{} [label="{}", fillcolor="#60a6f6"] ;\n'.format(i, label)
+            stack.append(i)
+        return output + '}'
+
+
+class ConstrainedSymbolicRegressor(object):
+
+    '''
+    Symbolic regression restricted to dimensionally and physically valid programs
+    feature_units, target_unit: units as powers of eV, e.g. [1, 1] and 1 for Ec, Ebind -> Ea
+    seeds: S-expressions of known forms put in the initial population
+    n_iter_no_change: stop when the best fitness has not improved for that many generations
+    optimize_every, n_optimize: every optimize_every generations the constants of the
+    n_optimize best programs are fitted by Levenberg-Marquardt (memetic step)
+    The other parameters follow gplearn SymbolicRegressor
+    '''
+    def __init__(self, population_size = 1000, generations = 20, tournament_size = 20, stopping_criteria = 0.0,
+                 const_range = (-1.0, 1.0), init_depth = (2, 6), max_depth = 8,
+                 function_set = ('add', 'sub', 'mul', 'div', 'sqrt', 'square', 'inv', 'log'),
+                 p_crossover = 0.7, p_subtree_mutation = 0.1, p_hoist_mutation = 0.05, p_point_mutation = 0.1,
+                 p_point_replace = 0.05, parsimony_coefficient = 0.001, feature_units = None, target_unit = 1,
+                 strict_units = True, seeds = (), max_retries = 20, n_iter_no_change = None,
+                 optimize_every = None, n_optimize = 10, verbose = 0, random_state = None):
+        self.population_size = population_size
+        self.generations = generations
+        self.tournament_size = tournament_size
+        self.stopping_criteria = stopping_criteria
+        self.const_range = const_range
+        self.init_depth = init_depth
+        self.max_depth = max_depth
+        self.function_set = function_set
+        self.p_crossover = p_crossover
+        self.p_subtree_mutation = p_subtree_mutation
+        self.p_hoist_mutation = p_hoist_mutation
+        self.p_point_mutation = p_point_mutation
+        self.p_point_replace = p_point_replace
+        self.parsimony_coefficient = parsimony_coefficient
+        self.feature_units = feature_units
+        self.target_unit = target_unit
+        self.strict_units = strict_units
+        self.seeds = seeds
+        self.max_retries = max_retries
+        self.n_iter_no_change = n_iter_no_change
+        self.optimize_every = optimize_every
+        self.n_optimize = n_optimize
+        self.verbose = verbose
+        self.random_state = random_state
+
+    # Validity
+
+    def _valid(self, program):
+
+        '''
+        Type check a candidate before it is evaluated
+        '''
+        candidate = Program(program)
+        if candidate.depth() > self.max_depth: return False
+        _, program_type = candidate.types(self.feature_types_)
+        if program_type is None: return False
+        if self.strict_units and program_type[0] != self.target_unit_: return False
+        return True
+
+    # Random programs and genetic operators
+
+    def _random_terminal(self, rs):
+        if self.const_range is None or rs.randint(self.n_features_ + 1) < self.n_features_:
+            return int(rs.randint(self.n_features_))
+        return float(rs.uniform(*self.const_range))
+
+    def _random_program(self, rs, depth, method):
+        n_functions = len(self.function_set)
+        if depth == 0 or (method == 'grow' and rs.randint(n_functions + self.n_features_) >= n_functions):
+            return [self._random_terminal(rs)]
+        name = self.function_set[rs.randint(n_functions)]
+        program = [name]
+        for _ in range(functions[name]):
+            program += self._random_program(rs, depth - 1, method)
+        return program
+
+    def _new_program(self, rs):
+
+        '''
+        Random valid program, ramped half and half as in gplearn
+        '''
+        for _ in range(self.max_retries):
+            depth = rs.randint(self.init_depth[0], self.init_depth[1] + 1)
+            program = self._random_program(rs, depth, 'full' if rs.rand() < 0.5 else 'grow')
+            if self._valid(program): return program
+            self.n_pruned_ += 1
+        return None
+
+    def _random_node(self, rs, program):
+        # functions are picked 90% of the time, as in gplearn
+        probs = np.array([0.9 if isinstance(node, str) else 0.1 for node in program])
+        return int(rs.choice(len(program), p = probs / probs.sum()))
+
+    def _crossover(self, rs, program, donor):
+
+        '''
+        Replace a subtree of program by a subtree of donor of the same unit and at least the same sign
+        '''
+        types, _ = Program(program).types(self.feature_types_)
+        donor_types, _ = Program(donor).types(self.feature_types_)
+        start = self._random_node(rs, program)
+        unit, sign = types[start]
+        matches = [i for i, ti in enumerate(donor_types) if ti[0] == unit and ti[1] >= sign]
+        if not matches: return None
+        donor_start = matches[rs.randint(len(matches))]
+        return program[:start] + donor[donor_start:subtree_end(donor, donor_start)] + program[subtree_end(program, start):]
+
+    def _subtree_mutation(self, rs, program):
+        donor = self._new_program(rs)
+        return None if donor is None else self._crossover(rs, program, donor)
+
+    def _hoist_mutation(self, rs, program):
+        start = self._random_node(rs, program)
+        end = subtree_end(program, start)
+        subtree = program[start:end]
+        sub_start = self._random_node(rs, subtree)
+        return program[:start] + subtree[sub_start:subtree_end(subtree, sub_start)] + program[end:]
+
+    def _point_mutation(self, rs, program):
+        program = list(program)
+        for i in np.flatnonzero(rs.uniform(size = len(program)) < self.p_point_replace):
+            if isinstance(program[i], str):
+                same_arity = [fi for fi in self.function_set if functions[fi] == functions[program[i]]]
+                program[i] = same_arity[rs.randint(len(same_arity))]
+            else:
+                program[i] = self._random_terminal(rs)
+        return program
+
+    def _offspring(self, rs, population, fitness):
+
+        '''
+        One child of the next generation, invalid children are pruned and
+        retried, the parent is reproduced if no valid child is found
+        '''
+        parent = self._tournament(rs, population, fitness)
+        for _ in range(self.max_retries):
+            method = rs.uniform()
+            if method < self.p_crossover:
+                child = self._crossover(rs, parent, self._tournament(rs, population, fitness))
+            elif method < self.p_crossover + self.p_subtree_mutation:
+                child = self._subtree_mutation(rs, parent)
+            elif method < self.p_crossover + self.p_subtree_mutation + self.p_hoist_mutation:
+                child = self._hoist_mutation(rs, parent)
+            elif method < self.p_crossover + self.p_subtree_mutation + self.p_hoist_mutation + self.p_point_mutation:
+                child = self._point_mutation(rs, parent)
+            else:
+                return list(parent)
+            if child is not None and self._valid(child): return child
+            self.n_pruned_ += 1
+        return list(parent)
+
+    def _tournament(self, rs, population, fitness):
+        contenders = rs.randint(len(population), size = self.tournament_size)
+        return population[contenders[np.argmin(fitness[contenders])]]
+
+    # Fitness
+
+    def _evaluate(self, population, X, y):
+
+        '''
+        Raw (RMSE) and penalized fitness, each distinct program is evaluated once per run
+        '''
+        raw_fitness = np.full(len(population), np.inf)
+        for i, program in enumerate(population):
+            key = tuple(program)
+            if key not in self._fitness_cache:
+                scaled = linear_scale(Program(program).execute(X), y)
+                self._fitness_cache[key] = np.inf if scaled is None else scaled[2]
+            raw_fitness[i] = self._fitness_cache[key]
+        lengths = np.array([len(pi) for pi in population])
+        return raw_fitness, raw_fitness + self.parsimony_coefficient * lengths
+
+    # Pareto archive
+
+    def _update_pareto(self, population, raw_fitness, X, y):
+
+        '''
+        Insert the best program of each length into the accuracy-complexity front
+        The front is kept sorted by length with strictly decreasing RMSE, and only
+        the programs on it are interned (by structural hash)
+        '''
+        lengths = np.array([len(pi) for pi in population])
+        for length in np.unique(lengths):
+            candidates = np.flatnonzero(lengths == length)
+            i = candidates[np.argmin(raw_fitness[candidates])]
+            RMSE = raw_fitness[i]
+            if not np.isfinite(RMSE): continue
+
+            position = bisect.bisect_left(self._pareto_lengths, length)
+            # dominated by a shorter or an equally long program, up to round-off
+            # (e.g. inv(inv(X1)) is not better than X1)
+            tolerance = RMSE * (1 + 1e-9)
+            if position > 0 and self.pareto_[position - 1][1] <= tolerance: continue
+            if position < len(self.pareto_) and self.pareto_[position][0] == length and self.pareto_[position][1] <= tolerance: continue
+            end = position
+            while end < len(self.pareto_) and self.pareto_[end][1] >= RMSE * (1 - 1e-9): end += 1
+            for _, _, key in self.pareto_[position:end]:
+                del self.programs_[key]
+
+            key = structural_hash(population[i])
+            a, b, _ = linear_scale(Program(population[i]).execute(X), y)
+            self.programs_[key] = (list(population[i]), a, b)
+            self.pareto_[position:end] = [(int(length), float(RMSE), key)]
+            self._pareto_lengths[position:end] = [int(length)]
+
+    def pareto_front(self, feature_names = None):
+
+        '''
+        Accuracy-complexity trade-off found during the run
+        return a dataframe with one row per non-dominated program
+        '''
+        rows = []
+        for length, RMSE, key in self.pareto_:
+            program, a, b = self.programs_[key]
+            expression = str(Program(program))
+            if feature_names is not None:
+                for i in range(len(feature_names) - 1, -1, -1):
+                    expression = expression.replace('X{}'.format(i), feature_names[i])
+            rows.append({'complexity': length, 'RMSE': RMSE, 'a': a, 'b': b, 'expression': expression, 'hash': key})
+        return pd.DataFrame(rows, columns = ['complexity', 'RMSE', 'a', 'b', 'expression', 'hash'])
+
+    def _optimize(self, population, raw_fitness, fitness, X, y):
+
+        '''
+        Fit the constants of the best programs in place
+        '''
+        for i in np.argsort(fitness, kind = 'mergesort')[:self.n_optimize]:
+            if not np.isfinite(fitness[i]): break
+            program, RMSE = optimize_constants(population[i], X, y)
+            if RMSE < raw_fitness[i]:
+                population[i] = program
+                raw_fitness[i] = RMSE
+                fitness[i] = RMSE + self.parsimony_coefficient * len(program)
+
+    # Training and prediction
+
+    def fit(self, X, y):
+
+        '''
+        Evolve the population, the best program is kept from one generation to the next
+        '''
+        X = np.asarray(X, dtype = float)
+        y = np.asarray(y, dtype = float)
+        rs = check_random_state(self.random_state)
+
+        self.n_features_ = X.shape[1]
+        feature_units = [1] * self.n_features_ if self.feature_units is None else self.feature_units
+        # a feature is positive if it is in the training data, e.g. energies
+        self.feature_types_ = [(Fraction(ui), POS if np.all(X[:, i] > 0) else ANY) for i, ui in enumerate(feature_units)]
+        self.target_unit_ = Fraction(self.target_unit)
+        self.n_pruned_ = 0
+        self._fitness_cache = {}
+        self.programs_ = {}
+        self.pareto_ = []
+        self._pareto_lengths = []
+
+        population = []
+        for seed in self.seeds:
+            program = parse_program(seed)
+            if not self._valid(program):
+                raise ValueError('Seed {} is not a valid program'.format(seed))
+            population.append(program)
+        while len(population) < self.population_size:
+            program = self._new_program(rs)
+            if program is not None: population.append(program)
+
+        self.run_details_ = {'generation': [], 'average_length': [], 'best_length': [],
+                             'best_fitness': [], 'n_pruned': [], 'generation_time': []}
+        best_fitness = []
+        for generation in range(self.generations):
+            t0 = time.perf_counter()
+            if generation > 0:
+                best = population[np.argmin(fitness)]
+                population = [best] + [self._offspring(rs, population, fitness) for _ in range(self.population_size - 1)]
+
+            raw_fitness, fitness = self._evaluate(population, X, y)
+            if self.optimize_every and generation % self.optimize_every == 0:
+                self._optimize(population, raw_fitness, fitness, X, y)
+            best_index = np.argmin(fitness)
+            best_fitness.append(fitness[best_index])
+            self._update_pareto(population, raw_fitness, X, y)
+
+            self.run_details_['generation'].append(generation)
+            self.run_details_['average_length'].append(np.mean([len(pi) for pi in population]))
+            self.run_details_['best_length'].append(len(population[best_index]))
+            self.run_details_['best_fitness'].append(raw_fitness[best_index])
+            self.run_details_['n_pruned'].append(self.n_pruned_)
+            self.run_details_['generation_time'].append(time.perf_counter() - t0)
+            if self.verbose:
+                print('{:4d} {:8.2f} {:6d} {:10.4f} {:8d} {:8.2f}s'.format(
+                      generation, self.run_details_['average_length'][-1], len(population[best_index]),
+                      raw_fitness[best_index], self.n_pruned_, self.run_details_['generation_time'][-1]))
+
+            if raw_fitness[best_index] <= self.stopping_criteria: break
+            if (self.n_iter_no_change is not None and generation >= self.n_iter_no_change and
+                    fitness[best_index] >= best_fitness[generation - self.n_iter_no_change]): break
+
+        self._program = Program(population[best_index])
+        self.a_, self.b_, self.RMSE_ = linear_scale(self._program.execute(X), y)
+        return self
+
+    def predict(self, X):
+        X = np.asarray(X, dtype = float)
+        return self.a_ * self._program.execute(X) + self.b_
+
+    def expression(self, feature_names = None):
+
+        '''
+        The scaled model as text, e.g. 0.571*div(square(Ebind), Ec) + -0.012
+        '''
+        program = str(self._program)
+        if feature_names is not None:
+            for i in range(len(feature_names) - 1, -1, -1):
+                program = program.replace('X{}'.format(i), feature_names[i])
+        return '{:.3f}*{} + {:.3f}'.format(self.a_, program, self.b_)
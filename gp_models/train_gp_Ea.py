@@ -1,4 +1,8 @@
 #%% Import necessary libraries
+import argparse
+import os
+import sys
+
 from gplearn.genetic import SymbolicRegressor
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.tree import DecisionTreeRegressor
@@ -16,15 +20,22 @@ from sklearn.model_selection import (LeaveOneOut, RepeatedKFold,
 import pandas as pd
 import graphviz
 
+# import the constrained genetic programming
+import gp_tools as gtools
+# seed tree shared with the statistical-learning models
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ml_models'))
+import seed_tools as sdtools
+
 # Set up random state
 # other random states taken were 1,2,3,4 in this work
 random_state = 0 
+seed_tree = sdtools.SeedTree(random_state)
 
 # Read data from a csv file
 model_name = 'gp_Ea'
 data = pd.read_csv('Ea_data.csv', header=0)
 
-metal = np.array(data['Metal'])
+metal = np.array(data['metal'])
 Ec = np.array(data['Ec'])
 Ebind = np.array(data['Ebind'])
 Ea = np.array(data['Ea'])
@@ -36,9 +47,29 @@ y = Ea
 X_train, X_test, y_train, y_test = train_test_split(
     X, y, test_size=0.2, random_state=0)
 
+# Constrained mode: typed primitives with units (eV), invalid candidates are
+# pruned before evaluation and the initial population is seeded with known forms
+# The published models (Ea_gp_models.csv, trees/) come from the gplearn default
+parser = argparse.ArgumentParser(description = 'Train the genetic programming model of Ea')
+parser.add_argument('--constrained', action = 'store_true', help = 'use the constrained GP of gp_tools')
+# parse_known_args so that the cells also run in an IPython kernel
+constrained = parser.parse_known_args()[0].constrained
+
 # Initialize a symbolic regressor object
 # Set up all the hyperparameters
-est_gp = SymbolicRegressor(population_size=5000, metric = 'rmse', n_jobs = 5,
+if constrained:
+    est_gp = gtools.ConstrainedSymbolicRegressor(population_size=5000,
+                           generations=20, stopping_criteria=0.1,
+                           p_crossover=0.7, p_subtree_mutation=0.1,
+                           p_hoist_mutation=0.05, p_point_mutation=0.1,
+                           verbose=1, parsimony_coefficient=0.01,
+                           feature_units=[1, 1], target_unit=1,
+                           seeds=['div(square(X1), X0)', 'X1', 'sqrt(mul(X0, X1))'],
+                           optimize_every=1, n_optimize=20,
+                           n_iter_no_change=5, random_state=seed_tree.seed('ConstrainedGP'))
+else:
+    # gplearn keeps the root seed itself, as in the published runs
+    est_gp = SymbolicRegressor(population_size=5000, metric = 'rmse', n_jobs = 5,
                            generations=20, stopping_criteria=0.1,
                            p_crossover=0.7, p_subtree_mutation=0.1,
                            p_hoist_mutation=0.05, p_point_mutation=0.1,
@@ -47,10 +78,21 @@ est_gp = SymbolicRegressor(population_size=5000, metric = 'rmse', n_jobs = 5,
 # train the gp model
 est_gp.fit(X_train, y_train)
 print(est_gp._program)
+if constrained:
+    print(est_gp.expression(['Ec', 'Ebind']))
+    # accuracy-complexity trade-off of the whole run
+    est_gp.pareto_front(['Ec', 'Ebind']).to_csv('Ea_gp_pareto_'+str(random_state)+'.csv', index=False)
 
 # Make the prediction using model
 y_test_pred = est_gp.predict(X_test)
 
+# The constants of the gplearn program are only tuned by point mutations,
+# refine them by Levenberg-Marquardt on the training data
+if not constrained:
+    program_refined, train_rmse_refined = gtools.optimize_constants(gtools.parse_program(str(est_gp._program)), X_train, y_train, linear_scaling=False)
+    test_rmse_refined = np.sqrt(mean_squared_error(y_test, gtools.Program(program_refined).execute(X_test)))
+    print('Refined constants: {} \n rmse: {} \n'.format(gtools.Program(program_refined), test_rmse_refined))
+
 # Access the model performance
 test_mae = mean_absolute_error(y_test, y_test_pred)
 test_rmse = np.sqrt(mean_squared_error(y_test, y_test_pred))
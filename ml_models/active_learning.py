@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Active learning of the diffusion scaling law, pick the next DFT calculations
+"""
+
+'''
+A candidate is a (metal, support) pair, described by the cheap tabulated
+properties of the metal (Ec, electronegativity) and of the support (Evac,
+electronegativity, CN, angle). Its Ebind and Ea need DFT.
+The surrogate is a bootstrap ensemble of the chained model used in screening:
+a LASSO Ebind model on the cheap descriptors feeds the DSL,
+Ea = u1 * Ebind^2/Ec + u0. The ensemble predictions of all candidates are one
+(members x candidates) array, the acquisition functions work on its mean and
+standard deviation, and a batch is picked greedily with the ensemble
+covariance conditioned on the points already in the batch, so the batch does
+not spend several calculations on the same correlated region.
+The bootstrap is online: each member weights each labeled point by a Poisson(1)
+count, new results get new counts and the members are refitted warm-started,
+the old counts are never redrawn.
+'''
+
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+from sklearn.linear_model import Lasso, LassoCV
+from sklearn.preprocessing import StandardScaler
+
+# import customized conditioning functions for the column pruning
+import conditioning_tools as ctools
+# import customized joint training functions for the descriptor expansion
+import joint_tools as jtools
+
+metal_properties = ['Ec', 'electronegativity X(TM)']
+support_properties = ['Evac', 'electronegativity X(ligand)', 'CN', 'angle']
+Ebind_primary_names = ['Ec', 'Evac', 'delta X', 'CN', 'angle']
+
+
+def candidate_pool(data, metals = None, supports = None):
+
+    '''
+    All (metal, support) pairs not in data
+    metals, supports: dataframes of new metals (metal + metal_properties columns)
+    and new supports (support + support_properties columns), added to the
+    metals and supports found in data
+    return a dataframe with the properties and delta X of each candidate
+    '''
+    metal_table = data[['metal'] + metal_properties].drop_duplicates('metal')
+    support_table = data[['support'] + support_properties].drop_duplicates('support')
+    if metals is not None: metal_table = pd.concat([metal_table, metals[['metal'] + metal_properties]]).drop_duplicates('metal')
+    if supports is not None: support_table = pd.concat([support_table, supports[['support'] + support_properties]]).drop_duplicates('support')
+
+    # every metal on every support, through a constant key (merge(how = 'cross') needs pandas 1.2)
+    pool = metal_table.assign(_key = 0).merge(support_table.assign(_key = 0), on = '_key').drop(columns = '_key')
+    labeled = pd.MultiIndex.from_frame(data[['metal', 'support']])
+    pool = pool[~pd.MultiIndex.from_frame(pool[['metal', 'support']]).isin(labeled)].reset_index(drop = True)
+    pool['delta X'] = pool['electronegativity X(ligand)'] - pool['electronegativity X(TM)']
+
+    return pool
+
+
+class BootstrapEnsemble(object):
+
+    '''
+    Online bootstrap ensemble of the chained Ebind LASSO + DSL model
+    '''
+    def __init__(self, n_members = 50, orders = [1, -1, 0.5, -0.5, 2, -2], Ebind_alpha = None,
+                 Ebind_alphas = np.logspace(0, -3, 20), vif_threshold = 1e3, random_state = 0):
+        self.n_members = n_members
+        self.orders = orders
+        self.Ebind_alpha = Ebind_alpha # None: chosen by LassoCV from Ebind_alphas at the first fit
+        self.Ebind_alphas = Ebind_alphas
+        self.vif_threshold = vif_threshold
+        self.rng = np.random.RandomState(random_state)
+
+    def _descriptors(self, data):
+
+        X_poly, _, _, _ = jtools.expand_union(data, Ebind_primary_names, self.orders)
+        X = X_poly[:, self.columns]
+        X[:, 1:] = (X[:, 1:] - self.mv) / self.sv
+        return X
+
+    def fit(self, data, candidates = None):
+
+        '''
+        Fit all members on the labeled data (Ebind, Ea and the properties)
+        The descriptor columns and their scaling are set here from the labeled
+        data and the candidates, which need no DFT, and kept by add so the warm
+        starts stay valid. Collinear columns are pruned as in conditioning_tools,
+        with hundreds of collinear columns and few labeled points a bootstrap
+        member can take millions of coordinate descent iterations
+        '''
+        descriptor_data = data if candidates is None else pd.concat([data, candidates], ignore_index = True)
+        X_poly, powers, _, secondary_primary = jtools.expand_union(descriptor_data, Ebind_primary_names, self.orders)
+        self.columns = jtools.target_columns(X_poly, powers, secondary_primary, np.arange(len(Ebind_primary_names)))
+        scaler = StandardScaler().fit(X_poly[:, self.columns[1:]])
+        X = X_poly[:, self.columns]
+        X[:, 1:] = scaler.transform(X[:, 1:])
+        kept = ctools.prune_columns(X, self.vif_threshold)
+        self.columns = self.columns[kept]
+        self.mv, self.sv = scaler.mean_[kept[1:] - 1], scaler.scale_[kept[1:] - 1]
+
+        if self.Ebind_alpha is None:
+            lasso_cv = LassoCV(alphas = self.Ebind_alphas, cv = 10, max_iter = int(1e7), tol = 0.001, fit_intercept = False, random_state = 0)
+            self.Ebind_alpha = lasso_cv.fit(self._descriptors(data), np.array(data['Ebind'], dtype = float)).alpha_
+
+        self.members = [Lasso(alpha = self.Ebind_alpha, max_iter = int(1e7), tol = 0.001, fit_intercept = False,
+                              warm_start = True, random_state = 0) for _ in range(self.n_members)]
+        self.data = data.reset_index(drop = True)
+        self.weights = self.rng.poisson(1.0, (self.n_members, len(data))).astype(float)
+        self._refit()
+        return self
+
+    def add(self, new_data):
+
+        '''
+        Incremental update with new DFT results, the new points get their own
+        Poisson counts and every member is refitted from its previous coefficients
+        '''
+        self.data = pd.concat([self.data, new_data], ignore_index = True)
+        self.weights = np.hstack([self.weights, self.rng.poisson(1.0, (self.n_members, len(new_data)))])
+        self._refit()
+        return self
+
+    def _refit(self):
+
+        X = self._descriptors(self.data)
+        Ebind = np.array(self.data['Ebind'], dtype = float)
+        # a member without any point left would have no fit, give it one
+        empty = self.weights.sum(axis = 1) == 0
+        self.weights[empty, self.rng.randint(len(Ebind), size = empty.sum())] = 1.0
+
+        for member, w in zip(self.members, self.weights):
+            member.fit(X, Ebind, sample_weight = w)
+        self.Ebind_coefs = np.stack([member.coef_ for member in self.members], axis = 1)
+
+        # weighted DSL of all members at once, on the DFT Ebind
+        x = Ebind**2 / np.array(self.data['Ec'], dtype = float)
+        y = np.array(self.data['Ea'], dtype = float)
+        sw = self.weights.sum(axis = 1)
+        mx, my = np.dot(self.weights, x) / sw, np.dot(self.weights, y) / sw
+        sxx = np.dot(self.weights, x**2) / sw - mx**2
+        sxy = np.dot(self.weights, x * y) / sw - mx * my
+        self.u1 = sxy / sxx
+        self.u0 = my - self.u1 * mx
+
+    def predict_members(self, candidates):
+
+        '''
+        Ea of each candidate by each member, (members x candidates)
+        The predicted Ebind is clipped to the labeled range, as in the chained
+        mode of train_joint, the inverse powers blow up outside of it
+        '''
+        Ebind = np.dot(self._descriptors(candidates), self.Ebind_coefs).T
+        Ebind = np.clip(Ebind, self.data['Ebind'].min(), self.data['Ebind'].max())
+        return self.u1[:, None] * Ebind**2 / np.array(candidates['Ec'], dtype = float) + self.u0[:, None]
+
+    def residual_variance(self):
+
+        '''
+        Variance of the ensemble mean residuals on the labeled data, the part of
+        the Ea error a new calculation cannot remove
+        '''
+        return np.var(np.array(self.data['Ea'], dtype = float) - self.predict_members(self.data).mean(axis = 0))
+
+
+def acquisition(Ea_mean, Ea_sigma, method = 'variance', Ea_threshold = 1.5, kappa = 1.96):
+
+    '''
+    Score of every candidate, the higher the more informative
+        - variance: the ensemble standard deviation
+        - UCB: upper confidence bound, Ea_mean + kappa * Ea_sigma
+        - straddle: kappa * Ea_sigma - |Ea_mean - Ea_threshold|, candidates
+          both uncertain and close to the stability threshold
+        - misclassification: probability of being on the wrong side of Ea_threshold
+    '''
+    Ea_sigma = np.maximum(Ea_sigma, np.finfo(float).tiny)
+    if method == 'variance': return Ea_sigma
+    if method == 'UCB': return Ea_mean + kappa * Ea_sigma
+    if method == 'straddle': return kappa * Ea_sigma - np.abs(Ea_mean - Ea_threshold)
+    if method == 'misclassification':
+        return norm.sf(np.abs(Ea_mean - Ea_threshold) / Ea_sigma)
+
+    raise ValueError("method must be 'variance', 'UCB', 'straddle' or 'misclassification', got {}".format(method))
+
+
+def propose_batch(Ea_members, batch_size, method = 'variance', noise = 0.0, **acquisition_kwargs):
+
+    '''
+    Greedy batch from the ensemble predictions (members x candidates)
+    After each pick the ensemble covariance is conditioned on observing that
+    candidate with the given noise variance (the mean is kept), one pivoted
+    Cholesky step, so the covariance of all candidates is never formed:
+    memory is members x candidates + batch x candidates
+    return the indices of the candidates in the order picked and their scores
+    '''
+    Ea_mean = Ea_members.mean(axis = 0)
+    A = (Ea_members - Ea_mean) / np.sqrt(len(Ea_members) - 1) # covariance = A^T A
+    variance = np.sum(A**2, axis = 0)
+
+    batch, scores, L = [], [], []
+    for _ in range(min(batch_size, Ea_members.shape[1])):
+        score = acquisition(Ea_mean, np.sqrt(np.maximum(variance, 0)), method, **acquisition_kwargs)
+        score[batch] = -np.inf
+        i = int(np.argmax(score))
+        batch.append(i)
+        scores.append(score[i])
+
+        # covariance column of i conditioned on the previous picks
+        column = np.dot(A.T, A[:, i])
+        for Lk in L: column -= Lk * Lk[i]
+        Li = column / np.sqrt(max(column[i] + noise, np.finfo(float).tiny))
+        L.append(Li)
+        variance = variance - Li**2
+
+    return np.array(batch), np.array(scores)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Utility functions to diagnose and reduce the collinearity of the descriptors
+"""
+
+'''
+The secondary descriptors (Ec, Ec^0.5, Ec^2, ln Ec, ...) and their products
+are highly collinear. One QR factorization with column pivoting gives the
+condition number, the numerical rank, the variance inflation factors (VIF)
+and the near-duplicate pairs. The pivot order also gives the pruning: each
+pivot is the column with the largest residual on the columns picked before
+it, so stopping once that residual is small keeps a well-conditioned subset.
+'''
+
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import linalg
+from sklearn.linear_model import enet_path
+
+
+def pivoted_qr(X):
+
+    '''
+    R factor and pivots of X[:, pivots] = Q R
+    return R (padded with zero rows to features x features when there are
+    fewer samples than features), the pivots and the residual ratio |R_kk|/||x_k||
+    of each pivot, i.e. sqrt(1 - R^2) of the column regressed on the columns
+    pivoted before it
+    '''
+    R_economic, pivots = linalg.qr(X, mode = 'r', pivoting = True)
+    R = np.zeros((X.shape[1], X.shape[1]))
+    R[:min(X.shape)] = R_economic[:X.shape[1]]
+    norms = np.linalg.norm(X, axis = 0)[pivots]
+    ratio = np.abs(np.diag(R)) / np.where(norms > 0, norms, 1.0)
+
+    return R, pivots, ratio
+
+
+def diagnose(X, feature_names = None, intercept_index = 0, rtol = 1e-10, duplicate_tol = 1e-6):
+
+    '''
+    Conditioning diagnostics of the scaled descriptors (intercept column of ones included)
+    return a dictionary with the condition number of the numerically independent
+    columns (the whole matrix is singular when rank < features), the numerical rank, a dataframe of
+    the VIF of each column (inf for columns in the numerical null space) and a
+    dataframe of the column pairs with |correlation| > 1 - duplicate_tol
+    '''
+    X = np.asarray(X, dtype = float)
+    n_features = X.shape[1]
+    if feature_names is None: feature_names = [str(i) for i in range(n_features)]
+    R, pivots, ratio = pivoted_qr(X)
+
+    rank = int(np.sum(ratio > rtol))
+    singular_values = linalg.svdvals(R[:rank, :rank])
+    condition = singular_values[0] / singular_values[-1]
+
+    # VIF_j = ||x_j||^2 [(X_S^T X_S)^-1]_jj on the independent columns S, from R_11^-1
+    vif = np.full(n_features, np.inf)
+    R_inv = linalg.solve_triangular(R[:rank, :rank], np.eye(rank))
+    norms = np.linalg.norm(X, axis = 0)
+    vif[pivots[:rank]] = norms[pivots[:rank]]**2 * np.sum(R_inv**2, axis = 1)
+    vif[intercept_index] = np.nan
+
+    # correlations of the pivoted columns from R^T R = X^T X
+    G = np.dot(R.T, R)
+    d = np.sqrt(np.diag(G))
+    d[d == 0] = 1.0
+    correlation = G / np.outer(d, d)
+    i_dup, j_dup = np.nonzero(np.triu(np.abs(correlation) > 1 - duplicate_tol, k = 1))
+    duplicates = pd.DataFrame({'feature_1': [feature_names[pivots[i]] for i in i_dup],
+                               'feature_2': [feature_names[pivots[j]] for j in j_dup],
+                               'correlation': correlation[i_dup, j_dup]})
+
+    vif_df = pd.DataFrame({'feature': feature_names, 'VIF': vif,
+                           'pivot_order': np.argsort(pivots), 'residual_ratio': ratio[np.argsort(pivots)]})
+
+    return {'condition': condition, 'rank': rank, 'VIF': vif_df, 'duplicates': duplicates}
+
+
+def prune_columns(X, vif_threshold = 1e3, intercept_index = 0, keep = ()):
+
+    '''
+    Columns kept by the pivoted QR: pivots are taken while the residual of the
+    column on the columns picked before it is above 1/sqrt(vif_threshold),
+    i.e. its VIF against those columns is below vif_threshold
+    Duplicate and near-duplicate columns (e.g. Ec_2Ec_-1 = Ec_1) are dropped this way
+    keep: columns kept anyway, e.g. the DSL term
+    return the sorted indices of the kept columns
+    '''
+    _, pivots, ratio = pivoted_qr(np.asarray(X, dtype = float))
+    n_keep = int(np.sum(np.cumprod(ratio**2 >= 1.0 / vif_threshold)))
+    kept = set(pivots[:n_keep]) | {intercept_index} | set(keep)
+
+    return np.array(sorted(kept))
+
+
+def path_iterations(X, y, alphas, l1_ratio = 1.0, columns = None):
+
+    '''
+    Coordinate descent iterations and time of a warm-started LASSO/Enet path,
+    with the same tolerance as the training scripts
+    '''
+    if columns is not None: X = X[:, columns]
+    t0 = time.perf_counter()
+    _, _, _, n_iters = enet_path(X, y, l1_ratio = l1_ratio, alphas = np.sort(alphas)[::-1],
+                                 max_iter = int(1e7), tol = 0.001, return_n_iter = True)
+    return int(np.sum(n_iters)), time.perf_counter() - t0
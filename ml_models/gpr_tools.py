@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Gaussian process regression (GPR) on the primary descriptors
+"""
+
+'''
+The kernel is s2 * (RBF(length_scales) + bias + noise_ratio * I), the bias
+term is a prior on a constant mean. The posterior mean only depends on the
+length scales and the noise ratio, s2 is set by maximum likelihood.
+Cross validation: for a given length scale, one eigendecomposition of the
+kernel of the training set serves every fold and every noise ratio, with
+A = (K + r I)^-1 the errors on the held-out rows T of a fold are
+A_TT^-1 (A (y - m))_T, exactly those of the GP refitted without T and
+centered by m, the mean of y over the training rows of the fold.
+The fitted model keeps its Cholesky factor: new points extend it by a block
+update and batches of candidates are predicted in chunks from it.
+'''
+
+import numpy as np
+from scipy import linalg
+
+
+def rbf_kernel(A, B, length_scales):
+
+    '''
+    exp(-|a - b|^2/2) of the inputs divided by the length scales (one per column, or one for all)
+    '''
+    A = np.asarray(A, dtype = float) / length_scales
+    B = np.asarray(B, dtype = float) / length_scales
+    d2 = np.sum(A**2, axis = 1)[:, None] + np.sum(B**2, axis = 1)[None, :] - 2 * np.dot(A, B.T)
+    return np.exp(-0.5 * np.maximum(d2, 0))
+
+
+def _fold_groups(folds):
+
+    '''
+    Folds grouped by the size of their test set, so each group is solved as one stacked array
+    '''
+    groups = {}
+    for k, (_, test_index) in enumerate(folds):
+        groups.setdefault(len(test_index), []).append(k)
+    return [(np.array(ks), np.array([folds[k][1] for k in ks])) for ks in groups.values()]
+
+
+def gpr_cv(X, y, folds, length_scales_grid, noise_ratios, bias = 1.0):
+
+    '''
+    Cross-validation RMSE of the GP posterior mean for every pair of length
+    scales and noise ratio, in each fold y is centered by its mean over the
+    training rows of the fold, as GPRModel.fit does, so the held-out rows do
+    not leak into the mean
+    folds: (train_index, test_index) pairs on the rows of X
+    return the RMSE (length scales x noise ratios x folds)
+    '''
+    y = np.asarray(y, dtype = float)
+    groups = _fold_groups(folds)
+    # A (y - m 1) = A y - m A 1 with m the training mean of each fold
+    fold_means = np.array([np.mean(y[train_index]) for train_index, _ in folds])
+
+    RMSE = np.zeros((len(length_scales_grid), len(noise_ratios), len(folds)))
+    for li, length_scales in enumerate(length_scales_grid):
+        eigvals, V = np.linalg.eigh(rbf_kernel(X, X, length_scales) + bias)
+        eigvals = np.maximum(eigvals, 0)
+        Vy = np.dot(V.T, y)
+        V1 = np.sum(V, axis = 0)
+        for ri, noise_ratio in enumerate(noise_ratios):
+            A = np.dot(V / (eigvals + noise_ratio), V.T)
+            Ay = np.dot(V, Vy / (eigvals + noise_ratio))
+            A1 = np.dot(V, V1 / (eigvals + noise_ratio))
+            for ks, T in groups:
+                A_TT = A[T[:, :, None], T[:, None, :]]
+                rhs = Ay[T] - fold_means[ks][:, None] * A1[T]
+                error = np.linalg.solve(A_TT, rhs[:, :, None])[:, :, 0]
+                RMSE[li, ri, ks] = np.sqrt(np.mean(error**2, axis = 1))
+
+    return RMSE
+
+
+class GPRModel(object):
+
+    '''
+    GP with a cached Cholesky factor of the training kernel
+    '''
+    def __init__(self, length_scales, noise_ratio, bias = 1.0):
+        self.length_scales = length_scales
+        self.noise_ratio = noise_ratio
+        self.bias = bias
+
+    def _kernel(self, A, B):
+
+        return rbf_kernel(A, B, self.length_scales) + self.bias
+
+    def fit(self, X, y):
+
+        self.X = np.asarray(X, dtype = float)
+        self.y = np.asarray(y, dtype = float)
+        self.y_mean = np.mean(self.y)
+        K = self._kernel(self.X, self.X) + self.noise_ratio * np.eye(len(self.X))
+        self.L = linalg.cholesky(K, lower = True)
+        self._solve()
+        return self
+
+    def add(self, X_new, y_new):
+
+        '''
+        Extend the Cholesky factor with new points, O(n^2 k) instead of
+        refactorizing in O(n^3), the hyperparameters and the mean are kept
+        '''
+        X_new = np.atleast_2d(np.asarray(X_new, dtype = float))
+        L12 = linalg.solve_triangular(self.L, self._kernel(self.X, X_new), lower = True)
+        K22 = self._kernel(X_new, X_new) + self.noise_ratio * np.eye(len(X_new))
+        L22 = linalg.cholesky(K22 - np.dot(L12.T, L12), lower = True)
+
+        n, k = len(self.X), len(X_new)
+        L = np.zeros((n + k, n + k))
+        L[:n, :n], L[n:, :n], L[n:, n:] = self.L, L12.T, L22
+        self.L = L
+        self.X = np.vstack([self.X, X_new])
+        self.y = np.concatenate([self.y, np.atleast_1d(y_new)])
+        self._solve()
+        return self
+
+    def _solve(self):
+
+        self.weights = linalg.cho_solve((self.L, True), self.y - self.y_mean)
+        # maximum likelihood signal variance
+        self.signal_variance = np.dot(self.y - self.y_mean, self.weights) / len(self.y)
+
+    def log_marginal_likelihood(self):
+
+        n = len(self.y)
+        return -0.5 * n * (np.log(2 * np.pi * self.signal_variance) + 1) - np.sum(np.log(np.diag(self.L)))
+
+    def predict(self, X, return_std = False, include_noise = False, chunksize = 10000):
+
+        '''
+        Predictive mean (and standard deviation) of a batch, in chunks of rows
+        so the memory stays at chunksize x training points
+        include_noise: add the noise variance, for the spread of new DFT values
+        '''
+        X = np.atleast_2d(np.asarray(X, dtype = float))
+        mean = np.zeros(len(X))
+        std = np.zeros(len(X))
+        for start in range(0, len(X), chunksize):
+            K_star = self._kernel(X[start:start + chunksize], self.X)
+            mean[start:start + chunksize] = np.dot(K_star, self.weights) + self.y_mean
+            if return_std:
+                v = linalg.solve_triangular(self.L, K_star.T, lower = True)
+                variance = 1 + self.bias - np.sum(v**2, axis = 0) + (self.noise_ratio if include_noise else 0)
+                std[start:start + chunksize] = np.sqrt(self.signal_variance * np.maximum(variance, 0))
+
+        if return_std: return mean, std
+        return mean
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Scaling laws fitted for each group of samples, e.g. one per support or per metal
+"""
+
+'''
+Every model family of validation_tools is fitted on the samples of one group
+only, the groups are dispatched to a worker pool that memory-maps the full
+descriptor matrix and receives the row indices of its group. The hierarchical
+variant shrinks the coefficients of each group towards the pooled (universal)
+coefficients, from fully pooled (lambda -> inf) to separate fits (lambda -> 0).
+The fitted coefficients of all groups are stacked in one array, a batch is
+predicted with one lookup of the row of its group.
+'''
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.linear_model import ElasticNet, Lasso
+
+import validation_tools as vtools
+
+
+class GroupModels(object):
+
+    '''
+    Coefficients of one model family for every group (groups x features),
+    the last row holds the pooled coefficients used for unknown groups
+    '''
+    def __init__(self, group_types, coefs, pooled_coefs = None):
+
+        self.group_types = np.asarray(group_types)
+        self.order = np.argsort(self.group_types, kind = 'mergesort')
+        if pooled_coefs is None: pooled_coefs = np.full(np.shape(coefs)[1], np.nan)
+        self.coefs = np.vstack([coefs, pooled_coefs])
+
+    def group_index(self, groups):
+
+        '''
+        Row of each sample in coefs, the pooled row for unknown groups
+        '''
+        groups = np.asarray(groups)
+        sorted_types = self.group_types[self.order]
+        position = np.clip(np.searchsorted(sorted_types, groups), 0, len(sorted_types) - 1)
+        found = sorted_types[position] == groups
+        return np.where(found, self.order[position], len(self.group_types))
+
+    def predict(self, X, groups):
+
+        X = np.asarray(X, dtype = float)
+        return np.einsum('ij,ij->i', X, self.coefs[self.group_index(groups)])
+
+
+def _fit_rows(X, y, rows, models):
+
+    '''
+    Fit every model on the rows of one group
+    return the coefficients and the leave-one-out residuals of each model,
+    from the hat matrix for OLS/Ridge and from refits for LASSO/Enet
+    '''
+    X_g, y_g = X[rows], y[rows]
+
+    fits = {}
+    for name, spec in models.items():
+
+        family = spec['family']
+        columns = spec.get('columns', None)
+        if columns is None: columns = np.arange(X.shape[1])
+        columns = np.asarray(columns)
+        X_sub = X_g[:, columns]
+
+        coefs = np.zeros(X.shape[1])
+        if family in ['OLS', 'Ridge']:
+            alpha = spec.get('alpha', 0.0) if family == 'Ridge' else 0.0
+            coefs[columns] = vtools.gram_solve(np.dot(X_sub.T, X_sub), np.dot(X_sub.T, y_g), family, alpha)
+            loo_residuals = vtools.loo_ridge_path(X_sub, y_g, [alpha])[1][:, 0]
+
+        elif family in ['LASSO', 'Enet']:
+            l1_ratio = spec.get('l1_ratio', 1.0) if family == 'Enet' else 1.0
+            if family == 'LASSO':
+                estimator = Lasso(alpha = spec['alpha'], max_iter = int(1e7), tol = 0.001, fit_intercept = False,
+                                  random_state = 0)
+            else:
+                estimator = ElasticNet(alpha = spec['alpha'], l1_ratio = l1_ratio, max_iter = int(1e7), tol = 0.001,
+                                       fit_intercept = False, random_state = 0)
+            coefs[columns] = estimator.fit(X_sub, y_g).coef_
+            # groups have fewer samples than active descriptors, where the ALO
+            # approximation breaks down, refit without each sample instead
+            loo_residuals = np.zeros(len(y_g))
+            for i in range(len(y_g)):
+                train = np.arange(len(y_g)) != i
+                loo_residuals[i] = y_g[i] - np.dot(X_sub[i], estimator.fit(X_sub[train], y_g[train]).coef_)
+
+        else:
+            raise ValueError('Unknown model family {}'.format(family))
+
+        fits[name] = (coefs, loo_residuals)
+
+    return fits
+
+
+def fit_groups(X, y, groups, models, pooled_coefs = None, n_jobs = 1, max_nbytes = 0):
+
+    '''
+    Fit each model family independently for every group
+    models: dictionary of model name -> specification, as in vtools.group_cv
+    pooled_coefs: dictionary of model name -> coefficients fitted on all groups,
+    compared with the group fits and used for unknown groups
+    max_nbytes: arrays larger than this are memory-mapped and shared by the
+    workers, 0 shares X whatever its size
+    return a dictionary of model name -> GroupModels and a tidy dataframe with
+    one row per (group, model)
+    '''
+    X = np.asarray(X, dtype = float)
+    y = np.asarray(y, dtype = float)
+    groups = np.asarray(groups)
+    group_types = np.unique(groups)
+    group_rows = [np.flatnonzero(groups == gi) for gi in group_types]
+    if pooled_coefs is None: pooled_coefs = {}
+
+    fits = Parallel(n_jobs = n_jobs, max_nbytes = max_nbytes)(
+        delayed(_fit_rows)(X, y, rows, models) for rows in group_rows)
+
+    group_models = {}
+    for name in models:
+        coefs = np.array([fit_g[name][0] for fit_g in fits])
+        group_models[name] = GroupModels(group_types, coefs, pooled_coefs.get(name, None))
+
+    rows = []
+    for gi, rows_g, fit_g in zip(group_types, group_rows, fits):
+        for name, (coefs, loo_residuals) in fit_g.items():
+            pooled_g = pooled_coefs.get(name, None)
+            rows.append({'group': gi,
+                         'model': name,
+                         'n': len(rows_g),
+                         'n_nonzero': np.count_nonzero(coefs),
+                         'RMSE_fit': np.sqrt(np.mean((y[rows_g] - np.dot(X[rows_g], coefs))**2)),
+                         'LOO_RMSE': np.sqrt(np.mean(loo_residuals**2)),
+                         'pooled_RMSE': np.nan if pooled_g is None else
+                                        np.sqrt(np.mean((y[rows_g] - np.dot(X[rows_g], pooled_g))**2))})
+
+    return group_models, pd.DataFrame(rows)
+
+
+def hierarchical_fit(X, y, groups, pooled_coefs, lambdas, columns = None):
+
+    '''
+    Group coefficients shrunk towards the pooled ones,
+    w_g = argmin ||y_g - X_g w||^2 + lambda ||w - w_pooled||^2
+    solved on the residuals of the pooled model, so each group is a Ridge fit
+    whose exact leave-one-out residuals give the lambda with the lowest LOO
+    error over all groups (the pooled coefficients are kept fixed)
+    columns: descriptors allowed to vary by group, e.g. [0, term_index] for the DSL
+    return the GroupModels at the best lambda, the best lambda, the LOO RMSE path
+    and the LOO residuals at the best lambda
+    '''
+    X = np.asarray(X, dtype = float)
+    y = np.asarray(y, dtype = float)
+    groups = np.asarray(groups)
+    pooled_coefs = np.asarray(pooled_coefs, dtype = float)
+    lambdas = np.atleast_1d(np.asarray(lambdas, dtype = float))
+    if columns is None: columns = np.arange(X.shape[1])
+    columns = np.asarray(columns)
+    group_types = np.unique(groups)
+
+    residuals = y - np.dot(X, pooled_coefs)
+    loo_residuals = np.zeros((len(y), len(lambdas)))
+    for gi in group_types:
+        rows = groups == gi
+        loo_residuals[rows] = vtools.loo_ridge_path(X[rows][:, columns], residuals[rows], lambdas)[1]
+    loo_path = np.sqrt(np.mean(loo_residuals**2, axis = 0))
+    best_index = np.argmin(loo_path)
+
+    coefs = np.tile(pooled_coefs, (len(group_types), 1))
+    for k, gi in enumerate(group_types):
+        X_g = X[groups == gi][:, columns]
+        coefs[k, columns] += vtools.gram_solve(np.dot(X_g.T, X_g), np.dot(X_g.T, residuals[groups == gi]),
+                                               'Ridge', lambdas[best_index])
+
+    return GroupModels(group_types, coefs, pooled_coefs), lambdas[best_index], loo_path, loo_residuals[:, best_index]
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Hyperparameter search across the model families
+"""
+
+'''
+Trials from a declared search space are dispatched to a process pool by an
+asyncio scheduler. Successive halving prunes unpromising trials early: every
+trial is first scored on a few cross-validation folds, and only the best
+1/eta of each family are scored on more folds, up to all of them.
+Fold scores are written to a local SQLite store as they arrive, so a
+search can be queried while running and resumed without refitting. The
+study name carries a hash of the data, the folds and the seed root, so
+cached fold scores are only reused for the same inputs
+'''
+
+import asyncio
+import hashlib
+import itertools
+import json
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.linear_model import ElasticNet, Lasso, Ridge
+
+import seed_tools as sdtools
+
+# data shared by the worker processes, set once per worker by _init_worker
+_worker_data = {}
+
+
+def _init_worker(X, y, X_primary, folds, seeds):
+
+    _worker_data.update({'X': X, 'y': y, 'X_primary': X_primary, 'folds': folds, 'seeds': seeds})
+
+
+def _make_estimator(family, params, random_state = 0):
+
+    if family == 'LASSO':
+        return Lasso(max_iter = int(1e7), tol = 0.001, fit_intercept = False, random_state = random_state, **params)
+    if family == 'Ridge':
+        return Ridge(fit_intercept = False, **params)
+    if family == 'Enet':
+        return ElasticNet(max_iter = int(1e7), tol = 0.001, fit_intercept = False, random_state = random_state, **params)
+    if family == 'GP':
+        # optional dependency, only needed for genetic programming trials
+        from gplearn.genetic import SymbolicRegressor
+        return SymbolicRegressor(metric = 'rmse', random_state = random_state, n_jobs = 1, **params)
+
+    raise ValueError('Unknown model family {}'.format(family))
+
+
+def evaluate_folds(family, params, fold_indices):
+
+    '''
+    Test RMSE of one trial on the given folds, run in a worker process
+    GP trials use the primary descriptors, the others the scaled descriptors
+    '''
+    X = _worker_data['X_primary'] if family == 'GP' else _worker_data['X']
+    y = _worker_data['y']
+
+    RMSEs = []
+    for fi in fold_indices:
+        train_index, test_index = _worker_data['folds'][fi]
+        if family == 'GP':
+            # the seed of a trial fold does not depend on the worker that runs it,
+            # the linear families are deterministic and keep the default
+            param_keys = [ki for name in sorted(params) for ki in (name, params[name])]
+            estimator = _make_estimator(family, params, _worker_data['seeds'].seed(family, *param_keys + ['fold', fi]))
+        else:
+            estimator = _make_estimator(family, params)
+        estimator.fit(X[train_index], y[train_index])
+        RMSEs.append(np.sqrt(np.mean((estimator.predict(X[test_index]) - y[test_index])**2)))
+
+    return RMSEs
+
+
+def expand_space(search_space):
+
+    '''
+    Cartesian product of the values declared for each parameter
+    search_space: dictionary of family -> dictionary of parameter -> list of values
+    return a list of (family, params) trials
+    '''
+    trials = []
+    for family, space in search_space.items():
+        names = sorted(space)
+        for values in itertools.product(*[space[ni] for ni in names]):
+            # numpy scalars are not json serializable
+            trials.append((family, {ni: np.asarray(vi).item() for ni, vi in zip(names, values)}))
+
+    return trials
+
+
+def study_name(study, X, y, folds, X_primary = None, random_state = 0):
+
+    '''
+    Name of a study in the store, the given name and a hash of everything a
+    fold score depends on besides the trial: X, y, X_primary, the folds and
+    the seed tree
+    '''
+    digest = hashlib.sha256()
+    for array in [X, y, X_primary]:
+        if array is None: continue
+        array = np.ascontiguousarray(array, dtype = float)
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    for train_index, test_index in folds:
+        digest.update(np.asarray(train_index, dtype = np.int64).tobytes() + b'|')
+        digest.update(np.asarray(test_index, dtype = np.int64).tobytes() + b'/')
+    digest.update(repr(sdtools.check_seeds(random_state)).encode())
+
+    return '{}-{}'.format(study, digest.hexdigest()[:16])
+
+
+def open_store(filename):
+
+    '''
+    Open (or create) the SQLite trial store
+    '''
+    connection = sqlite3.connect(filename)
+    connection.executescript('''
+        CREATE TABLE IF NOT EXISTS trials (
+            trial_id INTEGER PRIMARY KEY,
+            study TEXT, family TEXT, params TEXT,
+            status TEXT, n_folds INTEGER, RMSE REAL,
+            UNIQUE (study, family, params));
+        CREATE TABLE IF NOT EXISTS fold_results (
+            trial_id INTEGER, fold INTEGER, RMSE REAL, seconds REAL,
+            PRIMARY KEY (trial_id, fold));
+        ''')
+    return connection
+
+
+def _trial_id(connection, study, family, params):
+
+    key = json.dumps(params, sort_keys = True)
+    connection.execute('INSERT OR IGNORE INTO trials (study, family, params, status, n_folds) VALUES (?, ?, ?, ?, 0)',
+                       (study, family, key, 'running'))
+    return connection.execute('SELECT trial_id FROM trials WHERE study = ? AND family = ? AND params = ?',
+                              (study, family, key)).fetchone()[0]
+
+
+def _fold_scores(connection, trial_id):
+
+    return dict(connection.execute('SELECT fold, RMSE FROM fold_results WHERE trial_id = ?', (trial_id,)).fetchall())
+
+
+async def _run_trial(loop, pool, connection, trial_id, family, params, budget):
+
+    '''
+    Score a trial on the first budget folds, only the folds not yet in the store are fitted
+    '''
+    done = _fold_scores(connection, trial_id)
+    todo = [fi for fi in range(budget) if fi not in done]
+    if todo:
+        t0 = time.perf_counter()
+        RMSEs = await loop.run_in_executor(pool, evaluate_folds, family, params, todo)
+        seconds = (time.perf_counter() - t0) / len(todo)
+        connection.executemany('INSERT OR REPLACE INTO fold_results VALUES (?, ?, ?, ?)',
+                               [(trial_id, fi, ri, seconds) for fi, ri in zip(todo, RMSEs)])
+        done.update(zip(todo, RMSEs))
+
+    RMSE = np.mean([done[fi] for fi in range(budget)])
+    connection.execute('UPDATE trials SET n_folds = ?, RMSE = ? WHERE trial_id = ?', (budget, RMSE, trial_id))
+    connection.commit()
+
+    return RMSE
+
+
+async def _successive_halving(loop, pool, connection, study, trials, n_folds, min_folds, eta):
+
+    trial_ids = [_trial_id(connection, study, family, params) for family, params in trials]
+    # statuses of an earlier search of the same study are decided again
+    connection.executemany('UPDATE trials SET status = ? WHERE trial_id = ?', [('running', ti) for ti in trial_ids])
+    connection.commit()
+    alive = list(range(len(trials)))
+    budget = min(min_folds, n_folds)
+
+    while True:
+        RMSEs = await asyncio.gather(*[_run_trial(loop, pool, connection, trial_ids[ti], trials[ti][0], trials[ti][1], budget)
+                                       for ti in alive])
+        if budget >= n_folds: break
+
+        # keep the best 1/eta of the trials for the next rung
+        n_keep = max(1, len(alive) // eta)
+        keep = np.argsort(RMSEs, kind = 'mergesort')[:n_keep]
+        pruned = [trial_ids[alive[i]] for i in set(range(len(alive))) - set(keep)]
+        connection.executemany('UPDATE trials SET status = ? WHERE trial_id = ?', [('pruned', ti) for ti in pruned])
+        alive = [alive[i] for i in keep]
+        # a single survivor goes straight to the full budget
+        budget = n_folds if len(alive) == 1 else min(budget * eta, n_folds)
+
+    connection.executemany('UPDATE trials SET status = ? WHERE trial_id = ?', [('complete', trial_ids[ti]) for ti in alive])
+    connection.commit()
+
+
+async def _search(search_space, X, y, folds, X_primary, store, study, min_folds, eta, n_jobs, seeds):
+
+    loop = asyncio.get_event_loop()
+    connection = open_store(store)
+    trials = expand_space(search_space)
+
+    with ProcessPoolExecutor(max_workers = n_jobs, initializer = _init_worker,
+                             initargs = (X, y, X_primary, folds, seeds)) as pool:
+        # families are halved independently, their RMSEs are not ranked together
+        await asyncio.gather(*[
+            _successive_halving(loop, pool, connection, study, [ti for ti in trials if ti[0] == family],
+                                len(folds), min_folds, eta)
+            for family in search_space])
+
+    connection.close()
+
+
+def run_search(search_space, X, y, folds, X_primary = None, store = 'hyperparameter_search.db',
+               study = 'default', min_folds = 5, eta = 3, n_jobs = None, random_state = 0):
+
+    '''
+    Run a successive-halving search over all families in search_space
+    folds: list of (train_index, test_index), e.g. list(rkf.split(X_train))
+    X_primary: primary descriptors for the GP family
+    random_state: integer or SeedTree, each GP (trial, fold) gets its own seed
+    study: the trials are stored under study_name(study, ...), a change of the
+    data, folds or seeds starts a new study instead of reusing stale fold scores
+    return the best trial of each family of search_space read back from the store
+    '''
+    seeds = sdtools.check_seeds(random_state)
+    study = study_name(study, X, y, folds, X_primary, seeds)
+    asyncio.run(_search(search_space, X, y, folds, X_primary, store, study, min_folds, eta, n_jobs, seeds))
+
+    return best_trials(store, study, search_space)
+
+
+def best_trials(store, study, search_space = None):
+
+    '''
+    Best fully evaluated trial of each family
+    study: full study name, as returned by study_name
+    search_space: only consider the trials of this space, not those left in the
+    store by earlier searches of the same study with another grid
+    return a dictionary of family -> (params, CV RMSE)
+    '''
+    connection = open_store(store)
+    rows = connection.execute('''
+        SELECT family, params, RMSE FROM trials
+        WHERE study = ? AND status = 'complete' ORDER BY RMSE''', (study,)).fetchall()
+    connection.close()
+
+    if search_space is not None:
+        current = set((family, json.dumps(params, sort_keys = True)) for family, params in expand_space(search_space))
+        rows = [ri for ri in rows if (ri[0], ri[1]) in current]
+
+    best = {}
+    for family, params, RMSE in rows:
+        if family not in best: best[family] = (json.loads(params), RMSE)
+    return best
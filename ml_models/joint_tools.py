@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Utility functions to train Ebind and Ea on one shared feature pipeline
+"""
+
+'''
+The union of the primary descriptors of both targets is expanded, scaled and
+split into folds once. Each target uses the columns built only from its own
+primary descriptors, and all targets share the Gram matrix of the union:
+    - Ridge/OLS: one eigendecomposition per fold and column set serves every
+      alpha and every target using that column set
+    - LASSO/Enet: one Gram matrix per fold, sub-blocks passed as precompute
+Ebind and Ea have different column sets, so this is not one multi-output
+solve: each fold runs one solve per target. A shared column set would give
+Ea the Ebind descriptors and Ebind its own value as a descriptor. The Ea
+columns can be taken by name (columns_by_name) to match train_Ea.py exactly
+In chained mode the Ebind predicted by its model replaces the DFT Ebind
+in the descriptors of the Ea model
+'''
+
+import numpy as np
+from sklearn.linear_model import ElasticNet, enet_path
+from sklearn.preprocessing import PolynomialFeatures, StandardScaler
+
+
+def expand_union(data, primary_names, orders):
+
+    '''
+    Secondary descriptors of every primary descriptor (orders and natural log,
+    as transformers in the training scripts) and their pairwise products
+    return the expanded matrix, the PolynomialFeatures powers, the secondary
+    names and the primary index of each secondary descriptor
+    '''
+    orders_log = list(orders) + ['ln']
+    x_secondary, secondary_names, secondary_primary = [], [], []
+    for pi, name in enumerate(primary_names):
+        xv = np.array(data[name], dtype = float)
+        for oi in orders_log:
+            x_secondary.append(np.log(xv) if oi == 'ln' else xv**oi)
+            secondary_names.append(name + '_' + str(oi))
+            secondary_primary.append(pi)
+
+    poly = PolynomialFeatures(2, interaction_only = True)
+    X_poly = poly.fit_transform(np.stack(x_secondary, axis = 1))
+
+    return X_poly, poly.powers_, secondary_names, np.array(secondary_primary)
+
+
+def feature_names(powers, secondary_names):
+
+    '''
+    Descriptor names in the format of the training scripts, e.g. Ec_-1Ebind_2
+    '''
+    return ['1'] + [''.join([secondary_names[si] for si in np.nonzero(pi)[0]]) for pi in powers[1:]]
+
+
+def target_columns(X_poly, powers, secondary_primary, primary_index):
+
+    '''
+    Columns built only from the given primary descriptors (and the intercept),
+    without constant columns such as Ec_1Ec_-1 and exact duplicates
+    such as Ec_2Ec_-1 = Ec_1
+    '''
+    allowed = np.isin(secondary_primary, primary_index)
+    candidates = [ci for ci, pi in enumerate(powers) if np.all(allowed[pi > 0])]
+
+    columns, seen = [], set()
+    for ci in candidates:
+        xi = X_poly[:, ci]
+        if ci > 0 and np.ptp(xi) <= 1e-12 * max(1.0, np.abs(xi).max()): continue
+        key = np.round(xi / np.abs(xi).max(), 10).tobytes()
+        if key in seen: continue
+        seen.add(key)
+        columns.append(ci)
+
+    return np.array(columns)
+
+
+def columns_by_name(names, descriptors):
+
+    '''
+    Columns of the union with the given descriptor names, in their order,
+    e.g. the descriptors exported by a training script
+    '''
+    missing = [di for di in descriptors if di not in names]
+    if missing: raise KeyError('Descriptors not in the union {}'.format(missing))
+
+    return np.array([names.index(di) for di in descriptors])
+
+
+def scale_union(X_poly):
+
+    '''
+    Standardize every column but the intercept once, the scaling of a column
+    does not depend on the other columns, so each target can take a subset
+    '''
+    scaler = StandardScaler().fit(X_poly[:, 1:])
+    X = X_poly.copy()
+    X[:, 1:] = scaler.transform(X_poly[:, 1:])
+
+    return X, scaler.mean_, scaler.scale_
+
+
+def _group_targets(column_sets):
+
+    '''
+    Targets sharing the same column set are solved together
+    '''
+    groups = {}
+    for ti, columns in enumerate(column_sets):
+        groups.setdefault(tuple(columns), []).append(ti)
+    return groups
+
+
+def joint_ridge_cv(X, Y, column_sets, alphas, folds, rcond = 1e-10):
+
+    '''
+    Cross-validated Ridge path of all targets, alpha = 0 gives minimum norm OLS
+    Each fold uses the union Gram downdated by its test rows, and one
+    eigendecomposition per column set for all alphas and targets
+    return the test RMSE path (targets x alphas x folds)
+    '''
+    Y = np.reshape(Y, (len(Y), -1))
+    alphas = np.asarray(alphas, dtype = float)
+    G = np.dot(X.T, X)
+    B = np.dot(X.T, Y)
+    groups = _group_targets(column_sets)
+
+    RMSE_path = np.zeros((Y.shape[1], len(alphas), len(folds)))
+    for k, (_, test_index) in enumerate(folds):
+
+        X_test = X[test_index]
+        G_train = G - np.dot(X_test.T, X_test)
+        B_train = B - np.dot(X_test.T, Y[test_index])
+
+        for columns, targets in groups.items():
+            columns = np.array(columns)
+            eigvals, V = np.linalg.eigh(G_train[np.ix_(columns, columns)])
+            VtB = np.dot(V.T, B_train[np.ix_(columns, targets)])
+            for ai, alpha in enumerate(alphas):
+                denominator = eigvals + alpha
+                inverse = np.where(np.abs(denominator) > rcond * eigvals.max(), 1/denominator, 0.0)
+                W = np.dot(V, inverse[:, None] * VtB)
+                error = np.dot(X_test[:, columns], W) - Y[np.ix_(test_index, targets)]
+                RMSE_path[targets, ai, k] = np.sqrt(np.mean(error**2, axis = 0))
+
+    return RMSE_path
+
+
+def joint_ridge_fit(X, Y, column_sets, alphas, rcond = 1e-10):
+
+    '''
+    Ridge (alpha > 0) or minimum norm OLS (alpha = 0) fit of all targets
+    alphas: one alpha per target
+    return the coefficients (features x targets), zero outside each column set
+    '''
+    Y = np.reshape(Y, (len(Y), -1))
+    G = np.dot(X.T, X)
+    B = np.dot(X.T, Y)
+
+    coefs = np.zeros((X.shape[1], Y.shape[1]))
+    for columns, targets in _group_targets(column_sets).items():
+        columns = np.array(columns)
+        eigvals, V = np.linalg.eigh(G[np.ix_(columns, columns)])
+        VtB = np.dot(V.T, B[np.ix_(columns, targets)])
+        for ti, VtB_i in zip(targets, VtB.T):
+            denominator = eigvals + alphas[ti]
+            inverse = np.where(np.abs(denominator) > rcond * eigvals.max(), 1/denominator, 0.0)
+            coefs[columns, ti] = np.dot(V, inverse * VtB_i)
+
+    return coefs
+
+
+def joint_enet_cv(X, Y, column_sets, alphas, folds, l1_ratio = 1.0):
+
+    '''
+    Cross-validated LASSO (l1_ratio = 1) or Enet path of all targets
+    Each fold computes the union Gram once, every target takes its sub-block
+    and runs a warm-started path over the alphas
+    return the test RMSE path (targets x alphas x folds)
+    '''
+    Y = np.reshape(Y, (len(Y), -1))
+    alphas = np.sort(np.asarray(alphas, dtype = float))[::-1]
+    G = np.dot(X.T, X)
+
+    RMSE_path = np.zeros((Y.shape[1], len(alphas), len(folds)))
+    for k, (train_index, test_index) in enumerate(folds):
+
+        X_test = X[test_index]
+        G_train = G - np.dot(X_test.T, X_test)
+
+        for ti, columns in enumerate(column_sets):
+            X_train_i = X[np.ix_(train_index, columns)]
+            y_train_i = Y[train_index, ti]
+            _, coefs, _ = enet_path(X_train_i, y_train_i, l1_ratio = l1_ratio, alphas = alphas,
+                                    precompute = np.ascontiguousarray(G_train[np.ix_(columns, columns)]),
+                                    Xy = np.dot(X_train_i.T, y_train_i), max_iter = int(1e7), tol = 0.001)
+            error = np.dot(X_test[:, columns], coefs) - Y[test_index, ti][:, None]
+            RMSE_path[ti, :, k] = np.sqrt(np.mean(error**2, axis = 0))
+
+    return RMSE_path, alphas
+
+
+def joint_enet_fit(X, Y, column_sets, alphas, l1_ratio = 1.0):
+
+    '''
+    LASSO/Enet fit of all targets sharing one Gram matrix
+    return the coefficients (features x targets), zero outside each column set
+    '''
+    Y = np.reshape(Y, (len(Y), -1))
+    G = np.dot(X.T, X)
+
+    coefs = np.zeros((X.shape[1], Y.shape[1]))
+    for ti, columns in enumerate(column_sets):
+        estimator = ElasticNet(alpha = alphas[ti], l1_ratio = l1_ratio, precompute = np.ascontiguousarray(G[np.ix_(columns, columns)]),
+                               max_iter = int(1e7), tol = 0.001, fit_intercept = False, random_state = 0)
+        estimator.fit(X[:, columns], Y[:, ti])
+        coefs[columns, ti] = estimator.coef_
+
+    return coefs
+
+
+def chained_features(data, Ebind_predicted, primary_names, orders, mv, sv, columns, Ebind_name = 'Ebind', Ebind_bounds = None):
+
+    '''
+    Scaled descriptors of the Ea model with the DFT Ebind replaced by the
+    predicted one, using the scaling of the union
+    Ebind_bounds: (min, max) the predicted Ebind is clipped to, e.g. the DFT
+    range, negative predictions have no log or square root
+    '''
+    data_chained = {name: np.array(data[name], dtype = float) for name in primary_names}
+    data_chained[Ebind_name] = np.asarray(Ebind_predicted, dtype = float)
+    if Ebind_bounds is not None:
+        data_chained[Ebind_name] = np.clip(data_chained[Ebind_name], *Ebind_bounds)
+
+    X_poly, _, _, _ = expand_union(data_chained, primary_names, orders)
+    X = X_poly.copy()
+    X[:, 1:] = (X_poly[:, 1:] - mv) / sv
+
+    return X[:, columns]
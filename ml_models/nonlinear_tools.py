@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Nonlinear model families (random forest, gradient boosting, kernel ridge)
+on the cross-validation folds of the linear scaling laws
+"""
+
+'''
+Every (parameters, fold) pair of a grid is one task, the tasks run in
+parallel and each one gets its seed from the SeedTree, so the CV errors do
+not depend on the number of workers. Random forests also grow their trees in
+parallel when refitted on the training set (gradient boosting is sequential
+in its trees). prediction_throughput times the prediction of a large batch,
+to put the accuracy of each model next to its screening speed.
+'''
+
+import time
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.ensemble import GradientBoostingRegressor, RandomForestRegressor
+from sklearn.kernel_ridge import KernelRidge
+
+import hyperparameter_search as hsearch
+import seed_tools as sdtools
+
+
+def make_estimator(family, params, random_state = 0, n_jobs = 1):
+
+    '''
+    n_jobs: trees grown in parallel by the random forest
+    '''
+    if family == 'RF':
+        return RandomForestRegressor(random_state = random_state, n_jobs = n_jobs, **params)
+    if family == 'GBM':
+        return GradientBoostingRegressor(random_state = random_state, **params)
+    if family == 'KRR':
+        return KernelRidge(kernel = 'rbf', **params)
+
+    raise ValueError('Unknown model family {}'.format(family))
+
+
+def _param_keys(params):
+
+    return [ki for name in sorted(params) for ki in (name, params[name])]
+
+
+def _fold_RMSE(family, params, X, y, train_index, test_index, random_state):
+
+    estimator = make_estimator(family, params, random_state)
+    estimator.fit(X[train_index], y[train_index])
+    return np.sqrt(np.mean((estimator.predict(X[test_index]) - y[test_index])**2))
+
+
+def cv_grid(family, param_grid, X, y, folds, random_state = 0, n_jobs = 1):
+
+    '''
+    Cross-validation RMSE of every parameter set of the grid
+    param_grid: dictionary of parameter -> list of values
+    folds: (train_index, test_index) pairs, e.g. list(rkf.split(X_train))
+    random_state: integer or SeedTree, each (parameters, fold) gets its own seed
+    return the list of parameter sets and the RMSE (parameter sets x folds)
+    '''
+    X = np.asarray(X, dtype = float)
+    y = np.asarray(y, dtype = float)
+    seeds = sdtools.check_seeds(random_state)
+    params_list = [params for _, params in hsearch.expand_space({family: param_grid})]
+
+    RMSE = Parallel(n_jobs = n_jobs)(
+        delayed(_fold_RMSE)(family, params, X, y, train_index, test_index,
+                            seeds.seed(family, *_param_keys(params) + ['fold', k]))
+        for params in params_list for k, (train_index, test_index) in enumerate(folds))
+
+    return params_list, np.reshape(RMSE, (len(params_list), len(folds)))
+
+
+def fit_best(family, params_list, RMSE, X, y, random_state = 0, n_jobs = 1):
+
+    '''
+    Refit the parameter set with the lowest mean CV MSE on the training set
+    return the estimator and its parameters
+    '''
+    params = params_list[int(np.argmin(np.mean(RMSE**2, axis = 1)))]
+    seeds = sdtools.check_seeds(random_state)
+    estimator = make_estimator(family, params, seeds.seed(family, *_param_keys(params) + ['full']), n_jobs)
+    return estimator.fit(X, y), params
+
+
+def prediction_throughput(predict, inputs, n_rows = 100000, repeats = 3):
+
+    '''
+    Rows predicted per second, best of repeats on a batch of n_rows built by
+    tiling the inputs (an array, or a dictionary of arrays for the descriptor
+    based models)
+    '''
+    if isinstance(inputs, dict):
+        batch = {ki: np.resize(np.asarray(vi), n_rows) for ki, vi in inputs.items()}
+    else:
+        inputs = np.asarray(inputs)
+        batch = inputs[np.arange(n_rows) % len(inputs)]
+
+    seconds = np.inf
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        predict(batch)
+        seconds = min(seconds, time.perf_counter() - t0)
+    return n_rows / seconds
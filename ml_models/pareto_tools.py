@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Accuracy-complexity Pareto archive of the regression models
+"""
+
+'''
+Models are inserted one at a time, e.g. every alpha of a LASSO path, and only
+the non-dominated ones are kept: the front is sorted by complexity (number of
+nonzero terms) with strictly decreasing error. Models are interned by a key,
+the packed bits of their support for sparse models, so a support selected at
+several alphas is stored once with its best error.
+'''
+
+import bisect
+
+import numpy as np
+import pandas as pd
+
+
+def support_key(coefs):
+
+    '''
+    Packed bits of the nonzero coefficients, 12 bytes for 91 descriptors
+    '''
+    return np.packbits(np.asarray(coefs) != 0).tobytes()
+
+
+class ParetoArchive(object):
+
+    '''
+    Incrementally updated accuracy-complexity front
+    '''
+    def __init__(self, rtol = 1e-9):
+        self.rtol = rtol # errors closer than rtol are not an improvement
+        self.front = []  # (complexity, error, key) sorted by complexity
+        self.complexities = []
+        self.items = {}  # key -> description of the model, for the models on the front only
+
+    def update(self, complexity, error, key, item = None):
+
+        '''
+        Insert one model
+        return True if it is on the front
+        '''
+        if not np.isfinite(error): return False
+        position = bisect.bisect_left(self.complexities, complexity)
+        tolerance = error * (1 + self.rtol)
+        if position > 0 and self.front[position - 1][1] <= tolerance: return False
+        if (position < len(self.front) and self.front[position][0] == complexity
+                and self.front[position][1] <= tolerance): return False
+
+        end = position
+        while end < len(self.front) and self.front[end][1] >= error * (1 - self.rtol): end += 1
+        for _, _, ki in self.front[position:end]:
+            self.items.pop(ki, None)
+
+        self.front[position:end] = [(complexity, float(error), key)]
+        self.complexities[position:end] = [complexity]
+        self.items[key] = item
+        return True
+
+    def to_frame(self):
+
+        '''
+        The front as a dataframe, one row per model, the item dictionaries as columns
+        '''
+        rows = []
+        for complexity, error, key in self.front:
+            row = {'complexity': complexity, 'error': error}
+            row.update(self.items[key] or {})
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def best(self, max_complexity):
+
+        '''
+        Most accurate model with at most max_complexity terms
+        '''
+        position = bisect.bisect_right(self.complexities, max_complexity)
+        if position == 0: return None
+        complexity, error, key = self.front[position - 1]
+        return complexity, error, self.items[key]
+
+
+def update_from_path(archive, results, model_name, l1_ratio = 1.0, feature_names = None):
+
+    '''
+    Insert every alpha of a LASSO/Enet path, the support comes from the path
+    fitted on the whole training set and the error is the cross-validation RMSE,
+    the square root of the test MSE averaged over the folds as for the subsets
+    results: rtools.PathResults from cal_path with X_train and y_train, so that
+    full_coefs holds the coefficients of every alpha
+    l1_ratio: the l1_ratio the path was computed with, recorded with the models
+    return the number of models put on the front
+    '''
+    if not np.any(results.full_coefs):
+        raise ValueError('The path has no full_coefs, run cal_path with X_train and y_train')
+    CV_RMSE = np.sqrt(np.mean(results.RMSE_test**2, axis = 0))
+
+    n_front = 0
+    for ai, coefs in enumerate(results.full_coefs):
+        support = np.flatnonzero(coefs)
+        item = {'model': model_name, 'alpha': results.alphas[ai], 'l1_ratio': l1_ratio,
+                'terms': ' '.join(feature_names[si] for si in support) if feature_names is not None else support.tolist()}
+        n_front += archive.update(len(support), CV_RMSE[ai], (model_name, support_key(coefs)), item)
+
+    return n_front
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Local HTTP prediction server for the scaling laws
+"""
+
+'''
+The exported Ea and Ebind models are loaded once at startup.
+Incoming requests are queued and gathered into micro-batches, so each model
+is evaluated once per batch with vectorized numpy.
+
+Usage:
+    python prediction_server.py --port 8000
+
+    POST /predict  {"model": "Ea_DSL", "inputs": {"Ec": [4.09, 2.96], "Ebind": [4.26, 2.64]}}
+               ->  {"prediction": [...]}
+    GET  /models   available models and their primary descriptors
+    GET  /metrics  p50/p99 latency and throughput
+'''
+
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import screening_tools as stools
+
+# Exported coefficient files and the primary descriptors of their models
+model_files = {'Ea': ('coefficient_unnormalized.csv', ['Ec', 'Ebind']),
+               'Ebind': ('coefficient_Ebind_unnormalized.csv', ['Ec', 'Evac', 'delta X', 'CN', 'angle'])}
+
+
+def load_models(model_dir):
+
+    '''
+    Load every exported model, named target_method, e.g. Ea_DSL or Ebind_LASSO
+    The full precision binary sidecar is read when it matches the csv, the rounded csv otherwise
+    return a dictionary of model name -> (descriptors, coefficients, primary names, (powers, logs))
+    '''
+    models = {}
+    for target, (filename, primary_names) in model_files.items():
+        filename = os.path.join(model_dir, filename)
+        if stools.sidecar_is_current(filename):
+            target_models, primary_names = stools.load_sidecar(filename)
+        elif os.path.exists(filename):
+            target_models = {mi: (descriptors, coefs) + stools.descriptor_exponents(descriptors, primary_names)
+                             for mi, (descriptors, coefs) in stools.load_coefficients(filename).items()}
+        else:
+            continue
+        for method, (descriptors, coefs, powers, logs) in target_models.items():
+            models[target + '_' + method] = (descriptors, coefs, primary_names, (powers, logs))
+
+    return models
+
+
+class PredictionRequest(object):
+
+    '''
+    One queued request, completed by the batching thread
+    '''
+    def __init__(self, model, inputs):
+        self.model = model
+        self.inputs = inputs
+        self.n = len(inputs[next(iter(inputs))])
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher(object):
+
+    '''
+    Gather queued requests into batches of up to max_batch_size candidates,
+    waiting at most max_wait seconds after the first request of a batch
+    '''
+    def __init__(self, models, max_batch_size = 4096, max_wait = 0.001, n_latencies = 100000):
+        self.models = models
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen = n_latencies)
+        self.n_requests = 0
+        self.n_items = 0
+        self.n_batches = 0
+        self.t_start = time.perf_counter()
+
+        self.thread = threading.Thread(target = self._run, daemon = True)
+        self.thread.start()
+
+    def predict(self, model, inputs):
+
+        '''
+        Queue a request and block until its batch has been evaluated
+        '''
+        if model not in self.models:
+            raise KeyError('Unknown model {}'.format(model))
+        if not isinstance(inputs, dict):
+            raise TypeError('inputs must map each descriptor to its values, got {}'.format(type(inputs).__name__))
+        primary_names = self.models[model][2]
+        missing = [pi for pi in primary_names if pi not in inputs]
+        if missing:
+            raise KeyError('Missing descriptors {}'.format(missing))
+
+        # checked before queueing, a bad request must not reach the batch of others
+        inputs = {pi: np.atleast_1d(np.asarray(inputs[pi], dtype = float)) for pi in primary_names}
+        lengths = {pi: len(xi) for pi, xi in inputs.items()}
+        if any(xi.ndim != 1 for xi in inputs.values()) or len(set(lengths.values())) != 1:
+            raise ValueError('Descriptors must be 1d arrays of the same length, got {}'.format(lengths))
+
+        t0 = time.perf_counter()
+        request = PredictionRequest(model, inputs)
+        self.requests.put(request)
+        request.done.wait()
+
+        with self.lock:
+            self.latencies.append(time.perf_counter() - t0)
+            self.n_requests += 1
+            self.n_items += request.n
+
+        # the inputs were checked, a failure here is on the server side
+        if request.error is not None:
+            raise RuntimeError('Evaluation of {} failed: {}'.format(model, request.error)) from request.error
+        return request.result
+
+    def _run(self):
+
+        while True:
+            batch = [self.requests.get()]
+            n_items = batch[0].n
+            deadline = time.perf_counter() + self.max_wait
+            while n_items < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0: break
+                try:
+                    batch.append(self.requests.get(timeout = timeout))
+                except queue.Empty:
+                    break
+                n_items += batch[-1].n
+
+            self._evaluate(batch)
+
+    def _evaluate(self, batch):
+
+        '''
+        Evaluate each model once on the concatenated inputs of its requests,
+        and each request on its own if the batch fails, so that only the
+        failing request gets the error
+        '''
+        by_model = {}
+        for request in batch:
+            by_model.setdefault(request.model, []).append(request)
+
+        for model, requests in by_model.items():
+            descriptors, coefs, primary_names, (powers, logs) = self.models[model]
+            try:
+                inputs = {pi: np.concatenate([ri.inputs[pi] for ri in requests]) for pi in primary_names}
+                prediction = stools.predict_from_exponents(inputs, powers, logs, coefs, primary_names)
+                splits = np.cumsum([ri.n for ri in requests])[:-1]
+                for ri, pred_i in zip(requests, np.split(prediction, splits)):
+                    ri.result = pred_i
+            except Exception:
+                for ri in requests:
+                    try:
+                        ri.result = stools.predict_from_exponents(ri.inputs, powers, logs, coefs, primary_names)
+                    except Exception as error:
+                        ri.error = error
+
+            for ri in requests: ri.done.set()
+
+        with self.lock:
+            self.n_batches += 1
+
+    def metrics(self):
+
+        '''
+        Latency percentiles (ms) and throughput since startup
+        '''
+        with self.lock:
+            latencies = np.array(self.latencies)
+            elapsed = time.perf_counter() - self.t_start
+            n_requests, n_items, n_batches = self.n_requests, self.n_items, self.n_batches
+
+        metrics = {'requests': n_requests, 'items': n_items, 'batches': n_batches,
+                   'requests_per_s': n_requests / elapsed, 'items_per_s': n_items / elapsed,
+                   'mean_batch_items': n_items / n_batches if n_batches else 0.0}
+        if len(latencies):
+            metrics['latency_p50_ms'] = 1e3 * np.percentile(latencies, 50)
+            metrics['latency_p99_ms'] = 1e3 * np.percentile(latencies, 99)
+            metrics['latency_per_item_ms'] = 1e3 * latencies.sum() / n_items
+
+        return metrics
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1' # keep-alive, no new connection per request
+    batcher = None
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._send(200, self.batcher.metrics())
+        elif self.path == '/models':
+            self._send(200, {mi: mv[2] for mi, mv in self.batcher.models.items()})
+        else:
+            self._send(404, {'error': 'Unknown path {}'.format(self.path)})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send(404, {'error': 'Unknown path {}'.format(self.path)})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            prediction = self.batcher.predict(body['model'], body['inputs'])
+        except (KeyError, ValueError, TypeError) as error:
+            # malformed request: missing or bad Content-Length, invalid JSON, wrong types
+            self._send(400, {'error': '{}: {}'.format(type(error).__name__, error)})
+            return
+        except Exception as error:
+            self._send(500, {'error': '{}: {}'.format(type(error).__name__, error)})
+            return
+        self._send(200, {'prediction': prediction.tolist()})
+
+    def log_message(self, format, *args):
+        # one line per request would dominate the latency
+        pass
+
+
+class PredictionServer(ThreadingHTTPServer):
+
+    # workflow engines open many connections at once
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def serve(model_dir = os.getcwd(), host = '127.0.0.1', port = 8000, max_batch_size = 4096, max_wait = 0.001):
+
+    '''
+    Load the models and serve predictions until interrupted
+    '''
+    models = load_models(model_dir)
+    if not models:
+        raise FileNotFoundError('No exported coefficients found in {}'.format(model_dir))
+
+    PredictionHandler.batcher = MicroBatcher(models, max_batch_size, max_wait)
+    server = PredictionServer((host, port), PredictionHandler)
+    print('Serving {} on http://{}:{}'.format(', '.join(sorted(models)), host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Prediction server for the scaling laws')
+    parser.add_argument('--model-dir', default = os.getcwd())
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8000)
+    parser.add_argument('--max-batch-size', type = int, default = 4096)
+    parser.add_argument('--max-wait-ms', type = float, default = 1.0)
+    args = parser.parse_args()
+
+    serve(args.model_dir, args.host, args.port, args.max_batch_size, args.max_wait_ms / 1e3)
@@ -0,0 +1,130 @@
+# To add a new cell, type '# %%'
+# To add a new markdown cell, type '# %% [markdown]'
+# %% [markdown]
+# ## Active Learning: Picking the Next DFT Calculations
+#
+# Every (metal, support) pair costs hours of DFT for $ E_{bind} $ and $ E_a $. A bootstrap ensemble of the chained model used in screening (LASSO $ E_{bind} $ from the tabulated metal and support properties, fed into the DSL) scores the unlabeled pairs by its uncertainty, and a batch of the most informative pairs is proposed. When the results come back the ensemble is updated incrementally
+#
+# - The [retrospective run](#retrospective) hides most of the data and compares the acquisition functions with random picks
+#
+# - The [proposal](#proposal) scores the pairs missing from Ea_data.csv, built from the metals and supports in it plus those listed in new_metals.csv and new_supports.csv
+#
+
+# %%
+#%% Import all necessary libraries
+
+import os
+import numpy as np
+import pandas as pd
+
+import matplotlib
+import matplotlib.pyplot as plt
+
+# import customized active learning functions
+import active_learning as alearn
+
+# Set plotting format
+font = {'size'   : 20}
+
+matplotlib.rc('font', **font)
+matplotlib.rcParams['axes.linewidth'] = 1.5
+matplotlib.rcParams['xtick.labelsize'] = 16
+matplotlib.rcParams['ytick.labelsize'] = 16
+matplotlib.rcParams['legend.fontsize'] = 16
+matplotlib.rcParams['figure.dpi'] = 300. # set plotting resolution
+
+data = pd.read_csv('Ea_data.csv', header = 0)
+
+base_dir = os.getcwd()
+output_dir = os.path.join(base_dir, 'active_learning')
+if not os.path.exists(output_dir): os.makedirs(output_dir)
+
+n_members = 30
+batch_size = 5
+Ea_threshold = 1.5 # eV, as in the screening of train_Ea.py
+
+# %% [markdown]
+# ### Retrospective run <a name="retrospective"></a>
+#
+# Start from 20 random pairs, the other pairs form the pool. Each round proposes a batch from the pool, its DFT values are revealed and the ensemble is updated. The error of the ensemble mean on all pairs is compared with picking the batch at random
+
+# %%
+#%% Retrospective active learning
+
+n_initial = 20
+n_rounds = 10
+methods = ['random', 'variance', 'straddle', 'misclassification']
+random_states = [0, 1, 2]
+
+retrospective = []
+for random_state in random_states:
+    for method in methods:
+
+        rng = np.random.RandomState(random_state)
+        order = rng.permutation(len(data))
+        labeled, pool = list(order[:n_initial]), list(order[n_initial:])
+        ensemble = alearn.BootstrapEnsemble(n_members, random_state = random_state).fit(data.iloc[labeled], data.iloc[pool])
+
+        for ri in range(n_rounds + 1):
+            Ea_members = ensemble.predict_members(data)
+            Ea_mean = Ea_members.mean(axis = 0)
+            retrospective.append({'method': method, 'random_state': random_state, 'n_labeled': len(labeled),
+                                  'RMSE': np.sqrt(np.mean((Ea_mean - data['Ea'])**2)),
+                                  'accuracy': np.mean((Ea_mean > Ea_threshold) == (data['Ea'] > Ea_threshold))})
+            if ri == n_rounds: break
+
+            if method == 'random':
+                batch = rng.choice(len(pool), batch_size, replace = False)
+            else:
+                batch, _ = alearn.propose_batch(ensemble.predict_members(data.iloc[pool]), batch_size, method,
+                                                noise = ensemble.residual_variance(), Ea_threshold = Ea_threshold)
+            new_points = [pool[bi] for bi in batch]
+            labeled += new_points
+            pool = [pi for pi in pool if pi not in new_points]
+            ensemble.add(data.iloc[new_points])
+
+retrospective_df = pd.DataFrame(retrospective)
+retrospective_df.to_csv(os.path.join(output_dir, 'retrospective.csv'), index=False)
+retrospective_mean = retrospective_df.groupby(['method', 'n_labeled'])[['RMSE', 'accuracy']].mean().reset_index()
+print(retrospective_mean.pivot(index = 'n_labeled', columns = 'method', values = 'RMSE'))
+
+fig, ax = plt.subplots(figsize=(6, 6))
+for method in methods:
+    curve = retrospective_mean[retrospective_mean['method'] == method]
+    ax.plot(curve['n_labeled'], curve['RMSE'], 'o-', label = method)
+ax.set_xlabel('Number of DFT calculations')
+ax.set_ylabel('Ea RMSE (eV)')
+ax.legend(frameon=False, loc='best')
+fig.savefig(os.path.join(output_dir, 'retrospective_RMSE.png'), bbox_inches='tight')
+
+# %% [markdown]
+# ### Proposal of the next batch <a name="proposal"></a>
+#
+# new_metals.csv lists new metals (metal, Ec, electronegativity X(TM)), new_supports.csv new supports (support, Evac, electronegativity X(ligand), CN, angle). Append the DFT results of a batch to new_results.csv (the columns of Ea_data.csv) and rerun the cell, the ensemble is updated with them and the next batch is proposed
+
+# %%
+#%% Propose the next calculations
+
+new_metals = pd.read_csv('new_metals.csv') if os.path.exists('new_metals.csv') else None
+new_supports = pd.read_csv('new_supports.csv') if os.path.exists('new_supports.csv') else None
+candidates = alearn.candidate_pool(data, new_metals, new_supports)
+
+if len(candidates) == 0:
+    print('All (metal, support) pairs are labeled, add new metals or supports to propose calculations')
+else:
+    ensemble = alearn.BootstrapEnsemble(n_members).fit(data, candidates)
+    if os.path.exists('new_results.csv'):
+        new_results = pd.read_csv('new_results.csv')
+        ensemble.add(new_results)
+        candidates = alearn.candidate_pool(ensemble.data, new_metals, new_supports)
+
+    Ea_members = ensemble.predict_members(candidates)
+    batch, scores = alearn.propose_batch(Ea_members, batch_size, 'straddle',
+                                         noise = ensemble.residual_variance(), Ea_threshold = Ea_threshold)
+
+    proposal = candidates.iloc[batch][['metal', 'support']].copy()
+    proposal['Ea_mean'] = Ea_members.mean(axis = 0)[batch]
+    proposal['Ea_sigma'] = Ea_members.std(axis = 0)[batch]
+    proposal['score'] = scores
+    proposal.to_csv(os.path.join(output_dir, 'proposed_batch.csv'), index=False)
+    print(proposal)
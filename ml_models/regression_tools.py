@@ -10,7 +10,12 @@ Utility functions to make regression plots
 '''
 
 import os
+import tempfile
 import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from scipy import sparse
+from sklearn.linear_model import ElasticNet, Lasso, enet_path
 from sklearn.metrics import mean_squared_error, r2_score
 from scipy.stats import norm
 import seaborn as sns
@@ -30,58 +35,215 @@ def predict_y(x, intercept, J_nonzero):
     return y
 
 
-def cal_path(alphas, model, X_cv_train, y_cv_train, X_cv_test, y_cv_test, fit_int_flag):
-    
+def alpha_grid(X, y, l1_ratio = 1.0, eps = 1e-3, n_alphas = 100):
+
     '''
-    Calculate both RMSE and number of coefficients path for plotting purpose
+    The alpha grid LassoCV/ElasticNetCV build without an intercept, from the
+    smallest alpha giving all zero coefficients down to eps times it
     '''
-    
-    RMSE_path = []
-    coef_path = []
-    
-    for j in range(len(X_cv_train)):
-        
-        test_scores = np.zeros(len(alphas))
-        coefs_i = np.zeros(len(alphas))
-                
-        for i, ai in enumerate(alphas):
-            
-            estimator = model(alpha = ai,  max_iter = 1e7, tol = 0.001, fit_intercept=fit_int_flag, random_state = 0)
-            estimator.fit(X_cv_train[j], y_cv_train[j])
-            # Access the errors, error per cluster
-            test_scores[i] = np.sqrt(mean_squared_error(y_cv_test[j], estimator.predict(X_cv_test[j]))) #RMSE
-            coefs_i[i] = len(np.nonzero(estimator.coef_)[0])
-        
-        RMSE_path.append(test_scores)
-        coef_path.append(coefs_i)
-    
-    RMSE_path = np.transpose(np.array(RMSE_path))
-    coef_path = np.transpose(np.array(coef_path))
+    alpha_max = np.max(np.abs(np.dot(X.T, y))) / (len(y) * l1_ratio)
+    return np.geomspace(alpha_max, alpha_max * eps, num = n_alphas)
 
-    
-    return RMSE_path, coef_path
 
+class PathResults(object):
+
+    '''
+    Cross-validated regularization path in preallocated arrays, one row per fold
+        coefs: (folds x alphas x features), memory-mapped to a .npy file when
+        larger than memmap_bytes (or when memmap_dir is given)
+        intercepts, RMSE_train, RMSE_test, n_iter: (folds x alphas)
+        full_coefs, full_intercepts: the path fitted on the whole training set
+    '''
+    def __init__(self, alphas, n_folds, n_features, memmap_dir = None, memmap_bytes = 2**28):
+
+        self.alphas = np.asarray(alphas, dtype = float)
+        shape = (n_folds, len(self.alphas), n_features)
+        if memmap_dir is not None or np.prod(shape) * 8 > memmap_bytes:
+            if memmap_dir is None: memmap_dir = tempfile.mkdtemp()
+            self.coefs = np.lib.format.open_memmap(os.path.join(memmap_dir, 'path_coefs.npy'), mode = 'w+',
+                                                   dtype = np.float64, shape = shape)
+        else:
+            self.coefs = np.zeros(shape)
+        self.intercepts = np.zeros(shape[:2])
+        self.RMSE_train = np.zeros(shape[:2])
+        self.RMSE_test = np.zeros(shape[:2])
+        self.n_iter = np.zeros(shape[:2], dtype = int)
+        self.full_coefs = np.zeros(shape[1:])
+        self.full_intercepts = np.zeros(shape[1])
+
+    @property
+    def RMSE_path(self):
+        # test RMSE (alphas x folds) as the plotting functions take it
+        return self.RMSE_test.T
+
+    @property
+    def coef_path(self):
+        # number of nonzero coefficients (alphas x folds)
+        return np.count_nonzero(self.coefs, axis = 2).T
+
+    def best_index(self):
+
+        '''
+        Index of the alpha with the lowest mean test MSE over the folds,
+        the criterion of LassoCV and RidgeCV, the largest alpha on ties
+        '''
+        order = np.argsort(-self.alphas, kind = 'mergesort')
+        return order[np.argmin(np.mean(self.RMSE_test**2, axis = 0)[order])]
+
+    def best_alpha(self):
+
+        return self.alphas[self.best_index()]
+
+    def to_sparse(self):
+
+        '''
+        Fold coefficients as a sparse ((folds x alphas) x features) matrix,
+        LASSO paths are mostly zeros
+        '''
+        return sparse.csr_matrix(np.reshape(self.coefs, (-1, self.coefs.shape[2])))
+
+    def save(self, filename):
+
+        '''
+        Save everything in one npz file, the fold coefficients in sparse form
+        '''
+        coefs = self.to_sparse()
+        np.savez_compressed(filename, alphas = self.alphas, shape = self.coefs.shape, coefs_data = coefs.data,
+                            coefs_indices = coefs.indices, coefs_indptr = coefs.indptr, intercepts = self.intercepts,
+                            RMSE_train = self.RMSE_train, RMSE_test = self.RMSE_test, n_iter = self.n_iter,
+                            full_coefs = self.full_coefs, full_intercepts = self.full_intercepts)
+
+    @classmethod
+    def load(cls, filename, memmap_dir = None):
+
+        saved = np.load(filename)
+        shape = tuple(saved['shape'])
+        results = cls(saved['alphas'], shape[0], shape[2], memmap_dir)
+        coefs = sparse.csr_matrix((saved['coefs_data'], saved['coefs_indices'], saved['coefs_indptr']),
+                                  shape = (shape[0] * shape[1], shape[2]))
+        results.coefs[:] = np.reshape(coefs.toarray(), shape)
+        for name in ['intercepts', 'RMSE_train', 'RMSE_test', 'n_iter', 'full_coefs', 'full_intercepts']:
+            setattr(results, name, saved[name])
+        return results
+
+
+def _fold_path(alphas, model, X_train_j, y_train_j, fit_int_flag, model_kwargs):
 
+    '''
+    Path of one fold, alphas sorted from the largest
+    return the coefficients (alphas x features), intercepts and iterations
+    '''
+    model_params = model().get_params()
+    if model in (Lasso, ElasticNet) and not fit_int_flag:
+        # coordinate descent is cyclic, the path does not draw random numbers
+        l1_ratio = model_kwargs.get('l1_ratio', model_params.get('l1_ratio', 1.0))
+        _, coefs, _, n_iters = enet_path(X_train_j, y_train_j, l1_ratio = l1_ratio, alphas = alphas, precompute = False,
+                                         max_iter = int(1e7), tol = 0.001, return_n_iter = True)
+        return coefs.T, np.zeros(len(alphas)), np.asarray(n_iters)
+
+    coefs = np.zeros((len(alphas), X_train_j.shape[1]))
+    intercepts = np.zeros(len(alphas))
+    n_iters = np.zeros(len(alphas), dtype = int)
+    estimator = model(max_iter = 1e7, tol = 0.001, fit_intercept=fit_int_flag, random_state = 0, **model_kwargs)
+    if 'warm_start' in model_params: estimator.set_params(warm_start = True)
+    for i, ai in enumerate(alphas):
+        estimator.set_params(alpha = ai)
+        estimator.fit(X_train_j, y_train_j)
+        coefs[i] = estimator.coef_
+        intercepts[i] = estimator.intercept_
+        n_iter = getattr(estimator, 'n_iter_', None) # None for the direct Ridge solvers
+        n_iters[i] = 0 if n_iter is None else np.max(n_iter)
+    return coefs, intercepts, n_iters
+
+
+def cal_path(alphas, model, X_cv_train, y_cv_train, X_cv_test, y_cv_test, fit_int_flag,
+             X_train = None, y_train = None, memmap_dir = None, n_jobs = 1, **model_kwargs):
 
-def plot_coef_path(alpha, alphas, coef_path, model_name, output_dir = os.getcwd()):
     '''
-    #plot alphas vs the number of nonzero coefficents along the path
+    Fit the model at every alpha on every fold, from the largest alpha down
+    LASSO/Enet folds run one warm-started enet_path as LassoCV does, other
+    models are warm-started from the previous alpha when they support it
+    X_train, y_train: also fit each alpha on the whole training set, from
+    scratch as LassoCV/RidgeCV refit the selected alpha, so the selected model
+    is read from the results instead of refitted
+    n_jobs: folds fitted in parallel, the results do not depend on it
+    return a PathResults with the coefficients, intercepts, train/test RMSE
+    and iteration counts
     '''
+    alphas = np.asarray(alphas, dtype = float)
+    results = PathResults(alphas, len(X_cv_train), X_cv_train[0].shape[1], memmap_dir)
+    order = np.argsort(-alphas, kind = 'mergesort')
+
+    fold_paths = Parallel(n_jobs = n_jobs)(
+        delayed(_fold_path)(alphas[order], model, X_train_j, y_train_j, fit_int_flag, model_kwargs)
+        for X_train_j, y_train_j in zip(X_cv_train, y_cv_train))
+
+    for j, (X_train_j, y_train_j, X_test_j, y_test_j) in enumerate(zip(X_cv_train, y_cv_train, X_cv_test, y_cv_test)):
+
+        results.coefs[j, order], results.intercepts[j, order], results.n_iter[j, order] = fold_paths[j]
+
+        # errors of all alphas at once
+        coefs_j = results.coefs[j].T
+        results.RMSE_train[j] = np.sqrt(np.mean((np.dot(X_train_j, coefs_j) + results.intercepts[j] - y_train_j[:, None])**2, axis = 0))
+        results.RMSE_test[j] = np.sqrt(np.mean((np.dot(X_test_j, coefs_j) + results.intercepts[j] - y_test_j[:, None])**2, axis = 0)) #RMSE
+
+    if X_train is not None:
+        for i, ai in enumerate(alphas):
+            estimator = model(alpha = ai, max_iter = 1e7, tol = 0.001, fit_intercept=fit_int_flag, random_state = 0, **model_kwargs)
+            estimator.fit(X_train, y_train)
+            results.full_coefs[i] = estimator.coef_
+            results.full_intercepts[i] = estimator.intercept_
 
+    return results
 
+
+'''
+The path and coefficient heatmap figures save their data next to the figure
+(<figure name>.fig.npz) and are only drawn when render_figures is True,
+render_plots.py draws them later from the saved data
+'''
+render_figures = True
+
+
+def save_figure_data(output_dir, figure_name, kind, **arrays):
+
+    np.savez_compressed(os.path.join(output_dir, figure_name + '.fig.npz'), kind = kind, **arrays)
+
+
+def draw_path(alpha, alphas, path, ylabel, filename, max_lines = None, dpi = None):
+
+    '''
+    Plot alphas vs a quantity along the path, one dotted line per fold
+    path: (alphas x folds), the average is taken over all the folds
+    max_lines: draw at most this many fold lines, evenly spaced, None for all
+    and 0 for none
+    '''
     fig = plt.figure(figsize=(6, 6))
-    
-    plt.plot(-np.log10(alphas), coef_path, ':', linewidth= 0.8)
-    plt.plot(-np.log10(alphas), np.mean(coef_path, axis = 1), 
+
+    fold_lines = np.arange(path.shape[1])
+    if max_lines is not None and max_lines < len(fold_lines):
+        fold_lines = np.unique(np.linspace(0, len(fold_lines) - 1, max_lines).astype(int)) if max_lines > 0 else []
+    if len(fold_lines) > 0:
+        plt.plot(-np.log10(alphas), path[:, fold_lines], ':', linewidth= 0.8)
+    plt.plot(-np.log10(alphas), np.mean(path, axis = 1), 
              label='Average across the folds', linewidth=2)     
     plt.axvline(-np.log10(alpha), linestyle='--' , color='r', linewidth=3,
                 label='Optimal alpha') 
     plt.legend(frameon=False, loc='best')
     plt.xlabel(r'$-log10(\lambda)$')
-    plt.ylabel("Number of Nonzero Coefficients ")    
+    plt.ylabel(ylabel)    
     plt.tight_layout()
 
-    fig.savefig(os.path.join(output_dir, model_name + '_a_vs_n.png'))
+    fig.savefig(filename, dpi = dpi)
+
+
+def plot_coef_path(alpha, alphas, coef_path, model_name, output_dir = os.getcwd()):
+    '''
+    #plot alphas vs the number of nonzero coefficents along the path
+    '''
+    save_figure_data(output_dir, model_name + '_a_vs_n', 'coef_path', alpha = alpha, alphas = alphas, path = coef_path)
+    if render_figures:
+        draw_path(alpha, alphas, coef_path, "Number of Nonzero Coefficients ", os.path.join(output_dir, model_name + '_a_vs_n.png'))
 
 
 def plot_RMSE_path(alpha, alphas, RMSE_path, model_name, output_dir = os.getcwd()):
@@ -89,21 +251,9 @@ def plot_RMSE_path(alpha, alphas, RMSE_path, model_name, output_dir = os.getcwd(
     '''
     #plot alphas vs RMSE along the path
     '''
-
-    fig = plt.figure(figsize=(6, 6))
-    
-    plt.plot(-np.log10(alphas), RMSE_path, ':', linewidth= 0.8)
-    plt.plot(-np.log10(alphas), np.mean(RMSE_path, axis = 1), 
-             label='Average across the folds', linewidth=2)  
-    plt.axvline(-np.log10(alpha), linestyle='--' , color='r', linewidth=3,
-                label='Optimal alpha') 
-    
-    plt.legend(frameon=False,loc='best')
-    plt.xlabel(r'$-log10(\lambda)$')
-    plt.ylabel("RMSE (eV)")    
-    plt.tight_layout()
-   
-    fig.savefig(os.path.join(output_dir, model_name  + '_a_vs_cv.png'))
+    save_figure_data(output_dir, model_name + '_a_vs_cv', 'RMSE_path', alpha = alpha, alphas = alphas, path = RMSE_path)
+    if render_figures:
+        draw_path(alpha, alphas, RMSE_path, "RMSE (eV)", os.path.join(output_dir, model_name  + '_a_vs_cv.png'))
 
        
 def plot_path(X, y, alpha, alphas, RMSE_path, coef_path, model, model_name, output_dir = os.getcwd()):
@@ -124,18 +274,10 @@ def plot_path(X, y, alpha, alphas, RMSE_path, coef_path, model, model_name, outp
 
 def plot_ridge_path(alpha, alphas, RMSE_path, model_name, output_dir = os.getcwd()):
     
-    fig = plt.figure(figsize=(6, 6))
-    
-    plt.plot(-np.log10(alphas), np.mean(RMSE_path, axis = 1), 
-             label='Average across the folds', linewidth=2)  
-    plt.axvline(-np.log10(alpha), linestyle='--' , color='r', linewidth=3,
-                label='Optimal alpha') 
-    
-    plt.legend(frameon=False,loc='best')
-    plt.xlabel(r'$-log10(\lambda)$')
-    plt.ylabel("RMSE (eV)")    
-    plt.tight_layout()
-    fig.savefig(os.path.join(output_dir, model_name +'_a_vs_cv.png'))
+    # the average only, no fold lines
+    save_figure_data(output_dir, model_name + '_a_vs_cv', 'ridge_path', alpha = alpha, alphas = alphas, path = RMSE_path)
+    if render_figures:
+        draw_path(alpha, alphas, RMSE_path, "RMSE (eV)", os.path.join(output_dir, model_name +'_a_vs_cv.png'), max_lines = 0)
 
     
     
@@ -250,6 +392,16 @@ def parity_plot(yobj, ypred, model_name,  output_dir, test_RMSE):
     
     return all_RMSE, r2    
 
+def parity_metrics(yobj, ypred):
+    '''
+    RMSE and R2 score of the model for the whole dataset, 
+    the parity figures are drawn later from the report predictions
+    '''
+    all_RMSE = np.sqrt(np.mean((yobj - ypred)**2))
+    r2 = r2_score(yobj, ypred)
+    
+    return all_RMSE, r2
+
 def error_distribution(yobj, ypred, model_name, output_dir):
     
     '''
@@ -263,7 +415,7 @@ def error_distribution(yobj, ypred, model_name, output_dir):
     x_resid = np.linspace(mu - 3*sigma, mu + 3*sigma, 100)
     ax.plot(x_resid,norm.pdf(x_resid, mu, sigma), color='r')
     plt.title(r'{}, $\sigma$-{:.2}'.format(model_name, sigma))
-    fig.savefig(os.path.join(output_dir, model_name + '_parity.png'))
+    fig.savefig(os.path.join(output_dir, model_name + '_error_distribution.png'))
 
     return sigma
 
@@ -322,6 +474,14 @@ def plot_tri_correlation_matrix(coef_matrix, output_dir, x_plot_feature_names, m
     '''
     Plot the correlation matrix in a lower trianglar fashion
     '''
+    save_figure_data(output_dir, model_name + '_coef_heatmap', 'coef_heatmap', coef_matrix = coef_matrix,
+                     feature_names = np.array(x_plot_feature_names))
+    if render_figures:
+        draw_tri_correlation_matrix(coef_matrix, x_plot_feature_names, os.path.join(output_dir, model_name + '_coef_heatmap.png'))
+
+
+def draw_tri_correlation_matrix(coef_matrix, x_plot_feature_names, filename, dpi = None):
+
     corr = coef_matrix.copy()
     
     # create mask, true for white, false to show the value
@@ -367,4 +527,122 @@ def plot_tri_correlation_matrix(coef_matrix, output_dir, x_plot_feature_names, m
     ax.set_yticklabels(x_plot_feature_names, rotation = 0)
     ax.set_xlabel('Descriptor 1')
     ax.set_ylabel('Descriptor 2')
-    fig.savefig(os.path.join(output_dir, model_name + '_coef_heatmap.png'))
\ No newline at end of file
+    fig.savefig(filename, dpi = dpi)
+
+#%% Batched report for all models
+def cal_metrics(y, Y_pred, model_names, groups = None):
+    
+    '''
+    Metrics of all models from one prediction matrix (models x samples)
+    return a dataframe with the RMSE, MAE, R2 and residual standard deviation 
+    (sigma) of each model, and with groups given, a second one with the metrics 
+    of each (model, group)
+    '''
+    y = np.asarray(y, dtype = float)
+    E = np.asarray(Y_pred, dtype = float) - y
+    ss_tot = np.sum((y - y.mean())**2)
+    
+    metrics = pd.DataFrame({'model': model_names,
+                            'RMSE': np.sqrt(np.mean(E**2, axis = 1)),
+                            'MAE': np.mean(np.abs(E), axis = 1),
+                            'r2': 1 - np.sum(E**2, axis = 1)/ss_tot,
+                            'sigma': np.std(E, axis = 1)})
+    if groups is None: return metrics
+    
+    # one-hot group indicator, so that all group sums are one matrix product
+    group_types, group_index = np.unique(groups, return_inverse = True)
+    indicator = np.zeros((len(y), len(group_types)))
+    indicator[np.arange(len(y)), group_index] = 1
+    
+    n_group = indicator.sum(axis = 0)
+    y_group_mean = np.dot(y, indicator)/n_group
+    ss_tot_group = np.dot((y - y_group_mean[group_index])**2, indicator)
+    sse_group = np.dot(E**2, indicator)
+    
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        r2_group = np.where(ss_tot_group > 0, 1 - sse_group/ss_tot_group, np.nan)
+    
+    group_metrics = pd.DataFrame({'model': np.repeat(model_names, len(group_types)),
+                                  'group': np.tile(group_types, len(model_names)),
+                                  'n': np.tile(n_group, len(model_names)).astype(int),
+                                  'RMSE': np.sqrt(sse_group/n_group).ravel(),
+                                  'MAE': (np.dot(np.abs(E), indicator)/n_group).ravel(),
+                                  'r2': r2_group.ravel()})
+    
+    return metrics, group_metrics
+
+
+def plot_report(y, Y_pred, model_names, groups, output_dir, report_name = 'report', 
+                test_RMSEs = None, group_labels = None):
+    
+    '''
+    Render the parity, error, error distribution and per-group RMSE plots of all 
+    models in one multi-panel figure from one prediction matrix (models x samples)
+    groups: group of each sample, or a dictionary of grouping name -> groups 
+    (e.g. support and metal), one RMSE panel per grouping, the points are 
+    colored by the first grouping
+    group_labels: tick labels of the sorted groups, a dictionary for several groupings
+    return the metrics dataframe from cal_metrics and the metrics of every
+    (grouping, model, group)
+    '''
+    if not isinstance(groups, dict): groups = {'group': groups}
+    if not isinstance(group_labels, dict): group_labels = {list(groups)[0]: group_labels}
+    
+    metrics = cal_metrics(y, Y_pred, model_names)
+    group_metrics, group_types, group_index = {}, {}, {}
+    for name, groups_i in groups.items():
+        group_metrics[name] = cal_metrics(y, Y_pred, model_names, groups_i)[1]
+        group_types[name], group_index[name] = np.unique(groups_i, return_inverse = True)
+        if group_labels.get(name, None) is None: group_labels[name] = group_types[name]
+    
+    sns.set_style("ticks")
+    n_models = len(model_names)
+    n_groupings = len(groups)
+    fig, axes = plt.subplots(n_models, 3 + n_groupings, figsize=(6*(3 + n_groupings), 6*n_models), squeeze = False)
+    color_name = list(groups)[0]
+    colors = plt.cm.jet(np.linspace(0, 1, len(group_types[color_name])))[group_index[color_name]]
+    lims = [y.min(), y.max()]
+    
+    for mi, (model_name, y_pred) in enumerate(zip(model_names, Y_pred)):
+        
+        RMSE_i = metrics['RMSE'][mi] if test_RMSEs is None else test_RMSEs[mi]
+        # parity plot
+        ax = axes[mi, 0]
+        ax.scatter(y, y_pred, c = colors, alpha = 0.5, s = 60)
+        ax.plot(lims, lims, 'k--', lw=2)
+        ax.set_xlabel('DFT-Calculated ')
+        ax.set_ylabel('Model Prediction')
+        ax.set_title(r'{}, RMSE={:.2}, $R^2$ ={:.2}'.format(model_name, RMSE_i, metrics['r2'][mi]))
+        
+        # error plot
+        ax = axes[mi, 1]
+        ax.scatter(y, y_pred - y, c = colors, s = 20)
+        ax.plot(lims, np.zeros(len(lims)), 'k--', alpha=0.75, zorder=0)
+        ax.set_xlabel('DFT-Calculated ')
+        ax.set_ylabel('Error (eV)')
+        
+        # error distribution
+        ax = axes[mi, 2]
+        sigma = metrics['sigma'][mi]
+        ax.hist(y - y_pred, density=1, alpha=0.5, color='steelblue')
+        x_resid = np.linspace(-3*sigma, 3*sigma, 100)
+        ax.plot(x_resid, norm.pdf(x_resid, 0, sigma), color='r')
+        ax.set_xlabel('Residual (eV)')
+        ax.set_title(r'$\sigma$-{:.2}'.format(sigma))
+        
+        # RMSE per group
+        for gi, name in enumerate(groups):
+            ax = axes[mi, 3 + gi]
+            n_types = len(group_types[name])
+            RMSE_group = group_metrics[name]['RMSE'].values[mi*n_types: (mi+1)*n_types]
+            ax.bar(np.arange(n_types), RMSE_group, color = plt.cm.jet(np.linspace(0, 1, n_types)))
+            ax.set_xticks(np.arange(n_types))
+            ax.set_xticklabels(group_labels[name], rotation = 90)
+            ax.set_ylabel('RMSE (eV) per {}'.format(name))
+    
+    plt.tight_layout()
+    fig.savefig(os.path.join(output_dir, report_name + '.png'))
+    plt.close(fig)
+    
+    group_metrics = pd.concat([gm.assign(grouping = name) for name, gm in group_metrics.items()], ignore_index = True)
+    return metrics, group_metrics[['grouping'] + [ci for ci in group_metrics.columns if ci != 'grouping']]
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Render the path and coefficient heatmap figures from the data saved in training
+"""
+
+'''
+Training saves the data of each figure as <figure name>.fig.npz in the model
+directories (lasso, ridge, enet, ...). This script draws them on demand in any
+format matplotlib writes, vector formats (svg, pdf) stay small whatever the
+dpi, and max_lines thins the 100 fold lines of the path plots:
+
+    python render_plots.py lasso enet --format svg --max-lines 10
+'''
+
+import argparse
+import glob
+import os
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+
+import regression_tools as rtools
+
+# Set plotting format, as in the training scripts
+font = {'size'   : 20}
+
+matplotlib.rc('font', **font)
+matplotlib.rcParams['axes.linewidth'] = 1.5
+matplotlib.rcParams['xtick.major.size'] = 12
+matplotlib.rcParams['xtick.labelsize'] = 16
+matplotlib.rcParams['ytick.labelsize'] = 16
+matplotlib.rcParams['xtick.major.width'] = 3
+matplotlib.rcParams['ytick.major.size'] = 12
+matplotlib.rcParams['ytick.major.width'] = 3
+matplotlib.rcParams['legend.fontsize'] = 16
+
+path_ylabels = {'coef_path': "Number of Nonzero Coefficients ",
+                'RMSE_path': "RMSE (eV)",
+                'ridge_path': "RMSE (eV)"}
+
+
+def render(data_file, fmt = 'png', dpi = 300, max_lines = None, output_dir = None):
+
+    '''
+    Draw one figure from its .fig.npz data file
+    return the name of the figure file
+    '''
+    saved = np.load(data_file)
+    kind = str(saved['kind'])
+    if output_dir is None: output_dir = os.path.dirname(data_file)
+    filename = os.path.join(output_dir, os.path.basename(data_file)[:-len('.fig.npz')] + '.' + fmt)
+
+    if kind in path_ylabels:
+        if kind == 'ridge_path': max_lines = 0
+        rtools.draw_path(float(saved['alpha']), saved['alphas'], saved['path'], path_ylabels[kind], filename,
+                         max_lines = max_lines, dpi = dpi)
+    elif kind == 'coef_heatmap':
+        rtools.draw_tri_correlation_matrix(saved['coef_matrix'], list(saved['feature_names']), filename, dpi = dpi)
+    else:
+        raise ValueError('Unknown figure kind {}'.format(kind))
+
+    rtools.plt.close('all')
+    return filename
+
+
+def render_all(paths, fmt = 'png', dpi = 300, max_lines = None, kinds = None):
+
+    '''
+    Draw every figure whose data file is in the given directories or files
+    kinds: only draw these kinds, e.g. ['RMSE_path'], None for all
+    '''
+    data_files = []
+    for path in paths:
+        if os.path.isdir(path): data_files += sorted(glob.glob(os.path.join(path, '*.fig.npz')))
+        else: data_files.append(path)
+
+    filenames = []
+    for data_file in data_files:
+        if kinds is not None and str(np.load(data_file)['kind']) not in kinds: continue
+        filenames.append(render(data_file, fmt, dpi, max_lines))
+    return filenames
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Render the figures saved by the training scripts')
+    parser.add_argument('paths', nargs = '*', default = [os.getcwd()],
+                        help = 'model directories or .fig.npz files')
+    parser.add_argument('--format', default = 'png', help = 'png, svg, pdf, ...')
+    parser.add_argument('--dpi', type = float, default = 300)
+    parser.add_argument('--max-lines', type = int, default = None,
+                        help = 'fold lines drawn on the path plots, 0 for the average only')
+    parser.add_argument('--kinds', nargs = '*', default = None,
+                        help = 'coef_path, RMSE_path, ridge_path or coef_heatmap')
+    args = parser.parse_args()
+
+    for filename in render_all(args.paths, args.format, args.dpi, args.max_lines, args.kinds):
+        print(filename)
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Utility functions to record every training run
+"""
+
+'''
+Each run gets a manifest with the hash of its input data, its configuration,
+seeds, package versions, timings, metrics and outputs. Output files and arrays
+are stored once by their content hash (objects/ab/abcdef...), so an unchanged
+figure or coefficient vector is never stored twice. The runs and their
+metrics are indexed in a small SQLite file for lookup without loading them.
+
+    store_dir/
+        index.sqlite
+        objects/<hash[:2]>/<hash>
+        runs/<run_id>/manifest.json
+
+Every run is kept: the run id is the start time and a random suffix, the
+hash of the data, configuration, seeds, versions and uncommitted changes is
+indexed as inputs_hash to find the runs made with the same inputs. Only the
+files written during the run are archived, outputs left by earlier runs are
+listed as stale in the manifest.
+'''
+
+import hashlib
+import io
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def _hash_bytes(data):
+
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(filename, block_size = 1 << 20):
+
+    '''
+    sha256 of a file, read in blocks
+    '''
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _to_json(value):
+
+    # numpy arrays and scalars in the configuration
+    if isinstance(value, np.ndarray): return value.tolist()
+    if isinstance(value, np.generic): return value.item()
+    raise TypeError('{} is not json serializable'.format(type(value)))
+
+
+def _versions():
+
+    import scipy, sklearn
+    versions = {'python': platform.python_version(), 'numpy': np.__version__, 'scipy': scipy.__version__,
+                'pandas': pd.__version__, 'sklearn': sklearn.__version__}
+    try:
+        versions['git'] = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr = subprocess.DEVNULL,
+                                                  cwd = os.path.dirname(os.path.abspath(__file__))).decode().strip()
+        # uncommitted edits at the same commit give different results
+        diff = subprocess.check_output(['git', 'diff', 'HEAD'], stderr = subprocess.DEVNULL,
+                                       cwd = os.path.dirname(os.path.abspath(__file__)))
+        versions['git_diff'] = _hash_bytes(diff) if diff else None
+    except (OSError, subprocess.CalledProcessError):
+        versions['git'] = None
+        versions['git_diff'] = None
+    return versions
+
+
+def start_run(store_dir, data_files, config = None, seeds = None):
+
+    '''
+    Start recording a run
+    data_files: input files, hashed into the manifest
+    return the run dictionary passed to the other functions
+    '''
+    t_wall = time.time()
+    run = {'store_dir': store_dir,
+           'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(t_wall)),
+           'data': {os.path.basename(fi): hash_file(fi) for fi in data_files},
+           'config': dict(config or {}),
+           'seeds': dict(seeds or {}),
+           'versions': _versions(),
+           'timings': {},
+           'metrics': {},
+           'artifacts': {},
+           'stale': [],
+           '_t_wall': t_wall,
+           '_t_start': time.perf_counter(),
+           '_t_lap': time.perf_counter()}
+    return run
+
+
+def lap(run, name):
+
+    '''
+    Record the time spent since the previous lap (or the start) under name
+    '''
+    t = time.perf_counter()
+    run['timings'][name] = t - run['_t_lap']
+    run['_t_lap'] = t
+
+
+def log_metrics(run, metrics):
+
+    run['metrics'].update({ki: float(vi) for ki, vi in metrics.items()})
+
+
+def _put_object(store_dir, data):
+
+    digest = _hash_bytes(data)
+    path = os.path.join(store_dir, 'objects', digest[:2], digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path + '.tmp', 'wb') as f: f.write(data)
+        os.replace(path + '.tmp', path)
+    return digest
+
+
+def add_file(run, filename, name = None):
+
+    '''
+    Store an output file by content, an unchanged file is stored only once
+    Files not written during the run (older than its start) are left out
+    and listed as stale
+    return True if the file was stored
+    '''
+    name = name or os.path.relpath(filename)
+    # 1 s of slack for file systems with a coarse modification time
+    if os.path.getmtime(filename) < run['_t_wall'] - 1:
+        run['stale'].append(name)
+        return False
+    with open(filename, 'rb') as f:
+        digest = _put_object(run['store_dir'], f.read())
+    run['artifacts'][name] = digest
+    return True
+
+
+def add_array(run, name, array):
+
+    '''
+    Store an array (e.g. full precision coefficients) by content as .npy
+    '''
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(array), allow_pickle = False)
+    run['artifacts'][name + '.npy'] = _put_object(run['store_dir'], buffer.getvalue())
+
+
+def _connect(store_dir):
+
+    connection = sqlite3.connect(os.path.join(store_dir, 'index.sqlite'))
+    connection.executescript('''
+        CREATE TABLE IF NOT EXISTS runs (
+            run_id TEXT PRIMARY KEY, started TEXT, data_hash TEXT,
+            config_hash TEXT, git TEXT, seconds REAL, inputs_hash TEXT);
+        CREATE TABLE IF NOT EXISTS metrics (
+            run_id TEXT, name TEXT, value REAL, PRIMARY KEY (run_id, name));
+        ''')
+    # stores indexed before inputs_hash was recorded
+    if 'inputs_hash' not in [ci[1] for ci in connection.execute('PRAGMA table_info(runs)')]:
+        connection.execute('ALTER TABLE runs ADD COLUMN inputs_hash TEXT')
+    return connection
+
+
+def finish_run(run):
+
+    '''
+    Write the manifest and index the run
+    The run id is the start time and a random suffix, so a rerun never
+    replaces an earlier run. inputs_hash is the hash of the data,
+    configuration, seeds and versions (with the uncommitted changes), equal
+    for runs made with the same inputs
+    return the run id
+    '''
+    run['timings']['total'] = time.perf_counter() - run['_t_start']
+    manifest = {ki: vi for ki, vi in run.items() if not ki.startswith('_') and ki != 'store_dir'}
+
+    data_hash = _hash_bytes(json.dumps(run['data'], sort_keys = True).encode())
+    config_hash = _hash_bytes(json.dumps(run['config'], sort_keys = True, default = _to_json).encode())
+    inputs_hash = _hash_bytes(json.dumps([data_hash, config_hash, run['seeds'], run['versions']],
+                                         sort_keys = True, default = _to_json).encode())[:16]
+    run_id = '{}-{}'.format(time.strftime('%Y%m%dT%H%M%S', time.localtime(run['_t_wall'])), os.urandom(4).hex())
+    manifest['run_id'] = run_id
+    manifest['inputs_hash'] = inputs_hash
+
+    run_dir = os.path.join(run['store_dir'], 'runs', run_id)
+    os.makedirs(run_dir)
+    with open(os.path.join(run_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent = 1, sort_keys = True, default = _to_json)
+
+    connection = _connect(run['store_dir'])
+    with connection:
+        connection.execute('INSERT INTO runs (run_id, started, data_hash, config_hash, git, seconds, inputs_hash) '
+                           'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           (run_id, run['started'], data_hash, config_hash, run['versions']['git'], run['timings']['total'],
+                            inputs_hash))
+        connection.executemany('INSERT INTO metrics VALUES (?, ?, ?)',
+                               [(run_id, ki, vi) for ki, vi in run['metrics'].items()])
+    connection.close()
+
+    return run_id
+
+
+def list_runs(store_dir):
+
+    '''
+    All indexed runs, from the index only
+    '''
+    connection = _connect(store_dir)
+    runs = pd.read_sql_query('SELECT * FROM runs ORDER BY started', connection)
+    connection.close()
+    return runs
+
+
+def compare_runs(store_dir, run_ids = None, names = None):
+
+    '''
+    Metrics of several runs side by side (metrics x runs), from the index only
+    '''
+    connection = _connect(store_dir)
+    metrics = pd.read_sql_query('SELECT * FROM metrics', connection)
+    connection.close()
+
+    if run_ids is not None: metrics = metrics[metrics['run_id'].isin(run_ids)]
+    if names is not None: metrics = metrics[metrics['name'].isin(names)]
+    return metrics.pivot(index = 'name', columns = 'run_id', values = 'value')
+
+
+def load_manifest(store_dir, run_id):
+
+    with open(os.path.join(store_dir, 'runs', run_id, 'manifest.json')) as f:
+        return json.load(f)
+
+
+def artifact_path(store_dir, run_id, name):
+
+    '''
+    Path of a stored output of a past run, load .npy arrays with np.load
+    '''
+    digest = load_manifest(store_dir, run_id)['artifacts'][name]
+    return os.path.join(store_dir, 'objects', digest[:2], digest)
+
+
+def restore_artifact(store_dir, run_id, name, filename):
+
+    '''
+    Copy a stored output of a past run back to a file
+    '''
+    shutil.copyfile(artifact_path(store_dir, run_id, name), filename)
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Partitioned and sorted store of screening results with top-k and range queries
+"""
+
+'''
+The candidates are partitioned by support and metal, each partition is a
+directory of .npy columns sorted by one column (Ea_mean by default) and split
+in chunks whose min/max of every numeric column are kept in index.json.
+Queries read the columns memory-mapped and only touch the chunks that can
+match: range predicates are checked against the chunk statistics first
+(predicate pushdown), and top-k visits the chunks from the most promising
+one, keeping the k best rows in a heap and stopping once no remaining chunk
+can beat the worst of them.
+
+    writer = ScreeningIndexWriter('screening_index')
+    for batch in batches: writer.append(batch)
+    writer.close()
+
+    index = ScreeningIndex('screening_index')
+    index.top_k(100, 'Ea_mean', support = 'CeO2(111)')
+    index.query({'Ebind': (3, 4), 'Ea_mean': (2, None)})
+'''
+
+import hashlib
+import heapq
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+
+def _partition_name(key):
+
+    # readable part with the non-alphanumeric characters replaced, and a short
+    # hash of the raw key so that e.g. 'a(b' and 'a-b' get different directories
+    readable = '_'.join(''.join(ci if ci.isalnum() else '-' for ci in str(ki)) for ki in key)
+    digest = hashlib.sha256(json.dumps([str(ki) for ki in key]).encode()).hexdigest()[:8]
+    return '{}_{}'.format(readable, digest)
+
+
+def _column_array(series):
+
+    # strings as fixed width unicode so the columns load without pickle
+    values = series.to_numpy()
+    if values.dtype.kind in 'OUST': return values.astype(str)
+    return values
+
+
+class ScreeningIndexWriter(object):
+
+    '''
+    Write batches of screening results, each batch is split by partition and
+    spilled to disk, close() sorts every partition and writes the index
+    '''
+    def __init__(self, root, sort_column = 'Ea_mean', partition_columns = ('support', 'metal'), chunk_size = 65536):
+
+        self.root = root
+        self.sort_column = sort_column
+        self.partition_columns = list(partition_columns)
+        self.chunk_size = chunk_size
+        self.columns = None
+        self.n_runs = {}
+        if os.path.exists(root): shutil.rmtree(root)
+        os.makedirs(root)
+
+    def append(self, df):
+
+        if self.columns is None:
+            self.columns = [ci for ci in df.columns if ci not in self.partition_columns]
+        for key, part in df.groupby(self.partition_columns, sort = False):
+            key = key if isinstance(key, tuple) else (key,)
+            run_i = self.n_runs.get(key, 0)
+            run_dir = os.path.join(self.root, _partition_name(key), 'run-{:05d}'.format(run_i))
+            os.makedirs(run_dir)
+            for ci in self.columns:
+                np.save(os.path.join(run_dir, ci + '.npy'), _column_array(part[ci]))
+            self.n_runs[key] = run_i + 1
+        return self
+
+    def close(self):
+
+        partitions = []
+        for key, n_runs in self.n_runs.items():
+            part_dir = os.path.join(self.root, _partition_name(key))
+            run_dirs = [os.path.join(part_dir, 'run-{:05d}'.format(ri)) for ri in range(n_runs)]
+
+            sort_values = np.concatenate([np.load(os.path.join(ri, self.sort_column + '.npy')) for ri in run_dirs])
+            order = np.argsort(sort_values, kind = 'mergesort')
+            n = len(order)
+            bounds = list(range(0, n, self.chunk_size)) + [n]
+            chunks = [{'start': start, 'stop': stop, 'min': {}, 'max': {}} for start, stop in zip(bounds[:-1], bounds[1:])]
+
+            for ci in self.columns:
+                values = np.concatenate([np.load(os.path.join(ri, ci + '.npy')) for ri in run_dirs])[order]
+                np.save(os.path.join(part_dir, ci + '.npy'), values)
+                if values.dtype.kind not in 'fiu': continue
+                for chunk in chunks:
+                    chunk_values = values[chunk['start']:chunk['stop']]
+                    chunk['min'][ci] = float(np.nanmin(chunk_values))
+                    chunk['max'][ci] = float(np.nanmax(chunk_values))
+
+            for ri in run_dirs: shutil.rmtree(ri)
+            partitions.append({'key': [str(ki) for ki in key], 'path': _partition_name(key), 'n': n, 'chunks': chunks})
+
+        index = {'sort_column': self.sort_column, 'partition_columns': self.partition_columns,
+                 'columns': self.columns, 'partitions': partitions}
+        with open(os.path.join(self.root, 'index.json'), 'w') as f:
+            json.dump(index, f, indent = 1)
+        return index
+
+
+def write_index(df, root, **kwargs):
+
+    '''
+    Write one dataframe as a screening index
+    '''
+    return ScreeningIndexWriter(root, **kwargs).append(df).close()
+
+
+class ScreeningIndex(object):
+
+    '''
+    Read-only queries on an index written by ScreeningIndexWriter
+    Partition filters are keyword arguments, e.g. support = 'CeO2(111)' or
+    metal = ['Pt', 'Pd']. where: dictionary of column -> (low, high), bounds
+    included and None for unbounded, for the other columns only
+    '''
+    def __init__(self, root):
+
+        self.root = root
+        with open(os.path.join(root, 'index.json')) as f:
+            self.index = json.load(f)
+        self.sort_column = self.index['sort_column']
+        self.partition_columns = self.index['partition_columns']
+        self.columns = self.index['columns']
+        self._mmaps = {}
+        # chunks read by the last query, to check the pushdown
+        self.chunks_read = 0
+
+    def __len__(self):
+
+        return sum(pi['n'] for pi in self.index['partitions'])
+
+    def _column(self, partition, column):
+
+        key = (partition['path'], column)
+        if key not in self._mmaps:
+            self._mmaps[key] = np.load(os.path.join(self.root, partition['path'], column + '.npy'), mmap_mode = 'r')
+        return self._mmaps[key]
+
+    def _partitions(self, filters):
+
+        selected = []
+        for partition in self.index['partitions']:
+            keep = True
+            for ci, ki in zip(self.partition_columns, partition['key']):
+                if ci not in filters: continue
+                allowed = filters[ci]
+                allowed = [str(ai) for ai in allowed] if isinstance(allowed, (list, tuple, set, np.ndarray)) else [str(allowed)]
+                keep = keep and ki in allowed
+            if keep: selected.append(partition)
+        return selected
+
+    def _chunk_may_match(self, chunk, where):
+
+        for ci, (low, high) in where.items():
+            if ci not in chunk['min']: continue
+            if low is not None and chunk['max'][ci] < low: return False
+            if high is not None and chunk['min'][ci] > high: return False
+        return True
+
+    def _read_chunk(self, partition, chunk, where, columns):
+
+        '''
+        Rows of one chunk passing the predicates, as a dictionary of arrays
+        '''
+        self.chunks_read += 1
+        start, stop = chunk['start'], chunk['stop']
+        mask = np.ones(stop - start, dtype = bool)
+        for ci, (low, high) in where.items():
+            values = self._column(partition, ci)[start:stop]
+            if low is not None: mask &= values >= low
+            if high is not None: mask &= values <= high
+
+        rows = {}
+        for ci, ki in zip(self.partition_columns, partition['key']):
+            if ci in columns: rows[ci] = np.repeat(ki, np.count_nonzero(mask))
+        for ci in columns:
+            if ci not in self.partition_columns: rows[ci] = np.asarray(self._column(partition, ci)[start:stop])[mask]
+        return rows
+
+    def _check_columns(self, columns, where):
+
+        if columns is None: columns = self.partition_columns + self.columns
+        unknown = [ci for ci in list(columns) + list(where) if ci not in self.partition_columns + self.columns]
+        if unknown: raise KeyError('Unknown columns {}'.format(unknown))
+        # partition columns are not stored as columns, they are selected by keyword
+        partition_ranges = [ci for ci in where if ci in self.partition_columns]
+        if partition_ranges:
+            raise ValueError('Partition columns {} cannot take a range in where, select them by keyword, '
+                             'e.g. {} = [...]'.format(partition_ranges, partition_ranges[0]))
+        return list(columns)
+
+    def query(self, where = None, columns = None, **filters):
+
+        '''
+        All rows of the selected partitions within the ranges of where
+        return a dataframe
+        '''
+        where = dict(where or {})
+        columns = self._check_columns(columns, where)
+        self.chunks_read = 0
+
+        frames = []
+        for partition in self._partitions(filters):
+            for chunk in partition['chunks']:
+                if self._chunk_may_match(chunk, where):
+                    frames.append(pd.DataFrame(self._read_chunk(partition, chunk, where, columns), columns = columns))
+
+        if not frames: return pd.DataFrame(columns = columns)
+        return pd.concat(frames, ignore_index = True)
+
+    def top_k(self, k, column = None, ascending = True, where = None, columns = None, **filters):
+
+        '''
+        The k rows with the lowest (ascending) or highest values of column
+        among the selected partitions and ranges
+        return a dataframe sorted by column
+        '''
+        if column is None: column = self.sort_column
+        where = dict(where or {})
+        columns = self._check_columns(columns, where)
+        read_columns = columns if column in columns else columns + [column]
+        sign = 1.0 if ascending else -1.0
+        self.chunks_read = 0
+
+        # the chunks whose best possible value comes first
+        partitions = self._partitions(filters)
+        candidates = [(sign * (chunk['min'][column] if ascending else chunk['max'][column]), pi, ci)
+                      for pi, partition in enumerate(partitions)
+                      for ci, chunk in enumerate(partition['chunks']) if self._chunk_may_match(chunk, where)]
+        candidates.sort(key = lambda ti: ti[0])
+
+        # max-heap of the k best rows, as (-sign * value, counter, row)
+        heap = []
+        counter = 0
+        for bound, pi, ci in candidates:
+            if len(heap) == k and bound >= -heap[0][0]: break
+            rows = self._read_chunk(partitions[pi], partitions[pi]['chunks'][ci], where, read_columns)
+            scores = sign * rows[column]
+            for ri in np.argsort(scores, kind = 'mergesort')[:k]:
+                if len(heap) == k and scores[ri] >= -heap[0][0]: break
+                item = (-scores[ri], counter, {cj: rows[cj][ri] for cj in columns})
+                counter += 1
+                if len(heap) < k: heapq.heappush(heap, item)
+                else: heapq.heapreplace(heap, item)
+
+        best = [item[2] for item in sorted(heap, key = lambda ti: (-ti[0], ti[1]))]
+        return pd.DataFrame(best, columns = columns)
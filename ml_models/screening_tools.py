@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""
+Utility functions to screen single-atom catalysts with the scaling laws
+"""
+
+'''
+Vectorized predictions of Ea from the diffusion scaling law (DSL),
+Ea = u1 * Ebind^2/Ec + u0, where Ebind itself is predicted by a model
+with a residual standard deviation (see regression_tools.error_distribution)
+'''
+
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+
+def DSL_predict(Ebind, Ec, u1, u0):
+
+    '''
+    Point prediction of Ea from the unnormalized DSL coefficients
+    '''
+    return u1 * np.asarray(Ebind)**2 / np.asarray(Ec) + u0
+
+
+def propagate_DSL_linear(Ebind_mean, Ebind_sigma, Ec, u1, u0, DSL_sigma = 0.0):
+
+    '''
+    Linearized (first order) propagation of the Ebind uncertainty through the DSL
+    dEa/dEbind = 2*u1*Ebind/Ec, the DSL residual sigma is added in quadrature
+    return the mean and the standard deviation of Ea for each candidate
+    '''
+    Ebind_mean = np.asarray(Ebind_mean, dtype = float)
+    Ec = np.asarray(Ec, dtype = float)
+
+    Ea_mean = DSL_predict(Ebind_mean, Ec, u1, u0)
+    dEa_dEbind = 2 * u1 * Ebind_mean / Ec
+    Ea_sigma = np.sqrt((dEa_dEbind * Ebind_sigma)**2 + DSL_sigma**2)
+
+    return Ea_mean, Ea_sigma
+
+
+def propagate_DSL_MC(Ebind_mean, Ebind_sigma, Ec, u1, u0, DSL_sigma = 0.0,
+                     n_samples = 10000, random_state = 0, return_samples = False):
+
+    '''
+    Monte Carlo propagation of the Ebind uncertainty through the DSL
+    All candidates are sampled at once in a (n_samples, n_candidates) array
+    return the mean and the standard deviation of Ea (and the samples if asked)
+    '''
+    Ebind_mean = np.asarray(Ebind_mean, dtype = float)
+    Ec = np.asarray(Ec, dtype = float)
+    rng = np.random.RandomState(random_state)
+
+    Ebind_samples = Ebind_mean + Ebind_sigma * rng.standard_normal((n_samples,) + Ebind_mean.shape)
+    Ea_samples = DSL_predict(Ebind_samples, Ec, u1, u0)
+    if DSL_sigma > 0:
+        Ea_samples += DSL_sigma * rng.standard_normal(Ea_samples.shape)
+
+    Ea_mean = Ea_samples.mean(axis = 0)
+    Ea_sigma = Ea_samples.std(axis = 0)
+
+    if return_samples:
+        return Ea_mean, Ea_sigma, Ea_samples
+
+    return Ea_mean, Ea_sigma
+
+
+def stability_probability(Ea_mean, Ea_sigma, Ea_threshold, Ea_samples = None):
+
+    '''
+    Probability of each candidate having a diffusion barrier above Ea_threshold
+    Use the normal approximation, or the Monte Carlo samples if given
+    '''
+    if Ea_samples is not None:
+        return np.mean(Ea_samples > Ea_threshold, axis = 0)
+
+    Ea_sigma = np.maximum(np.asarray(Ea_sigma, dtype = float), np.finfo(float).tiny)
+
+    return norm.sf(Ea_threshold, loc = Ea_mean, scale = Ea_sigma)
+
+
+def screen_DSL(Ebind_mean, Ebind_sigma, Ec, u1, u0, Ea_threshold, DSL_sigma = 0.0,
+               method = 'linear', n_samples = 10000, random_state = 0):
+
+    '''
+    Predict Ea with uncertainty for a batch of candidates and rank them
+    by the probability of being stable, Ea > Ea_threshold
+    method: 'linear' for the linearized propagation, 'MC' for Monte Carlo
+    return a dictionary of arrays, rank holds the candidate indices from
+    the most to the least likely stable
+    '''
+    if method == 'linear':
+        Ea_mean, Ea_sigma = propagate_DSL_linear(Ebind_mean, Ebind_sigma, Ec, u1, u0, DSL_sigma)
+        p_stable = stability_probability(Ea_mean, Ea_sigma, Ea_threshold)
+    elif method == 'MC':
+        Ea_mean, Ea_sigma, Ea_samples = propagate_DSL_MC(Ebind_mean, Ebind_sigma, Ec, u1, u0, DSL_sigma,
+                                                         n_samples, random_state, return_samples = True)
+        p_stable = stability_probability(Ea_mean, Ea_sigma, Ea_threshold, Ea_samples)
+    else:
+        raise ValueError("method must be 'linear' or 'MC', got {}".format(method))
+
+    # stable sort so that ties keep the input order
+    rank = np.argsort(-p_stable, kind = 'mergesort')
+
+    return {'Ea_mean': Ea_mean, 'Ea_sigma': Ea_sigma, 'p_stable': p_stable, 'rank': rank}
+
+
+#%% Predictions from the exported coefficients
+def parse_descriptor(name, primary_names):
+
+    '''
+    Split a descriptor name such as 'Ec_-1Ebind_2' into [('Ec', -1.0), ('Ebind', 2.0)]
+    The natural log is returned as the order 'ln', the intercept '1' as []
+    '''
+    if name == '1': return []
+
+    # longest names first, so that a primary name is never matched by its prefix
+    primary_pattern = '|'.join(re.escape(pi) for pi in sorted(primary_names, key = len, reverse = True))
+    terms = re.findall(r'({})_(-?\d+(?:\.\d+)?|ln)'.format(primary_pattern), name)
+    if ''.join(pi + '_' + oi for pi, oi in terms) != name:
+        raise ValueError('Cannot parse descriptor {}'.format(name))
+
+    return [(pi, oi if oi == 'ln' else float(oi)) for pi, oi in terms]
+
+
+def descriptor_matrix(inputs, descriptors, primary_names, dtype = np.float64):
+
+    '''
+    Evaluate the descriptors for a batch of candidates
+    inputs: dictionary of primary descriptor name -> array of values
+    dtype: np.float32 halves the memory of large batches
+    '''
+    n = len(np.atleast_1d(inputs[primary_names[0]]))
+    D = np.ones((n, len(descriptors)), dtype = dtype)
+    for di, name in enumerate(descriptors):
+        for pi, oi in parse_descriptor(name, primary_names):
+            xi = np.asarray(inputs[pi], dtype = dtype)
+            D[:, di] *= np.log(xi) if oi == 'ln' else xi**oi
+
+    return D
+
+
+def descriptor_exponents(descriptors, primary_names):
+
+    '''
+    Exponent vectors of the descriptors (descriptors x primary descriptors),
+    the powers and the number of natural logs of each primary descriptor
+    '''
+    powers = np.zeros((len(descriptors), len(primary_names)))
+    logs = np.zeros((len(descriptors), len(primary_names)), dtype = int)
+    for di, name in enumerate(descriptors):
+        for pi, oi in parse_descriptor(name, primary_names):
+            if oi == 'ln': logs[di, primary_names.index(pi)] += 1
+            else: powers[di, primary_names.index(pi)] += oi
+
+    return powers, logs
+
+
+def exponent_matrix(inputs, powers, logs, primary_names, dtype = np.float64):
+
+    '''
+    Evaluate the descriptors of a batch from their exponent vectors, without parsing names
+    '''
+    n = len(np.atleast_1d(inputs[primary_names[0]]))
+    D = np.ones((n, len(powers)), dtype = dtype)
+    for pj, pi in enumerate(primary_names):
+        xi = np.asarray(inputs[pi], dtype = dtype)
+        for di in np.flatnonzero(powers[:, pj]): D[:, di] *= xi**dtype(powers[di, pj])
+        for di in np.flatnonzero(logs[:, pj]): D[:, di] *= np.log(xi)**logs[di, pj]
+
+    return D
+
+
+def sidecar_filename(filename):
+
+    '''
+    Binary sidecar of an exported coefficient csv, e.g. coefficient_unnormalized.npy
+    The names, shapes and offsets of its arrays are in the json header next to it
+    '''
+    return os.path.splitext(filename)[0] + '.npy'
+
+
+def sidecar_header_filename(filename):
+
+    '''
+    Json header of the binary sidecar, e.g. coefficient_unnormalized.json
+    '''
+    return os.path.splitext(filename)[0] + '.json'
+
+
+def _file_hash(filename):
+
+    with open(filename, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def sidecar_is_current(filename):
+
+    '''
+    True when the sidecar of a coefficient csv exists and was written with
+    that csv (same sha256), or when only the sidecar is there
+    '''
+    if not (os.path.exists(sidecar_filename(filename)) and os.path.exists(sidecar_header_filename(filename))):
+        return False
+    if not os.path.exists(filename): return True
+    with open(sidecar_header_filename(filename)) as f:
+        header = json.load(f)
+
+    return header.get('csv_sha256') == _file_hash(filename)
+
+
+def save_coefficients(filename, descriptors, coefs, primary_names, normalized_coefs = None,
+                      scaler_mean = None, scaler_scale = None):
+
+    '''
+    Write the full precision coefficients next to the rounded csv, with the
+    exponent vectors of the descriptors and the scaler statistics
+    coefs, normalized_coefs: dictionary of model name -> coefficients
+    All arrays go into one flat float64 .npy, which is memory mapped on load,
+    and the names, shapes and offsets into a small json header
+    Call it after writing the csv, the header keeps the sha256 of the csv so
+    that a sidecar left from another export is not read in its place
+    '''
+    model_names = list(coefs)
+    powers, logs = descriptor_exponents(descriptors, primary_names)
+    arrays = {'powers': powers, 'logs': logs,
+              'coefs': np.array([coefs[mi] for mi in model_names], dtype = np.float64)}
+    if normalized_coefs is not None:
+        arrays['normalized_coefs'] = np.array([normalized_coefs[mi] for mi in model_names], dtype = np.float64)
+    if scaler_mean is not None:
+        arrays['scaler_mean'] = np.asarray(scaler_mean, dtype = np.float64)
+        arrays['scaler_scale'] = np.asarray(scaler_scale, dtype = np.float64)
+
+    header = {'model_names': model_names, 'descriptors': list(descriptors),
+              'primary_names': list(primary_names), 'arrays': {},
+              'csv_sha256': _file_hash(filename) if os.path.exists(filename) else None}
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = {'offset': offset, 'shape': list(np.shape(array))}
+        offset += np.size(array)
+    np.save(sidecar_filename(filename), np.concatenate([np.ravel(array).astype(np.float64) for array in arrays.values()]))
+    with open(sidecar_header_filename(filename), 'w') as f:
+        json.dump(header, f)
+
+
+def load_sidecar_arrays(filename):
+
+    '''
+    Memory map the binary sidecar of an exported coefficient file
+    return the json header and a dictionary of array name -> read only view
+    '''
+    with open(sidecar_header_filename(filename)) as f:
+        header = json.load(f)
+    # plain ndarray views of the mapped buffer, slicing a np.memmap is several times slower
+    buffer = np.load(sidecar_filename(filename), mmap_mode = 'r').view(np.ndarray)
+    arrays = {}
+    for name, entry in header['arrays'].items():
+        size = int(np.prod(entry['shape']))
+        arrays[name] = buffer[entry['offset']:entry['offset'] + size].reshape(entry['shape'])
+
+    return header, arrays
+
+
+def load_sidecar(filename, model_names = None):
+
+    '''
+    Read the binary sidecar of an exported coefficient file
+    Only the nonzero terms are kept, so only those are evaluated
+    return a dictionary of model name -> (descriptor names, coefficients, powers, logs)
+    and the primary descriptor names of the exponent vectors
+    '''
+    header, arrays = load_sidecar_arrays(filename)
+    saved_names, descriptors = header['model_names'], header['descriptors']
+    powers, logs = np.array(arrays['powers']), arrays['logs'].astype(int)
+    if model_names is None: model_names = saved_names
+
+    models = {}
+    for mi in model_names:
+        coefs_i = np.array(arrays['coefs'][saved_names.index(mi)])
+        nonzero = np.flatnonzero(coefs_i)
+        models[mi] = ([descriptors[di] for di in nonzero], coefs_i[nonzero], powers[nonzero], logs[nonzero])
+
+    return models, header['primary_names']
+
+
+def load_coefficients(filename, model_names = None, exact = True):
+
+    '''
+    Read the unnormalized coefficients exported by the training scripts
+    Only the nonzero terms are kept, so only those are evaluated
+    exact: read the full precision coefficients of the binary sidecar when it
+    was written with this csv, the csv is rounded to decimal_places
+    return a dictionary of model name -> (descriptor names, coefficients)
+    '''
+    if exact and sidecar_is_current(filename):
+        models = load_sidecar(filename, model_names)[0]
+        return {mi: (descriptors, coefs) for mi, (descriptors, coefs, _, _) in models.items()}
+
+    coef_df = pd.read_csv(filename, index_col = 0)
+    if model_names is None: model_names = [mi for mi in coef_df.columns if mi != 'Descriptors']
+
+    models = {}
+    for mi in model_names:
+        nonzero = np.nonzero(np.array(coef_df[mi]))[0]
+        models[mi] = (list(coef_df['Descriptors'].iloc[nonzero]), np.array(coef_df[mi].iloc[nonzero], dtype = float))
+
+    return models
+
+
+def predict_from_coefficients(inputs, descriptors, coefs, primary_names, dtype = np.float64):
+
+    '''
+    Vectorized prediction of a batch of candidates from unnormalized coefficients
+    '''
+    D = descriptor_matrix(inputs, descriptors, primary_names, dtype)
+    return np.dot(D, np.asarray(coefs, dtype = dtype))
+
+
+def predict_from_exponents(inputs, powers, logs, coefs, primary_names, dtype = np.float64):
+
+    '''
+    Vectorized prediction of a batch from the exponent vectors of the sidecar
+    '''
+    D = exponent_matrix(inputs, powers, logs, primary_names, dtype)
+    return np.dot(D, np.asarray(coefs, dtype = dtype))
+
+
+def float32_error(inputs, descriptors, coefs, primary_names):
+
+    '''
+    Largest difference between the float32 and float64 predictions of a batch,
+    large unnormalized coefficients of opposite signs cancel and lose digits in float32
+    '''
+    y64 = predict_from_coefficients(inputs, descriptors, coefs, primary_names)
+    y32 = predict_from_coefficients(inputs, descriptors, coefs, primary_names, np.float32)
+    return np.max(np.abs(y32 - y64))
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Independent random streams for every task of a run, derived from one root seed
+"""
+
+'''
+Each task that draws random numbers (a stability pair, a search trial, a GP
+run, a forest, the MC screening...) is named by a tuple of keys and gets its
+own 32-bit seed, the sha256 of the root seed and the keys, for a RandomState
+or the random_state of an estimator. The stream of a task only depends on the
+root seed and its keys, not on which worker runs it or in which order, so a
+parallel run draws the same numbers as the serial one. Only the root seed
+needs to be recorded to reproduce a run.
+'''
+
+import hashlib
+import struct
+
+import numpy as np
+
+
+def _key_int(key):
+
+    '''
+    Map a key to a nonnegative integer, the same in every process and session
+    (unlike hash() of strings): integers are kept, floats use their bits,
+    anything else the first 4 bytes of the sha256 of its string
+    '''
+    if isinstance(key, (bool, np.bool_)):
+        return int(key)
+    if isinstance(key, (int, np.integer)) and key >= 0:
+        return int(key)
+    if isinstance(key, (float, np.floating)):
+        return struct.unpack('<Q', struct.pack('<d', float(key)))[0]
+    return int.from_bytes(hashlib.sha256(str(key).encode()).digest()[:4], 'little')
+
+
+class SeedTree(object):
+
+    '''
+    Root seed and the keys of a subtree, e.g.
+        seeds = SeedTree(0)
+        seeds.seed('RF', 'fold', 3) -> integer for random_state
+        seeds.spawn('stability').rng('pair', 7) -> RandomState
+    '''
+    def __init__(self, random_state = 0, keys = ()):
+        self.random_state = int(random_state)
+        self.keys = tuple(keys)
+
+    def __repr__(self):
+        return 'SeedTree({}, {})'.format(self.random_state, self.keys)
+
+    def spawn(self, *keys):
+
+        return SeedTree(self.random_state, self.keys + keys)
+
+    def seed(self, *keys):
+
+        '''
+        32-bit integer seed of the task, for the random_state of sklearn estimators
+        '''
+        digest = hashlib.sha256(repr((self.random_state,) + tuple(_key_int(ki) for ki in self.keys + keys)).encode())
+        return int.from_bytes(digest.digest()[:4], 'little')
+
+    def rng(self, *keys):
+
+        return np.random.RandomState(self.seed(*keys))
+
+
+def check_seeds(random_state):
+
+    '''
+    SeedTree from an integer, None (root seed 0) or a SeedTree
+    '''
+    if isinstance(random_state, SeedTree): return random_state
+    return SeedTree(0 if random_state is None else random_state)
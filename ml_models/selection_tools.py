@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Model selection from the cross-validated regularization paths
+"""
+
+'''
+The one-standard-error rule picks the most regularized model whose mean
+cross-validation error is within one standard error of the minimum, it reads
+the fold errors already stored by rtools.cal_path or ElasticNetCV and needs
+no new fits. Stability selection fits LASSO paths on random halves of the
+training set (complementary pairs) and counts how often each descriptor is
+selected, the halves run in parallel and each path is warm-started from one
+alpha to the next by enet_path.
+'''
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed, effective_n_jobs
+from sklearn.linear_model import enet_path
+
+import seed_tools as sdtools
+
+
+def one_standard_error(mse, alphas):
+
+    '''
+    mse: cross-validation MSE (folds x alphas)
+    The standard error is the standard deviation over the folds divided by
+    sqrt(folds), repeated k-fold folds are correlated so it is optimistic
+    return the index of the minimum mean MSE and of the largest alpha within
+    one standard error of it
+    '''
+    mse = np.asarray(mse, dtype = float)
+    alphas = np.asarray(alphas, dtype = float)
+    mean = np.mean(mse, axis = 0)
+    se = np.std(mse, axis = 0, ddof = 1) / np.sqrt(mse.shape[0])
+
+    # the largest alpha on ties, as LassoCV
+    order = np.argsort(-alphas, kind = 'mergesort')
+    min_index = order[np.argmin(mean[order])]
+    within = np.flatnonzero(mean <= mean[min_index] + se[min_index])
+    return min_index, within[np.argmax(alphas[within])]
+
+
+def path_selection(results, rule = '1se'):
+
+    '''
+    Index of the selected alpha of a PathResults, rule: 'min' or '1se'
+    '''
+    min_index, se_index = one_standard_error(results.RMSE_test**2, results.alphas)
+    return se_index if rule == '1se' else min_index
+
+
+def enet_selection(enet_cvs, rule = '1se'):
+
+    '''
+    Pick the l1 ratio and alpha from a list of fitted ElasticNetCV, one per
+    l1 ratio, on their stored cross-validation errors instead of a holdout:
+    the l1 ratio with the lowest mean MSE, then the alpha by the rule
+    return the index in the list and the index of the alpha in its alphas_
+    '''
+    mse_min = [np.min(np.mean(cv.mse_path_, axis = 1)) for cv in enet_cvs]
+    l1_index = int(np.argmin(mse_min))
+    cv = enet_cvs[l1_index]
+    min_index, se_index = one_standard_error(cv.mse_path_.T, cv.alphas_)
+    return l1_index, se_index if rule == '1se' else min_index
+
+
+def _subsample_paths(X, y, subsamples, alphas, l1_ratio, center):
+
+    selected = np.zeros((len(alphas), X.shape[1]))
+    for rows in subsamples:
+        X_rows, y_rows = X[rows], y[rows]
+        # centering each half leaves its intercept unpenalized
+        if center: X_rows, y_rows = X_rows - X_rows.mean(axis = 0), y_rows - y_rows.mean()
+        _, coefs, _ = enet_path(X_rows, y_rows, l1_ratio = l1_ratio, alphas = alphas, precompute = False,
+                                max_iter = int(1e7), tol = 0.001)
+        selected += np.abs(coefs.T) > 0
+    return selected
+
+
+def stability_selection(X, y, alphas, n_pairs = 50, l1_ratio = 1.0, intercept_index = None, n_jobs = -1, random_state = 0):
+
+    '''
+    Selection frequency of each descriptor at each alpha over 2 * n_pairs
+    subsamples, each pair splits the rows into two disjoint halves
+    intercept_index: the all-ones column of X, left out of the paths (each half
+    is centered instead), it would otherwise be selected in every subsample
+    random_state: integer or SeedTree, pair k is drawn from the stream ('pair', k),
+    the pairs are divided into one chunk per job
+    return the frequencies (alphas x features, without the intercept column),
+    alphas sorted from the largest
+    '''
+    X = np.asarray(X, dtype = float)
+    if intercept_index is not None: X = np.delete(X, intercept_index, axis = 1)
+    y = np.asarray(y, dtype = float)
+    alphas = np.sort(np.asarray(alphas, dtype = float))[::-1]
+    n_half = len(y) // 2
+
+    seeds = sdtools.check_seeds(random_state)
+    subsamples = []
+    for k in range(n_pairs):
+        order = seeds.rng('pair', k).permutation(len(y))
+        subsamples += [order[:n_half], order[n_half:2 * n_half]]
+
+    chunks = np.array_split(np.arange(len(subsamples)), min(len(subsamples), effective_n_jobs(n_jobs)))
+    selected = Parallel(n_jobs = n_jobs)(
+        delayed(_subsample_paths)(X, y, [subsamples[i] for i in chunk], alphas, l1_ratio, intercept_index is not None) 
+        for chunk in chunks)
+
+    return np.sum(selected, axis = 0) / len(subsamples), alphas
+
+
+def stability_table(frequencies, alphas, feature_names, threshold = 0.6):
+
+    '''
+    Maximum selection frequency over the alphas of each descriptor, those at
+    or above the threshold form the stable set, alpha_stable is the largest
+    alpha where the frequency reaches the threshold
+    return a dataframe sorted by frequency
+    '''
+    reached = frequencies >= threshold
+    alpha_stable = np.where(np.any(reached, axis = 0), alphas[np.argmax(reached, axis = 0)], np.nan)
+    max_frequency = np.max(frequencies, axis = 0)
+    stable_df = pd.DataFrame({'feature': feature_names,
+                              'frequency': max_frequency,
+                              'alpha_stable': alpha_stable,
+                              'stable': max_frequency >= threshold})
+    return stable_df.sort_values('frequency', ascending = False, kind = 'mergesort').reset_index(drop = True)
+
+
+def expected_false_selections(frequencies, threshold = 0.6):
+
+    '''
+    Bound q^2/((2 threshold - 1) p) of Meinshausen and Buhlmann on the number
+    of falsely selected descriptors, q the mean number of descriptors selected
+    per subsample at the smallest alpha, valid for a threshold above 0.5
+    '''
+    q = np.sum(frequencies[-1])
+    return q**2 / ((2 * threshold - 1) * frequencies.shape[1])
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Utility functions to train the linear models out of core
+"""
+
+'''
+Row chunks of the primary descriptors are expanded on the fly and reduced to
+running means, centered co-moments and X^T y, so the memory depends on the
+number of descriptors and not on the number of data points.
+OLS/Ridge/DSL and LASSO/Enet are then solved from these statistics alone
+
+With dtype = np.float32 the expansion and the chunk co-moments are computed
+in single precision and merged into float64 running statistics. Each chunk is
+centered before its product, which keeps the float32 rounding small; fits
+whose system is too ill-conditioned for it are refined from float64 statistics
+'''
+
+import numpy as np
+import pandas as pd
+
+from validation_tools import gram_solve
+
+
+def expand_features(x_primary, orders, powers, dtype = np.float64):
+
+    '''
+    Expand the primary descriptors into the polynomial descriptors
+    x_primary: (n, n_primary) array of primary descriptors
+    orders: numerical orders, the natural log is appended as in transformers
+    powers: rows of PolynomialFeatures.powers_ kept, e.g. poly.powers_[poly_indices_nonrepeat]
+    dtype: np.float32 halves the memory of the expanded chunk
+    '''
+    x_primary = np.asarray(x_primary, dtype = dtype)
+    if x_primary.ndim == 1: x_primary = x_primary[:, None]
+
+    # secondary descriptors, same column order as transformers
+    x_secondary = []
+    for xi in x_primary.T:
+        x_secondary += [xi**oi for oi in orders] + [np.log(xi)]
+    x_secondary = np.stack(x_secondary, axis = 1)
+
+    powers = np.asarray(powers)
+    X_chunk = np.ones((len(x_primary), len(powers)), dtype = dtype)
+    for j in range(x_secondary.shape[1]):
+        for pj in np.unique(powers[:, j]):
+            if pj == 0: continue
+            X_chunk[:, powers[:, j] == pj] *= x_secondary[:, [j]]**pj
+
+    return X_chunk
+
+
+def read_csv_chunks(filename, primary_names, target_name, chunksize = 100000):
+
+    '''
+    Stream (primary descriptors, target) row chunks from a csv file
+    '''
+    for data in pd.read_csv(filename, header = 0, chunksize = chunksize):
+        yield np.array(data[primary_names], dtype = float), np.array(data[target_name], dtype = float)
+
+
+def init_stats(n_features):
+
+    '''
+    Empty running statistics for n_features descriptors and one target
+    '''
+    return {'n': 0,
+            'dtype': 'float64',
+            'mean': np.zeros(n_features + 1),
+            'comoment': np.zeros((n_features + 1, n_features + 1))}
+
+
+def update_stats(stats, X_chunk, y_chunk):
+
+    '''
+    Merge a chunk into the running statistics (Chan et al. pairwise update)
+    The target is carried as the last column so X^T y is updated with X^T X
+    '''
+    Z = np.concatenate((X_chunk, np.reshape(y_chunk, (-1, 1)).astype(X_chunk.dtype)), axis = 1)
+    n_chunk = len(Z)
+    if n_chunk == 0: return stats
+
+    # the chunk product runs in the chunk precision, the merge in float64
+    mean_chunk = Z.mean(axis = 0, dtype = np.float64)
+    Z_centered = Z - mean_chunk.astype(Z.dtype)
+    comoment_chunk = np.dot(Z_centered.T, Z_centered).astype(np.float64)
+
+    n = stats['n'] + n_chunk
+    delta = mean_chunk - stats['mean']
+    stats['comoment'] += comoment_chunk + np.outer(delta, delta) * stats['n'] * n_chunk / n
+    stats['mean'] += delta * n_chunk / n
+    stats['n'] = n
+
+    return stats
+
+
+def stream_stats(chunks, orders, powers, dtype = np.float64):
+
+    '''
+    Accumulate the statistics from an iterable of (primary descriptors, target) chunks
+    The first column (all ones, the intercept) is not scaled, as in training
+    dtype: precision of the expansion and of the chunk products
+    '''
+    stats = None
+    for x_chunk, y_chunk in chunks:
+        X_chunk = expand_features(x_chunk, orders, powers, dtype)
+        X_chunk = X_chunk[:, 1:]
+        if stats is None:
+            stats = init_stats(X_chunk.shape[1])
+            stats['dtype'] = np.dtype(dtype).name
+        update_stats(stats, X_chunk, y_chunk)
+
+    return stats
+
+
+def scaled_gram(stats):
+
+    '''
+    Gram matrix and X^T y of the standardized design [1, (X - mean)/scale]
+    mean and scale match StandardScaler (population variance, zero scale set to 1)
+    '''
+    n = stats['n']
+    mv = stats['mean'][:-1]
+    y_mean = stats['mean'][-1]
+    C = stats['comoment']
+
+    sv = np.sqrt(np.diag(C)[:-1] / n)
+    sv[sv == 0.0] = 1.0
+
+    n_features = len(mv) + 1
+    G = np.zeros((n_features, n_features))
+    G[0, 0] = n
+    G[1:, 1:] = C[:-1, :-1] / np.outer(sv, sv)
+
+    b = np.zeros(n_features)
+    b[0] = n * y_mean
+    b[1:] = C[:-1, -1] / sv
+
+    yy = C[-1, -1] + n * y_mean**2
+
+    return G, b, yy, mv, sv
+
+
+def gram_enet(G, b, n, alpha, l1_ratio = 1.0, max_iter = 10000, tol = 0.001, coef_init = None, yy = None):
+
+    '''
+    Coordinate descent for LASSO/Enet from the Gram matrix G = X^T X and b = X^T y
+    Minimizes the same objective as sklearn ElasticNet with fit_intercept = False,
+    1/(2n) ||y - Xw||^2 + alpha*l1_ratio*||w||_1 + 0.5*alpha*(1 - l1_ratio)*||w||^2
+    With yy = y^T y given, it stops on the duality gap < tol*yy as sklearn does,
+    otherwise on the relative coefficient change < tol
+    return the coefficients and the number of iterations
+    '''
+    n_features = len(b)
+    w = np.zeros(n_features) if coef_init is None else np.array(coef_init, dtype = float)
+    # q = b - G w, the correlation of the residual with each descriptor
+    q = b - np.dot(G, w)
+
+    l1 = n * alpha * l1_ratio
+    l2 = n * alpha * (1.0 - l1_ratio)
+    G_diag = np.diag(G)
+
+    for n_iter in range(1, max_iter + 1):
+
+        w_max = 0.0
+        d_w_max = 0.0
+        for j in range(n_features):
+            if G_diag[j] == 0.0: continue
+            w_j = w[j]
+            rho = q[j] + G_diag[j] * w_j
+            w[j] = np.sign(rho) * max(abs(rho) - l1, 0.0) / (G_diag[j] + l2)
+            if w[j] != w_j:
+                q -= G[:, j] * (w[j] - w_j)
+            d_w_max = max(d_w_max, abs(w[j] - w_j))
+            w_max = max(w_max, abs(w[j]))
+
+        if w_max == 0.0 or d_w_max / w_max < tol:
+            if yy is None: break
+
+            # duality gap, as in sklearn enet_coordinate_descent_gram
+            XtA = q - l2 * w
+            dual_norm_XtA = np.max(np.abs(XtA))
+            R_norm2 = yy - 2 * np.dot(w, b) + np.dot(w, b - q)
+            if dual_norm_XtA > l1:
+                const = l1 / dual_norm_XtA
+                gap = 0.5 * R_norm2 * (1 + const**2)
+            else:
+                const = 1.0
+                gap = R_norm2
+            gap += l1 * np.sum(np.abs(w)) - const * yy + const * np.dot(b, w) \
+                + 0.5 * l2 * (1 + const**2) * np.dot(w, w)
+            if gap < tol * yy: break
+
+    return w, n_iter
+
+
+def system_condition(G, n, family, alpha = 0.0, l1_ratio = 1.0, columns = None):
+
+    '''
+    Condition number of the system solved by a fit on the given columns,
+    G + alpha*I for Ridge (as gram_solve) and G + n*alpha*(1 - l1_ratio)*I for Enet
+    '''
+    if columns is None: columns = np.arange(len(G))
+    G_sub = G[np.ix_(columns, columns)]
+    if family == 'Ridge': G_sub = G_sub + alpha * np.eye(len(G_sub))
+    if family == 'Enet': G_sub = G_sub + n * alpha * (1 - l1_ratio) * np.eye(len(G_sub))
+    if len(G_sub) == 0: return 1.0
+    return np.linalg.cond(G_sub)
+
+
+def fit_from_stats(stats, family, alpha = 0.0, l1_ratio = 1.0, columns = None, coef_init = None,
+                   stats64 = None, rtol = 1e-3):
+
+    '''
+    Fit OLS, Ridge, DSL (OLS on columns) or LASSO/Enet from the accumulated statistics
+    return the normalized coefficients, the unnormalized coefficients and the
+    training RMSE, without ever holding the design matrix
+    stats64: float64 statistics, or a function returning them (e.g. a second pass
+    over the chunks), used when stats are float32 and the condition number of the
+    system (on the active descriptors for LASSO/Enet) times the float32 epsilon
+    exceeds rtol
+    '''
+    G, b, yy, mv, sv = scaled_gram(stats)
+    n_features = len(b)
+    if columns is None: columns = np.arange(n_features)
+    columns = np.asarray(columns)
+    G_sub, b_sub = G[np.ix_(columns, columns)], b[columns]
+
+    coefs = np.zeros(n_features)
+    if family in ['OLS', 'Ridge']:
+        coefs[columns] = gram_solve(G_sub, b_sub, family, alpha)
+        active = columns
+    elif family in ['LASSO', 'Enet']:
+        w_init = None if coef_init is None else np.asarray(coef_init)[columns]
+        coefs[columns], _ = gram_enet(G_sub, b_sub, stats['n'], alpha, l1_ratio, coef_init = w_init, yy = yy)
+        active = np.flatnonzero(coefs)
+    else:
+        raise ValueError('Unknown model family {}'.format(family))
+
+    if stats.get('dtype') == 'float32' and stats64 is not None:
+        condition = system_condition(G, stats['n'], family, alpha, l1_ratio, active)
+        if condition * np.finfo(np.float32).eps > rtol:
+            if callable(stats64): stats64 = stats64()
+            return fit_from_stats(stats64, family, alpha, l1_ratio, columns, coefs)
+
+    # the same conversion as in the training scripts
+    coefs_unnormalized = np.zeros_like(coefs)
+    coefs_unnormalized[1:] = coefs[1:]/sv
+    coefs_unnormalized[0] = coefs[0] - np.sum(mv/sv*coefs[1:])
+
+    rss = yy - 2 * np.dot(coefs, b) + np.dot(coefs, np.dot(G, coefs))
+    RMSE = np.sqrt(max(rss, 0.0) / stats['n'])
+
+    return coefs, coefs_unnormalized, RMSE
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Utility functions to search for small descriptor subsets
+"""
+
+'''
+Exhaustive best-subset search over the polynomial descriptors, in the spirit of SISSO
+All linear models with 1 to max_terms descriptors (plus the intercept column)
+are scored by the cross-validation RMSE. The subsets are solved in batches
+from the per-fold Gram matrices, so no design matrix is ever refitted
+'''
+
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+
+def fold_grams(X, y, folds):
+
+    '''
+    Gram matrices of the full data and of each test fold
+    The training Gram of a fold is the full Gram downdated by its test rows
+    return a dictionary of arrays
+    '''
+    X = np.asarray(X, dtype = float)
+    y = np.asarray(y, dtype = float)
+
+    G = np.dot(X.T, X)
+    b = np.dot(X.T, y)
+
+    G_test = np.array([np.dot(X[test].T, X[test]) for _, test in folds])
+    b_test = np.array([np.dot(X[test].T, y[test]) for _, test in folds])
+    yy_test = np.array([np.dot(y[test], y[test]) for _, test in folds])
+    n_test = np.array([len(test) for _, test in folds])
+
+    return {'G': G, 'b': b, 'yy': np.dot(y, y), 'n': len(y),
+            'G_train': G - G_test, 'b_train': b - b_test,
+            'yy_train': np.dot(y, y) - yy_test,
+            'G_test': G_test, 'b_test': b_test, 'yy_test': yy_test, 'n_test': n_test}
+
+
+def _batch_rss(G, b, yy, subsets, jitter = 1e-10):
+
+    '''
+    Residual sum of squares of OLS fits for a batch of subsets
+    G: (..., p, p), b: (..., p), yy: (...), subsets: (m, s) column indices
+    return the coefficients (..., m, s) and the RSS (..., m)
+    '''
+    G_sub = G[..., subsets[:, :, None], subsets[:, None, :]]
+    b_sub = b[..., subsets]
+    # tiny diagonal shift keeps exactly collinear subsets solvable
+    G_sub = G_sub + jitter * np.trace(G_sub, axis1 = -2, axis2 = -1)[..., None, None] * np.eye(subsets.shape[1])
+    w = np.linalg.solve(G_sub, b_sub[..., None])[..., 0]
+    rss = yy[..., None] - np.sum(w * b_sub, axis = -1)
+
+    return w, np.maximum(rss, 0.0)
+
+
+def _cv_rmse(grams, subsets):
+
+    '''
+    Cross-validation RMSE, the square root of the MSE averaged over the folds
+    '''
+    w, _ = _batch_rss(grams['G_train'], grams['b_train'], grams['yy_train'], subsets)
+
+    G_test = grams['G_test'][:, subsets[:, :, None], subsets[:, None, :]]
+    b_test = grams['b_test'][:, subsets]
+    rss_test = grams['yy_test'][:, None] - 2 * np.sum(w * b_test, axis = -1) \
+        + np.einsum('kmi,kmij,kmj->km', w, G_test, w)
+    mse_test = np.maximum(rss_test, 0.0) / grams['n_test'][:, None]
+
+    return np.sqrt(np.mean(mse_test, axis = 0))
+
+
+def subset_search(X, y, folds, max_terms = 3, n_top = 10, feature_names = None,
+                  intercept_index = 0, prune = True, chunk_size = 20000, n_jobs = 1):
+
+    '''
+    Enumerate all linear models with 1 to max_terms descriptors
+    X: scaled descriptors with the intercept column at intercept_index
+    folds: list of (train_index, test_index), e.g. list(rkf.split(X_train))
+    The subsets are visited in order of their training RMSE on the full data,
+    which bounds the CV RMSE from below (exactly for leave-one-out, and in
+    practice for K-fold), so once it exceeds the n_top-th best CV RMSE the
+    remaining subsets are pruned
+    Chunks of subsets are scored in parallel
+    return a dataframe of the n_top models per number of terms and the
+    Pareto front of number of terms vs CV RMSE
+    '''
+    X = np.asarray(X, dtype = float)
+    n_features = X.shape[1]
+    if feature_names is None: feature_names = [str(i) for i in range(n_features)]
+    candidates = [i for i in range(n_features) if i != intercept_index]
+
+    grams = fold_grams(X, y, folds)
+
+    rows = []
+    for n_terms in range(1, max_terms + 1):
+
+        subsets = np.array([(intercept_index,) + ci for ci in combinations(candidates, n_terms)])
+
+        # training RMSE on the full data, the lower bound used for pruning
+        train_RMSE = np.concatenate([
+            np.sqrt(_batch_rss(grams['G'], grams['b'], np.array(grams['yy']), subsets[i: i + chunk_size])[1] / grams['n'])
+            for i in range(0, len(subsets), chunk_size)])
+        order = np.argsort(train_RMSE, kind = 'mergesort')
+
+        best_subsets = np.zeros((0, n_terms + 1), dtype = int)
+        best_CV = np.zeros(0)
+        best_train = np.zeros(0)
+        n_scored = 0
+        round_size = chunk_size * max(1, abs(n_jobs))
+
+        for start in range(0, len(order), round_size):
+
+            visit = order[start: start + round_size]
+            if prune and len(best_CV) == n_top:
+                # drop the subsets whose bound cannot beat the current top models
+                visit = visit[train_RMSE[visit] < best_CV.max()]
+                if len(visit) == 0: break
+
+            CV_RMSE = np.concatenate(Parallel(n_jobs = n_jobs)(
+                delayed(_cv_rmse)(grams, subsets[visit[i: i + chunk_size]])
+                for i in range(0, len(visit), chunk_size)))
+            n_scored += len(visit)
+
+            best_subsets = np.concatenate((best_subsets, subsets[visit]))
+            best_CV = np.concatenate((best_CV, CV_RMSE))
+            best_train = np.concatenate((best_train, train_RMSE[visit]))
+            keep = np.argsort(best_CV, kind = 'mergesort')[:n_top]
+            best_subsets, best_CV, best_train = best_subsets[keep], best_CV[keep], best_train[keep]
+
+        for si, CV_i, train_i in zip(best_subsets, best_CV, best_train):
+            terms = [feature_names[ci] for ci in si if ci != intercept_index]
+            rows.append({'n_terms': n_terms,
+                         'terms': ' + '.join(terms),
+                         'columns': list(si),
+                         'CV_RMSE': CV_i,
+                         'train_RMSE': train_i,
+                         'n_subsets': len(subsets),
+                         'n_scored': n_scored})
+
+    results = pd.DataFrame(rows, columns = ['n_terms', 'terms', 'columns', 'CV_RMSE', 'train_RMSE', 'n_subsets', 'n_scored'])
+
+    # Pareto front: the best model per number of terms that improves on all smaller ones
+    best_per_size = results.loc[results.groupby('n_terms')['CV_RMSE'].idxmin()]
+    pareto = best_per_size[best_per_size['CV_RMSE'] < best_per_size['CV_RMSE'].cummin().shift(1, fill_value = np.inf)]
+
+    return results, pareto.reset_index(drop = True)
@@ -19,6 +19,10 @@
 # 
 # - [Genetic Programming (GP) based on sybomlic regression](#enet)
 # 
+# - [Gaussian process regression (GPR)](#GPR), a probabilistic baseline
+# 
+# - [Random forest, gradient boosting and kernel ridge](#nonlinear), nonlinear baselines
+# 
 # 
 # 
 # The primary physical descriptors (features) include 
@@ -33,13 +37,16 @@
 # 
 # __DSL__ - $ E_a \propto (E_{bind})^2/E_c $ 
 # 
-# The performance of DSL is compared with other ML [models](#models) and across [supports](#supports) and [metals](#metals)
+# The performance of DSL is compared with other ML [models](#models) in [one report](#report) and across [supports](#supports) and [metals](#metals)
+# 
+# Every model is also [fitted per support and per metal](#groups) to see where the universal law fails
 # 
 
 # %%
 #%% Import all necessary libraries 
 
 import os
+import time
 import numpy as np
 import pandas as pd
 import seaborn as sns
@@ -64,6 +71,13 @@ from sklearn.preprocessing import PolynomialFeatures, StandardScaler
 
 # import customized plotting functions
 import regression_tools as rtools
+# import the seeding of parallel tasks
+import seed_tools as sdtools
+# the path and coefficient heatmap figures are only saved as data (*.fig.npz),
+# render them on demand with render_plots.py or set to True to draw them here
+rtools.render_figures = False
+# import customized run recording functions
+import run_store as rstore
 
 # Set plotting format
 font = {'size'   : 20}
@@ -93,6 +107,11 @@ Ec = np.array(data['Ec']) # cohesive energy of the metal
 Ebind = np.array(data['Ebind']) #binding energy of the single atom
 Ea = np.array(data['Ea']) # Diffusion barrier of the single atom onto the support
 
+# Start recording the run, the input data is hashed into its manifest
+run = rstore.start_run(os.path.join(os.getcwd(), 'runs'), ['Ea_data.csv'])
+rstore.lap(run, 'data')
+
+
 # %% [markdown]
 # ### Step 2 - Generate the descriptors (features)
 
@@ -219,6 +238,8 @@ repeated_indices = [16, 18, 27, 29, 40, 49, 83, 85, 87, 89, 93, 95]
 poly_indices_nonrepeat = [poly_indices_nonrepeat[i] for i in range(0, len(poly_indices_nonrepeat)) if i not in repeated_indices]
 x_features_poly_combined = [x_features_poly_combined[i] for i in range(0, len(x_features_poly_combined)) if i not in repeated_indices]
 x_features_poly = [x_features_poly[i] for i in range(0, len(x_features_poly)) if i not in repeated_indices]
+rstore.lap(run, 'descriptors')
+
 
 # %% [markdown]
 # ### Step 3 - Scaling the features to zero mean and unit variance
@@ -237,6 +258,8 @@ mv = scaler.mean_
 X = X_before_scaling.copy()
 X[:,1:] = scaler.transform(X_before_scaling[:,1:])
 fit_int_flag = False # Not fitting for intercept, as the first coefficient is the intercept
+rstore.lap(run, 'scaling')
+
 
 # %% [markdown]
 # ### Step 4 - Set the cross-validation scheme
@@ -247,6 +270,10 @@ fit_int_flag = False # Not fitting for intercept, as the first coefficient is th
 
 # Set random state here
 random_state = 0
+# Every task that draws random numbers (stability pairs, search trials, forests, MC screening)
+# gets its own seed derived from it, so the results do not depend on the number of workers.
+# The data splits keep the root seed, the coordinate descent paths and Ridge draw none
+seeds = sdtools.SeedTree(random_state)
 # Train test split, save 20% of data point to the test set
 X_train, X_test, y_train, y_test, X_before_train, X_before_test = train_test_split(X, y, X_before_scaling, test_size=0.2, random_state = random_state)
                     
@@ -255,7 +282,7 @@ X_train, X_test, y_train, y_test, X_before_train, X_before_test = train_test_spl
 alphas_grid = np.logspace(0, -3, 20)
 
 # Cross-validation scheme                                  
-rkf = RepeatedKFold(n_splits = 10, n_repeats = 10 , random_state =random_state)
+rkf = RepeatedKFold(n_splits = 10, n_repeats = 10 , random_state = random_state)
 
 # Explicitly take out the train/test set
 X_cv_train, y_cv_train, X_cv_test, y_cv_test = [],[],[],[]
@@ -265,7 +292,13 @@ for train_index, test_index in rkf.split(X_train):
     y_cv_train.append(y_train[train_index])
     X_cv_test.append(X_train[test_index])
     y_cv_test.append(y_train[test_index])
-    
+
+# Record the configuration of the run
+run['config'].update({'orders': orders, 'repeated_indices': repeated_indices, 'test_size': 0.2,
+                      'n_splits': 10, 'n_repeats': 10, 'alphas_grid': alphas_grid})
+run['seeds']['random_state'] = random_state
+rstore.lap(run, 'cross validation')
+
 
 # %% [markdown]
 # ### Step 5 - Train ML models
@@ -283,31 +316,34 @@ base_dir = os.getcwd()
 output_dir = os.path.join(base_dir, model_name)
 if not os.path.exists(output_dir): os.makedirs(output_dir)    
 
-lasso_cv  = LassoCV(cv = rkf,  max_iter = 1e7, tol = 0.001, fit_intercept=fit_int_flag, random_state=random_state)
-lasso_cv.fit(X_train, y_train)
-
-# the optimal alpha from lassocv
-lasso_alpha = lasso_cv.alpha_
+# One path on the alpha grid of LassoCV holds the folds and the whole training set, 
+# the optimal alpha and its model are read from it, as LassoCV would select and refit them
+lasso_path_results = rtools.cal_path(rtools.alpha_grid(X_train, y_train), Lasso, X_cv_train, y_cv_train, X_cv_test, y_cv_test, 
+                                     fit_int_flag, X_train, y_train)
+lasso_alpha_index = lasso_path_results.best_index()
+# the optimal alpha
+lasso_alpha = lasso_path_results.alphas[lasso_alpha_index]
 # Coefficients for each term
-lasso_coefs = lasso_cv.coef_
+lasso_coefs = lasso_path_results.full_coefs[lasso_alpha_index]
 # The original intercepts 
-lasso_intercept = lasso_cv.intercept_
+lasso_intercept = lasso_path_results.full_intercepts[lasso_alpha_index]
 
 # Access the errors 
-y_predict_test = lasso_cv.predict(X_test)
-y_predict_train = lasso_cv.predict(X_train)
+y_predict_test = np.dot(X_test, lasso_coefs) + lasso_intercept
+y_predict_train = np.dot(X_train, lasso_coefs) + lasso_intercept
 
 
 lasso_RMSE_test = np.sqrt(mean_squared_error(y_test, y_predict_test))
 lasso_RMSE_train = np.sqrt(mean_squared_error(y_train, y_predict_train))
 lasso_r2_train = r2_score(y_train, y_predict_train)
 
-# Use alpha grid prepare for lassopath
-lasso_RMSE_path, lasso_coef_path = rtools.cal_path(alphas_grid, Lasso, X_cv_train, y_cv_train, X_cv_test, y_cv_test, fit_int_flag)
-rtools.plot_path(X, y, lasso_alpha, alphas_grid, lasso_RMSE_path, lasso_coef_path, lasso_cv, model_name, output_dir)
+# Plot the path from the stored results
+lasso_RMSE_path, lasso_coef_path = lasso_path_results.RMSE_path, lasso_path_results.coef_path
+lasso_path_results.save(os.path.join(output_dir, model_name + '_path.npz'))
+rtools.plot_path(X, y, lasso_alpha, lasso_path_results.alphas, lasso_RMSE_path, lasso_coef_path, None, model_name, output_dir)
 # Plot the parity plot 
-lasso_RMSE, lasso_r2 = rtools.parity_plot(y, lasso_cv.predict(X), model_name, output_dir, lasso_RMSE_test)
-lasso_prediction = lasso_cv.predict(X)
+lasso_prediction = np.dot(X, lasso_coefs) + lasso_intercept
+lasso_RMSE, lasso_r2 = rtools.parity_metrics(y, lasso_prediction)
 
 # The indices for non-zero coefficients/significant cluster interactions 
 J_index = np.nonzero(lasso_coefs)[0]
@@ -330,6 +366,8 @@ lasso_coefs_unnormalized[0] = lasso_coefs[0] - np.sum(mv/sv*lasso_coefs[1:])
 # Plot coefficients matrix
 lasso_coef_matrix = rtools.make_coef_matrix(x_feature_nonzero, J_nonzero, n_features, x_secondary_feature_names)
 rtools.plot_tri_correlation_matrix(lasso_coef_matrix, output_dir, x_plot_feature_names, model_name)
+rstore.lap(run, 'LASSO')
+
 
 # %% [markdown]
 # #### Ridge regression<a name="ridge"></a>
@@ -347,46 +385,53 @@ output_dir = os.path.join(base_dir, model_name)
 if not os.path.exists(output_dir): os.makedirs(output_dir)    
 
 alphas_grid_ridge = np.logspace(0, -3, 20)
-ridgeCV = RidgeCV(alphas = alphas_grid_ridge,  cv = rkf, fit_intercept=fit_int_flag)
-ridgeCV.fit(X_train, y_train)
-ridge_alpha = ridgeCV.alpha_ 
-ridge_intercept = ridgeCV.intercept_ 
-ridge_coefs = ridgeCV.coef_
+# the alpha is selected from the stored path as RidgeCV would, by the mean test MSE over the folds
+ridge_path_results = rtools.cal_path(alphas_grid_ridge, Ridge, X_cv_train, y_cv_train, X_cv_test, y_cv_test, fit_int_flag, X_train, y_train)
+ridge_alpha_index = ridge_path_results.best_index()
+ridge_alpha = ridge_path_results.alphas[ridge_alpha_index]
+ridge_intercept = ridge_path_results.full_intercepts[ridge_alpha_index]
+ridge_coefs = ridge_path_results.full_coefs[ridge_alpha_index]
 
 # Access the errors 
-y_predict_test = ridgeCV.predict(X_test)
-y_predict_train = ridgeCV.predict(X_train)
+y_predict_test = np.dot(X_test, ridge_coefs) + ridge_intercept
+y_predict_train = np.dot(X_train, ridge_coefs) + ridge_intercept
 
 ridge_RMSE_test = np.sqrt(mean_squared_error(y_test, y_predict_test))
 ridge_RMSE_train = np.sqrt(mean_squared_error(y_train, y_predict_train))
 ridge_r2_train = r2_score(y_train, y_predict_train)   
 
 # plot the rigde path
-ridge_RMSE_path, ridge_coef_path = rtools.cal_path(alphas_grid_ridge, Ridge, X_cv_train, y_cv_train, X_cv_test, y_cv_test, fit_int_flag)
+ridge_RMSE_path, ridge_coef_path = ridge_path_results.RMSE_path, ridge_path_results.coef_path
+ridge_path_results.save(os.path.join(output_dir, model_name + '_path.npz'))
 rtools.plot_RMSE_path(ridge_alpha, alphas_grid_ridge, ridge_RMSE_path, model_name, output_dir)
 # Plot the parity plot 
-ridge_RMSE, ridge_r2 = rtools.parity_plot(y, ridgeCV.predict(X), model_name, output_dir, ridge_RMSE_test)
+ridge_prediction = np.dot(X, ridge_coefs) + ridge_intercept
+ridge_RMSE, ridge_r2 = rtools.parity_metrics(y, ridge_prediction)
 
 '''
 Convert the coefficient to unnormalized form
 '''
 ridge_coefs_unnormalized = np.zeros_like(ridge_coefs)
 ridge_coefs_unnormalized[1:] = ridge_coefs[1:]/sv
-ridge_coefs_unnormalized[0] = ridge_coefs[0] - np.sum(mv/sv*lasso_coefs[1:])
+ridge_coefs_unnormalized[0] = ridge_coefs[0] - np.sum(mv/sv*ridge_coefs[1:])
 
 # Plot coefficients matrix
 ridge_coef_matrix = rtools.make_coef_matrix(x_features_poly, ridge_coefs, n_features, x_secondary_feature_names)
 rtools.plot_tri_correlation_matrix(ridge_coef_matrix, output_dir, x_plot_feature_names, model_name)
-ridge_prediction = ridgeCV.predict(X)
+rstore.lap(run, 'Ridge')
+
 
 # %% [markdown]
 # #### Elastic net<a name="enet"></a>
 # 
-# The L1 ratio is varied and the best model is selected based on testing RMSE
+# The L1 ratio is varied and the best model is selected on the cross-validation errors stored by ElasticNetCV, the test set is only used to report its RMSE
 
 # %%
 #%% elastic net results
 
+# import customized selection functions
+import selection_tools as seltools
+
 model_name = 'enet'
 output_dir = os.path.join(base_dir, model_name)
 if not os.path.exists(output_dir): os.makedirs(output_dir)    
@@ -397,7 +442,7 @@ def l1_enet(ratio):
     input l1 ratio and return the model, non zero coefficients and cv scores
     training elastic net properly
     '''
-    enet_cv  = ElasticNetCV(cv = rkf, l1_ratio=ratio,  max_iter = 1e7, tol = 0.001, fit_intercept=fit_int_flag, random_state= random_state)
+    enet_cv  = ElasticNetCV(cv = rkf, l1_ratio=ratio,  max_iter = 1e7, tol = 0.001, fit_intercept=fit_int_flag, random_state = random_state)
     enet_cv.fit(X_train, y_train)
     
     # the optimal alpha
@@ -475,11 +520,15 @@ fig.savefig(os.path.join(output_dir, 'elastic_net.png'))
 '''
 # Use alpha grid prepare for enet_path when RMSE is mininal 
 '''
-enet_RMSE_path, enet_coef_path = rtools.cal_path(alphas_grid, ElasticNet, X_cv_train, y_cv_train, X_cv_test, y_cv_test, fit_int_flag)    
-enet_min_index = np.argmin(enet_RMSE_test)
+enet_path_l1_ratio = 0.5 # the l1 ratio of the path, also recorded in the Pareto front
+enet_path_results = rtools.cal_path(alphas_grid, ElasticNet, X_cv_train, y_cv_train, X_cv_test, y_cv_test, fit_int_flag, 
+                                    X_train, y_train, l1_ratio = enet_path_l1_ratio)
+enet_RMSE_path, enet_coef_path = enet_path_results.RMSE_path, enet_path_results.coef_path
+# the l1 ratio with the lowest mean CV MSE, at the alpha ElasticNetCV selected for it
+enet_min_index = seltools.enet_selection(enet, 'min')[0]
 l1s_min = l1s[enet_min_index] 
 enet_min = enet[enet_min_index]
-enet_min_RMSE_test = np.amin(enet_RMSE_test)
+enet_min_RMSE_test = enet_RMSE_test[enet_min_index]
 rtools.plot_path(X, y, enet_alphas[enet_min_index], alphas_grid, enet_RMSE_path, enet_coef_path, enet[enet_min_index], model_name, output_dir)
 
 
@@ -505,13 +554,13 @@ J_nonzero = enet_min_coefs[J_index]
 x_feature_nonzero_combined = [x_features_poly_combined[pi] for pi in J_index]
 x_feature_nonzero = [x_features_poly[pi] for pi in J_index]
 # Plot the parity plot
-enet_min_RMSE, enet_min_r2 = rtools.parity_plot(y, enet_min.predict(X), model_name, output_dir, enet_min_RMSE_test)
+enet_min_prediction = enet_min.predict(X)
+enet_min_RMSE, enet_min_r2 = rtools.parity_metrics(y, enet_min_prediction)
 
 
 # Plot coefficients matrix
 enet_min_coef_matrix = rtools.make_coef_matrix(x_feature_nonzero, J_nonzero, n_features, x_secondary_feature_names)
 rtools.plot_tri_correlation_matrix(enet_min_coef_matrix, output_dir, x_plot_feature_names, model_name)
-enet_min_prediction = enet_min.predict(X)
 
 '''
 Convert the coefficient to unnormalized form
@@ -520,6 +569,8 @@ enet_min_coefs_unnormalized = np.zeros_like(enet_min_coefs)
 
 enet_min_coefs_unnormalized[1:] = enet_min_coefs[1:]/sv
 enet_min_coefs_unnormalized[0] = enet_min_coefs[0] - np.sum(mv/sv*enet_min_coefs[1:])
+rstore.lap(run, 'Enet')
+
 
 # %% [markdown]
 # #### Ordinary least square (OLS) regression<a name="OLS"></a>
@@ -543,13 +594,13 @@ OLS_r2_train = r2_score(y_train, y_predict_train)
 OLS_RMSE_test = np.sqrt(mean_squared_error(y_test, y_predict_test))
 OLS_RMSE_train = np.sqrt(mean_squared_error(y_train, y_predict_train))
 # Plot the parity plot
-OLS_RMSE, OLS_r2 = rtools.parity_plot(y, OLS.predict(X), model_name, output_dir, OLS_RMSE_test)
+OLS_prediction = OLS.predict(X)
+OLS_RMSE, OLS_r2 = rtools.parity_metrics(y, OLS_prediction)
 
 
 # Plot coefficients matrix
 OLS_coef_matrix = rtools.make_coef_matrix(x_features_poly, OLS_coefs, n_features, x_secondary_feature_names)
 rtools.plot_tri_correlation_matrix(OLS_coef_matrix, output_dir, x_plot_feature_names, model_name)
-OLS_prediction = OLS.predict(X)
 
 '''
 Convert the coefficient to unnormalized form
@@ -557,6 +608,8 @@ Convert the coefficient to unnormalized form
 OLS_coefs_unnormalized = np.zeros_like(OLS_coefs)
 OLS_coefs_unnormalized[1:] = OLS_coefs[1:]/sv
 OLS_coefs_unnormalized[0] = OLS_coefs[0] - np.sum(mv/sv*OLS_coefs[1:])
+rstore.lap(run, 'OLS')
+
 
 # %% [markdown]
 # #### Genetic Programming based on symbolic regression <a name="GP"></a>
@@ -594,13 +647,61 @@ GP_r2_train = r2_score(y_train, y_predict_train)
 GP_RMSE_test = np.sqrt(mean_squared_error(y_test, y_predict_test))
 GP_RMSE_train = np.sqrt(mean_squared_error(y_train, y_predict_train))
 # Plot the parity plot
-GP_RMSE, GP_r2 =rtools.parity_plot(y, GP_predict(X_GP), model_name, output_dir, GP_RMSE_test)
-GP_prediction =  GP_predict(X_GP)
+GP_prediction = GP_predict(X_GP)
+GP_RMSE, GP_r2 =rtools.parity_metrics(y, GP_prediction)
 
 # the normalized coefficients
 GP_coefs = np.zeros_like(GP_coefs_unnormalized)
 GP_coefs[1:] = GP_coefs_unnormalized[1:]*sv
 GP_coefs[0] = GP_coefs_unnormalized[0] + np.sum(mv/sv*GP_coefs_unnormalized[1:])
+rstore.lap(run, 'GP')
+
+
+# %% [markdown]
+# #### Gaussian process regression (GPR) <a name="GPR"></a>
+#
+# A probabilistic baseline on the primary descriptors $ E_c $ and $ E_{bind} $ with an RBF kernel. The length scales and the noise ratio are picked by the cross-validation RMSE on the same folds, one eigendecomposition per length scale serves all folds and noise ratios
+
+# %%
+#%% Gaussian process regression
+
+# import customized Gaussian process functions
+import gpr_tools as gtools
+
+model_name = 'GPR'
+output_dir = os.path.join(base_dir, model_name)
+if not os.path.exists(output_dir): os.makedirs(output_dir)
+
+primary_index = [x_features_poly_combined.index(xi + '_1') for xi in x_primary_feature_names]
+GPR_scaler = StandardScaler().fit(X_before_train[:, primary_index])
+X_GPR_train = GPR_scaler.transform(X_before_train[:, primary_index])
+X_GPR_test = GPR_scaler.transform(X_before_test[:, primary_index])
+X_GPR = GPR_scaler.transform(X_before_scaling[:, primary_index])
+
+# one length scale per primary descriptor
+length_scales_grid = [np.array([l1, l2]) for l1 in np.logspace(-0.5, 1, 8) for l2 in np.logspace(-0.5, 1, 8)]
+noise_ratios = np.logspace(-4, 0, 9)
+GPR_RMSE_path = gtools.gpr_cv(X_GPR_train, y_train, list(rkf.split(X_train)), length_scales_grid, noise_ratios)
+# the CV RMSE of every model is the square root of the test MSE averaged over the folds, as LassoCV selects
+GPR_CV_RMSE = np.sqrt(np.mean(GPR_RMSE_path**2, axis = 2))
+GPR_li, GPR_ri = np.unravel_index(np.argmin(GPR_CV_RMSE), GPR_RMSE_path.shape[:2])
+GPR_length_scales, GPR_noise_ratio = length_scales_grid[GPR_li], noise_ratios[GPR_ri]
+
+GPR = gtools.GPRModel(GPR_length_scales, GPR_noise_ratio).fit(X_GPR_train, y_train)
+
+# Access the errors
+y_predict_test = GPR.predict(X_GPR_test)
+y_predict_train = GPR.predict(X_GPR_train)
+GPR_r2_train = r2_score(y_train, y_predict_train)
+
+GPR_RMSE_test = np.sqrt(mean_squared_error(y_test, y_predict_test))
+GPR_RMSE_train = np.sqrt(mean_squared_error(y_train, y_predict_train))
+# Plot the parity plot, the predictive sigma includes the noise as it is compared with DFT values
+GPR_prediction, GPR_sigma = GPR.predict(X_GPR, return_std = True, include_noise = True)
+GPR_RMSE, GPR_r2 = rtools.parity_metrics(y, GPR_prediction)
+print('GPR length scales: {}, noise ratio: {:.1e}, test RMSE: {:.3f}'.format(np.round(GPR_length_scales, 3), GPR_noise_ratio, GPR_RMSE_test))
+rstore.lap(run, 'GPR')
+
 
 # %% [markdown]
 # #### Univerisal Diffusion Scaling relation (DSL) <a name="DSL"></a>
@@ -631,7 +732,8 @@ DSL_r2_train = r2_score(y_train, y_predict_train)
 DSL_RMSE_test = np.sqrt(mean_squared_error(y_test, y_predict_test))
 DSL_RMSE_train = np.sqrt(mean_squared_error(y_train, y_predict_train))
 # Plot the parity plot
-DSL_RMSE, DSL_r2 =rtools.parity_plot(y, DSL.predict(X_DSL), model_name, output_dir, DSL_RMSE_test)
+DSL_prediction = DSL.predict(X_DSL)
+DSL_RMSE, DSL_r2 =rtools.parity_metrics(y, DSL_prediction)
 
 # the unnormalized coefficients
 DSL_coefs_unnormalized = np.zeros_like(DSL_coefs)
@@ -639,7 +741,62 @@ DSL_coefs_unnormalized[1:] = DSL_coefs[1:]/sv
 DSL_coefs_unnormalized[0] = DSL_coefs[0] - np.sum(mv/sv*DSL_coefs[1:])
 u0= DSL_coefs_unnormalized[0] #intercept
 u1 = DSL_coefs_unnormalized[term_index] # the coefficient
-DSL_prediction = DSL.predict(X_DSL)
+rstore.lap(run, 'DSL')
+
+
+# %% [markdown]
+# #### Nonlinear models: random forest, gradient boosting and kernel ridge <a name="nonlinear"></a>
+# 
+# Trained on the primary descriptors (scaled as for the GPR) with the folds of the linear models, every (parameters, fold) pair is fitted in parallel. The prediction throughput on a batch of candidates is reported next to the test RMSE, to see what accuracy the closed-form DSL gives up for its speed
+
+# %%
+#%% Nonlinear models
+
+# import customized nonlinear model functions
+import nonlinear_tools as nltools
+import screening_tools as stools
+
+nonlinear_dir = os.path.join(base_dir, 'nonlinear')
+if not os.path.exists(nonlinear_dir): os.makedirs(nonlinear_dir)
+
+nonlinear_grids = {'RF': {'n_estimators': [100], 'max_depth': [None, 4], 'min_samples_leaf': [1, 3]},
+                   'GBM': {'n_estimators': [200], 'learning_rate': [0.05, 0.1], 'max_depth': [2, 3]},
+                   'KRR': {'alpha': np.logspace(-4, 0, 9), 'gamma': np.logspace(-2, 1, 7)}}
+nonlinear_models, nonlinear_predictions, nonlinear_RMSE_test = {}, {}, {}
+nonlinear_rows = []
+
+# the primary descriptors of a batch, scaled as the nonlinear models and the GPR were trained
+primary_matrix = lambda inputs: GPR_scaler.transform(np.column_stack([inputs[pi] for pi in x_primary_feature_names]))
+throughput_inputs = {pi: np.array(data[pi]) for pi in x_primary_feature_names}
+
+for family, grid in nonlinear_grids.items():
+    params_list, nonlinear_RMSE_path = nltools.cv_grid(family, grid, X_GPR_train, y_train, list(rkf.split(X_train)), 
+                                                       seeds.spawn('nonlinear'), n_jobs = -1)
+    model_i, params_i = nltools.fit_best(family, params_list, nonlinear_RMSE_path, X_GPR_train, y_train, 
+                                         seeds.spawn('nonlinear'), n_jobs = -1)
+    nonlinear_models[family] = model_i
+    nonlinear_predictions[family] = model_i.predict(X_GPR)
+    nonlinear_RMSE_test[family] = np.sqrt(mean_squared_error(y_test, model_i.predict(X_GPR_test)))
+    nonlinear_rows.append({'model': family, 'params': str(params_i), 
+                           'CV_RMSE': np.sqrt(np.mean(nonlinear_RMSE_path**2, axis = 1)).min(), 'RMSE_test': nonlinear_RMSE_test[family],
+                           'rows_per_second': nltools.prediction_throughput(lambda b: model_i.predict(primary_matrix(b)), throughput_inputs)})
+
+# the linear scaling laws evaluated from their unnormalized coefficients, as in screening
+lasso_terms = np.flatnonzero(lasso_coefs_unnormalized)
+linear_predictors = {'DSL': (lambda b: stools.DSL_predict(b['Ebind'], b['Ec'], u1, u0), np.nan, DSL_RMSE_test),
+                     'LASSO': (lambda b: stools.predict_from_coefficients(b, [x_features_poly_combined[ti] for ti in lasso_terms], 
+                                                                         lasso_coefs_unnormalized[lasso_terms], x_primary_feature_names),
+                               np.sqrt(np.mean(lasso_path_results.RMSE_test[:, lasso_alpha_index]**2)), lasso_RMSE_test),
+                     'GPR': (lambda b: GPR.predict(primary_matrix(b)), GPR_CV_RMSE.min(), GPR_RMSE_test)}
+for mi, (predict_i, CV_RMSE_i, RMSE_test_i) in linear_predictors.items():
+    nonlinear_rows.append({'model': mi, 'params': '', 'CV_RMSE': CV_RMSE_i, 'RMSE_test': RMSE_test_i,
+                           'rows_per_second': nltools.prediction_throughput(predict_i, throughput_inputs)})
+
+nonlinear_df = pd.DataFrame(nonlinear_rows)
+nonlinear_df.to_csv(os.path.join(nonlinear_dir, 'accuracy_throughput.csv'), index=False)
+print(nonlinear_df[['model', 'CV_RMSE', 'RMSE_test', 'rows_per_second']])
+rstore.lap(run, 'nonlinear')
+
 
 # %% [markdown]
 # ### Step 6 - Compare models 
@@ -686,6 +843,42 @@ ax2.set_ylim([0.9, 1])
 ax2.tick_params('y', colors='royalblue')
 plt.tight_layout()
 fig.savefig(os.path.join(output_dir, model_name + '_performance.png'))
+rstore.lap(run, 'compare')
+
+
+# %% [markdown]
+# #### Report of all models from one prediction matrix <a name="report"></a>
+# 
+# The parity, error and error distribution of every model and its RMSE per support and per metal are drawn in one figure, from one prediction of the whole dataset per model. The parity figure of each model and the DSL figures below are drawn from the same predictions
+
+# %%
+#%% Batched parity/error report
+
+report_models = ['DSL', 'LASSO', 'Enet', 'Ridge', 'OLS', 'GP', 'GPR'] + list(nonlinear_models)
+report_RMSE_test = [DSL_RMSE_test, lasso_RMSE_test, enet_min_RMSE_test, ridge_RMSE_test, OLS_RMSE_test, GP_RMSE_test, GPR_RMSE_test] + \
+                   [nonlinear_RMSE_test[mi] for mi in nonlinear_models]
+# each model predicts the whole dataset only once
+Y_prediction = np.array([DSL_prediction, lasso_prediction, enet_min_prediction, 
+                         ridge_prediction, OLS_prediction, np.ravel(GP_prediction), GPR_prediction] + 
+                        [nonlinear_predictions[mi] for mi in nonlinear_models])
+
+support_labels = [r'$\rm CeO_{2}(100)$', r'$\rm CeO_{2}(111)$', 'Graphene', 'MgO(100)', '2H-'+r'$\rm MoS_{2}(0001)$', r'$\rm SrTiO_{3}(100)$',
+                  'Steps of ' + r'$\rm CeO_{2}$', r'$\rm TiO_{2}(110)$', 'ZnO(100)']
+# the parity, error, error distribution and per support/metal RMSE of every model in one figure
+report_metrics, report_group_metrics = rtools.plot_report(y, Y_prediction, report_models, {'support': support, 'metal': metal}, 
+                                                          output_dir, 'report', report_RMSE_test, {'support': support_labels})
+report_metrics.to_csv(os.path.join(output_dir, 'report_metrics.csv'), index=False)
+report_group_metrics.to_csv(os.path.join(output_dir, 'report_group_metrics.csv'), index=False)
+
+# the parity figure of each linear/GP model in its own folder, from the same predictions
+report_dirs = {'DSL': 'DSL', 'LASSO': 'lasso', 'Enet': 'enet', 'Ridge': 'ridge', 'OLS': 'OLS', 'GP': 'GP', 'GPR': 'GPR'}
+for mi, y_pred_i, RMSE_test_i in zip(report_models, Y_prediction, report_RMSE_test):
+    if mi in report_dirs: 
+        rtools.parity_plot(y, y_pred_i, report_dirs[mi], os.path.join(base_dir, report_dirs[mi]), RMSE_test_i)
+DSL_prediction = Y_prediction[report_models.index('DSL')]
+rtools.error_distribution(y, DSL_prediction, model_name, output_dir)
+rstore.lap(run, 'report')
+
 
 # %% [markdown]
 # #### DSL performance across support <a name="supports"></a>
@@ -704,11 +897,12 @@ Based on support
 category = support.copy()
 types = support_types.copy()
 
-legend_labels = [r'$\rm CeO_{2}(100)$', r'$\rm CeO_{2}(111)$', 'Graphene', 'MgO(100)', '2H-'+r'$\rm MoS_{2}(0001)$', r'$\rm SrTiO_{3}(100)$',
-         'Steps of ' + r'$\rm CeO_{2}$', r'$\rm TiO_{2}(110)$', 'ZnO(100)']
+legend_labels = support_labels
 term_index = np.where(np.array(x_features_poly_combined) ==  'Ec_-1Ebind_2')[0][0]
 x_plot =  X_before_scaling[:,term_index]
 y_plot = y.copy()
+# R2 of DSL for the whole dataset from the batched report
+DSL_r2 = report_metrics['r2'][report_models.index('DSL')]
 sns.set_style("ticks")
 fig, ax = plt.subplots(figsize=(6, 6))
 color_set = cm.jet(np.linspace(0,1,len(types)))
@@ -720,7 +914,7 @@ for type_i, ci, label_i in zip(types, color_set, legend_labels):
                 facecolor = ci, 
                 alpha = 0.8,
                 s  = 100)
-ax.plot([x_plot.min(), x_plot.max()], [DSL.predict(X_DSL).min(), DSL.predict(X_DSL).max()], 'k--',  lw=2)
+ax.plot([x_plot.min(), x_plot.max()], [DSL_prediction.min(), DSL_prediction.max()], 'k--',  lw=2)
 ax.set_xlabel(r'$\rm E_{bind}^2/E_c$ ' + '(eV)')
 ax.set_ylabel(r'$\rm E_a$' +'(eV)')
 
@@ -730,6 +924,8 @@ plt.text(4,0.4, r'$\rm R^2$ = ' + str(np.around(DSL_r2, decimals = 3)) )
 plt.legend(bbox_to_anchor = (1.02, 1),loc= 'upper left', frameon=False)
 
 fig.savefig(os.path.join(output_dir, model_name + '_parity_support.png'))
+rstore.lap(run, 'DSL support')
+
 
 # %% [markdown]
 # #### DSL performance across metal <a name="metals"></a>
@@ -750,6 +946,10 @@ mesh = 10
 
 DSL_function = lambda x, y: x**2/y * u1 + u0 
 
+# R2 of DSL for each metal from the batched report
+DSL_r2_metal = report_group_metrics[(report_group_metrics['model'] == 'DSL') & 
+                                    (report_group_metrics['grouping'] == 'metal')].set_index('group')['r2']
+
 sns.set_style("ticks")
 fig, ax = plt.subplots(figsize=(6, 6))
 color_set = cm.jet(np.linspace(0,1,len(types)))
@@ -759,7 +959,7 @@ for type_i, ci in zip(types, color_set):
     indices = np.where(np.array(category) == type_i)[0]
     ax.scatter(x_plot_bind[indices],
                 y_plot[indices],
-                label=type_i+ ' ('+ r'$\rm R^2$ = ' + str(np.around(r2_score(DSL.predict(X_DSL)[indices], y_plot[indices]), decimals = 3)) + ')',
+                label=type_i+ ' ('+ r'$\rm R^2$ = ' + str(np.around(DSL_r2_metal[type_i], decimals = 3)) + ')',
                 facecolor = ci, 
                 alpha = 0.8,
                 s  = 100)
@@ -775,12 +975,363 @@ ax.set_ylabel(r'$\rm E_a$' +'(eV)')
 plt.legend(bbox_to_anchor = (1.02, 1),loc= 'upper left', frameon=False)
 
 fig.savefig(os.path.join(output_dir, model_name + '_parity_metal.png'))
+rstore.lap(run, 'DSL metal')
+
+
+# %% [markdown]
+# #### Screening with uncertainty propagated from the Ebind model <a name="screening"></a>
+# 
+# The Ebind fed into the DSL is itself predicted by the LASSO Ebind model (train_Ebind.py), so its residual $\sigma$ is propagated to Ea. The candidates are ranked by the probability of $E_a$ above a threshold
+
+# %%
+#%% Screening with uncertainty
+
+# import customized screening functions
+import screening_tools as stools
+
+# Residual sigma of the DSL and of the LASSO Ebind model
+DSL_sigma = report_metrics['sigma'][report_models.index('DSL')]
+Ebind_sigma_file = os.path.join(base_dir, 'lasso_Ebind', 'lasso_Ebind_sigma.txt')
+if os.path.exists(Ebind_sigma_file): Ebind_sigma = float(np.loadtxt(Ebind_sigma_file))
+else: Ebind_sigma = 0.0 # run train_Ebind.py first to propagate the Ebind error
+
+Ea_threshold = 1.5 # eV
+screen_linear = stools.screen_DSL(Ebind, Ebind_sigma, Ec, u1, u0, Ea_threshold, DSL_sigma = DSL_sigma, method = 'linear')
+screen_MC = stools.screen_DSL(Ebind, Ebind_sigma, Ec, u1, u0, Ea_threshold, DSL_sigma = DSL_sigma, method = 'MC', 
+                           random_state = seeds.seed('screening'))
+
+screen_df = pd.DataFrame({'metal': metal, 'support': support, 'Ec': Ec, 'Ebind': Ebind,
+                          'Ea_mean': screen_linear['Ea_mean'], 'Ea_sigma': screen_linear['Ea_sigma'],
+                          'p_stable': screen_linear['p_stable'], 'p_stable_MC': screen_MC['p_stable'],
+                          'Ea_GPR': GPR_prediction, 'Ea_sigma_GPR': GPR_sigma,
+                          'p_stable_GPR': stools.stability_probability(GPR_prediction, GPR_sigma, Ea_threshold)})
+screen_df = screen_df.iloc[screen_linear['rank']]
+screen_df.to_csv(os.path.join(output_dir, model_name + '_screening.csv'), index=False)
+
+# Index of the results partitioned by support and sorted by Ea, queries only read the chunks 
+# that can match. Partitioning by metal too only pays off for large candidate sets, the 99 
+# samples would give 99 one-row partitions. The index is a local cache outside the model 
+# folders, it is not tracked nor archived in the run store
+import screening_index as sindex
+
+screen_index_dir = os.path.join(base_dir, 'screening_index', model_name)
+sindex.write_index(screen_df, screen_index_dir, partition_columns = ('support',))
+screen_index = sindex.ScreeningIndex(screen_index_dir)
+print(screen_index.top_k(5, 'Ea_mean', ascending = False, support = 'CeO2(111)'))
+print(screen_index.query({'Ebind': (3, 5), 'Ea_mean': (Ea_threshold, None)}))
+rstore.lap(run, 'screening')
+
+
+# %% [markdown]
+# #### Leave-one-group-out validation across supports and metals <a name="groupcv"></a>
+# 
+# Each support (metal) is held out in turn and all models are refitted on the rest, which measures the extrapolation to an unseen support (metal)
+
+# %%
+#%% Leave one support/metal out
+
+# import customized validation functions
+import validation_tools as vtools
+
+group_models = {'DSL': {'family': 'OLS', 'columns': [0, term_index]},
+                'LASSO': {'family': 'LASSO', 'alpha': lasso_alpha},
+                'Enet': {'family': 'Enet', 'alpha': enet_min_alpha, 'l1_ratio': l1s_min},
+                'Ridge': {'family': 'Ridge', 'alpha': ridge_alpha},
+                'OLS': {'family': 'OLS'},
+                'GP': {'family': 'fixed', 'coefs': GP_coefs}}
+
+group_cv_support = vtools.group_cv(X, y, support, group_models, n_jobs = -1)
+group_cv_metal = vtools.group_cv(X, y, metal, group_models, n_jobs = -1)
+group_cv_support.to_csv(os.path.join(output_dir, 'group_cv_support.csv'), index=False)
+group_cv_metal.to_csv(os.path.join(output_dir, 'group_cv_metal.csv'), index=False)
+rstore.lap(run, 'group cv')
+
+
+# %% [markdown]
+# #### Exact leave-one-out validation <a name="loo"></a>
+# 
+# The LOO residuals of Ridge and DSL follow from one SVD of the training descriptors for the whole alpha grid, without refitting. LASSO and elastic net use the approximate LOO (ALO) on the active set of one path. OLS on all descriptors has more descriptors than training samples, its LOO depends on the rank cutoff and is left out
+
+# %%
+#%% Leave one out
+
+ridge_LOO_path, ridge_LOO_residuals = vtools.loo_ridge_path(X_train, y_train, alphas_grid_ridge)
+DSL_LOO_RMSE = vtools.loo_ridge_path(X_train, y_train, [0.0], columns = [0, term_index])[0][0]
+lasso_ALO_path, lasso_ALO_alphas, _ = vtools.alo_enet_path(X_train, y_train, alphas_grid)
+enet_ALO_path, enet_ALO_alphas, _ = vtools.alo_enet_path(X_train, y_train, alphas_grid, l1_ratio = l1s_min)
+
+ridge_LOO_alpha = alphas_grid_ridge[np.argmin(ridge_LOO_path)]
+lasso_ALO_alpha = lasso_ALO_alphas[np.argmin(lasso_ALO_path)]
+enet_ALO_alpha = enet_ALO_alphas[np.argmin(enet_ALO_path)]
+print('LOO RMSE DSL: {:.3f}, Ridge: {:.3f} (alpha {:.4f}), LASSO (ALO): {:.3f} (alpha {:.4f}), Enet (ALO): {:.3f} (alpha {:.4f})'.format(
+      DSL_LOO_RMSE, ridge_LOO_path.min(), ridge_LOO_alpha, lasso_ALO_path.min(), lasso_ALO_alpha, enet_ALO_path.min(), enet_ALO_alpha))
+
+loo_df = pd.concat([pd.DataFrame({'model': 'Ridge', 'alpha': alphas_grid_ridge, 'LOO RMSE': ridge_LOO_path}),
+                    pd.DataFrame({'model': 'LASSO', 'alpha': lasso_ALO_alphas, 'LOO RMSE': lasso_ALO_path}),
+                    pd.DataFrame({'model': 'Enet', 'alpha': enet_ALO_alphas, 'LOO RMSE': enet_ALO_path}),
+                    pd.DataFrame({'model': ['DSL'], 'alpha': [0.0], 'LOO RMSE': [DSL_LOO_RMSE]})], ignore_index = True)
+loo_df.to_csv(os.path.join(output_dir, 'loo_path.csv'), index=False)
+rstore.lap(run, 'loo')
+
+
+# %% [markdown]
+# #### Scaling laws fitted per support and per metal <a name="groups"></a>
+# 
+# Each model is fitted again on the samples of one support (or one metal) only, and the DSL is also fitted with its intercept and slope shrunk towards the universal ones. Groups whose own fit has a much lower leave-one-out error than the universal model, or whose slope departs from the universal $ u_1 $, are where the universal law fails
+# 
+# OLS on all descriptors is left out: with 9 to 11 samples per group it interpolates and its LOO error is meaningless. The group fits and their errors use all the samples of a group, test rows included, while the universal (pooled) coefficients come from the training set only, so pooled_RMSE mixes in-sample and held-out rows. Compare the group LOO_RMSE with the leave-one-group-out errors above rather than with pooled_RMSE
+
+# %%
+#%% Per-group fits
+
+# import customized group fitting functions
+import group_tools as grtools
+
+# the universal coefficients fitted on the training set
+pooled_coefs = {'DSL': DSL_coefs, 'LASSO': lasso_coefs, 'Enet': enet_min_coefs, 'Ridge': ridge_coefs}
+# full OLS interpolates the few samples of a group, as in the LOO cell it is left out
+fit_models = {name: spec for name, spec in group_models.items() if spec['family'] != 'fixed' and name != 'OLS'}
+hierarchical_lambdas = np.logspace(-4, 4, 33)
+# leave-one-out error of the universal DSL on all samples
+DSL_LOO_RMSE_all = vtools.loo_ridge_path(X, y, [0.0], columns = [0, term_index])[0][0]
+
+group_fits = {}
+slope_rows = []
+for group_name, groups_i in [('support', support), ('metal', metal)]:
+    
+    group_fit_models, group_fit_df = grtools.fit_groups(X, y, groups_i, fit_models, pooled_coefs, n_jobs = -1)
+    DSL_hierarchical, DSL_lambda, DSL_lambda_path, DSL_hierarchical_loo = grtools.hierarchical_fit(
+        X, y, groups_i, DSL_coefs, hierarchical_lambdas, columns = [0, term_index])
+    group_fit_models['DSL hierarchical'] = DSL_hierarchical
+    group_fits[group_name] = group_fit_models
+    
+    # predictions of every sample from the model of its group, one lookup
+    hierarchical_rows = []
+    DSL_hierarchical_prediction = DSL_hierarchical.predict(X, groups_i)
+    for gi in DSL_hierarchical.group_types:
+        rows = np.array(groups_i) == gi
+        hierarchical_rows.append({'group': gi, 'model': 'DSL hierarchical', 'n': np.sum(rows), 'n_nonzero': 2,
+                                  'RMSE_fit': np.sqrt(np.mean((y[rows] - DSL_hierarchical_prediction[rows])**2)),
+                                  'LOO_RMSE': np.sqrt(np.mean(DSL_hierarchical_loo[rows]**2)),
+                                  'pooled_RMSE': np.sqrt(np.mean((y[rows] - DSL_prediction[rows])**2))})
+    group_fit_df = pd.concat([group_fit_df, pd.DataFrame(hierarchical_rows)], ignore_index = True)
+    group_fit_df.to_csv(os.path.join(output_dir, 'group_fits_' + group_name + '.csv'), index=False)
+    print('{}: hierarchical DSL lambda = {:.3g}, LOO RMSE {:.3f} (universal DSL {:.3f})'.format(
+        group_name, DSL_lambda, DSL_lambda_path.min(), DSL_LOO_RMSE_all))
+    print(group_fit_df.pivot(index = 'group', columns = 'model', values = 'LOO_RMSE').round(3))
+    
+    # the unnormalized DSL slope of each group against the universal u1
+    for mi in ['DSL', 'DSL hierarchical']:
+        for gi, coefs_g in zip(group_fit_models[mi].group_types, group_fit_models[mi].coefs):
+            slope_rows.append({'grouping': group_name, 'group': gi, 'model': mi, 'u1': coefs_g[term_index]/sv[term_index - 1]})
+
+slope_df = pd.DataFrame(slope_rows)
+slope_df.to_csv(os.path.join(output_dir, 'group_DSL_slopes.csv'), index=False)
+
+fig, axes = plt.subplots(1, 2, figsize=(12, 6))
+for ax, group_name in zip(axes, ['support', 'metal']):
+    slopes = slope_df[slope_df['grouping'] == group_name].pivot(index = 'group', columns = 'model', values = 'u1')
+    positions = np.arange(len(slopes))
+    ax.bar(positions - 0.2, slopes['DSL'], width = 0.4, label = 'separate')
+    ax.bar(positions + 0.2, slopes['DSL hierarchical'], width = 0.4, label = 'hierarchical')
+    ax.axhline(u1, color = 'k', linestyle = '--', lw = 2, label = 'universal')
+    ax.set_xticks(positions)
+    ax.set_xticklabels(slopes.index, rotation = 90)
+    ax.set_ylabel(r'$\rm u_1$')
+axes[0].legend(frameon=False, loc='best')
+fig.savefig(os.path.join(output_dir, model_name + '_group_slopes.png'), bbox_inches='tight')
+rstore.lap(run, 'group fits')
+
+
+# %% [markdown]
+# #### Exhaustive search of small descriptor subsets <a name="subsets"></a>
+# 
+# All models with 1, 2 and 3 descriptors are scored by the cross-validation RMSE, the Pareto front shows how much accuracy each additional descriptor buys over the DSL
+
+# %%
+#%% Best subset search
+
+# import customized subset search functions
+import subset_tools as subtools
+
+subset_results, subset_pareto = subtools.subset_search(X_train, y_train, list(rkf.split(X_train)), max_terms = 3,
+                                                       feature_names = x_features_poly_combined, n_jobs = -1)
+subset_results.to_csv(os.path.join(output_dir, 'subset_search.csv'), index=False)
+subset_pareto.to_csv(os.path.join(output_dir, 'subset_pareto.csv'), index=False)
+rstore.lap(run, 'subset search')
+
+
+# %% [markdown]
+# #### Accuracy-complexity front of the sparse models <a name="pareto"></a>
+# 
+# Every alpha of the LASSO and elastic net paths and every scored subset is inserted into one Pareto archive, the front gives the best cross-validation RMSE for each number of terms (the intercept counted)
+
+# %%
+#%% Pareto front
+
+# import customized Pareto archive
+import pareto_tools as ptools
+
+pareto_archive = ptools.ParetoArchive()
+# the supports are read from the paths fitted on the whole training set, nothing is refitted
+ptools.update_from_path(pareto_archive, lasso_path_results, 'LASSO', feature_names = x_features_poly_combined)
+ptools.update_from_path(pareto_archive, enet_path_results, 'Enet', l1_ratio = enet_path_l1_ratio, feature_names = x_features_poly_combined)
+for _, row in subset_results.iterrows():
+    pareto_archive.update(len(row['columns']), row['CV_RMSE'], ('subset', tuple(row['columns'])), 
+                          {'model': 'subset', 'terms': row['terms']})
+
+pareto_df = pareto_archive.to_frame()
+pareto_df.to_csv(os.path.join(output_dir, 'pareto_front.csv'), index=False)
+print(pareto_df[['complexity', 'error', 'model']])
+rstore.lap(run, 'pareto')
+
+
+# %% [markdown]
+# #### Conditioning of the descriptors <a name="conditioning"></a>
+#
+# One pivoted QR of the training descriptors gives the condition number, the variance inflation factors (VIF) and the near-duplicate pairs. Columns whose VIF against the columns picked before them exceeds the threshold are pruned, and the LASSO path is refitted on the pruned columns to compare the coordinate descent iterations and the cross-validation RMSE
+
+# %%
+#%% Conditioning diagnostics and column pruning
+
+# import customized conditioning functions
+import conditioning_tools as ctools
+
+conditioning = ctools.diagnose(X_train, x_features_poly_combined)
+print('Condition number: {:.3e}, rank {} of {} columns'.format(conditioning['condition'], conditioning['rank'], X_train.shape[1]))
+print(conditioning['VIF'].sort_values('VIF', ascending = False).head(10))
+conditioning['VIF'].to_csv(os.path.join(output_dir, 'conditioning_vif.csv'), index=False)
+conditioning['duplicates'].to_csv(os.path.join(output_dir, 'conditioning_duplicates.csv'), index=False)
+
+# keep the DSL term so the pruned models can still select it
+vif_threshold = 1e3
+pruned_columns = ctools.prune_columns(X_train, vif_threshold, keep = [term_index])
+pruned_conditioning = ctools.diagnose(X_train[:, pruned_columns])
+pruned_lasso_RMSE_path = rtools.cal_path(lasso_path_results.alphas, Lasso, [Xi[:, pruned_columns] for Xi in X_cv_train], y_cv_train,
+                                         [Xi[:, pruned_columns] for Xi in X_cv_test], y_cv_test, fit_int_flag).RMSE_path
+
+conditioning_rows = []
+for columns_name, columns_i, conditioning_i, RMSE_path_i in [('all', None, conditioning, lasso_RMSE_path),
+                                                             ('pruned', pruned_columns, pruned_conditioning, pruned_lasso_RMSE_path)]:
+    n_iter_i, time_i = ctools.path_iterations(X_train, y_train, lasso_path_results.alphas, columns = columns_i)
+    conditioning_rows.append({'columns': columns_name, 'n_columns': X_train.shape[1] if columns_i is None else len(columns_i),
+                              'condition': conditioning_i['condition'], 'rank': conditioning_i['rank'],
+                              'max_VIF': conditioning_i['VIF']['VIF'].max(), 'lasso_path_iterations': n_iter_i,
+                              'lasso_path_time': time_i, 'lasso_CV_RMSE': np.sqrt(np.mean(RMSE_path_i**2, axis = 1)).min()})
+conditioning_df = pd.DataFrame(conditioning_rows)
+conditioning_df.to_csv(os.path.join(output_dir, 'conditioning.csv'), index=False)
+print('Pruned descriptors: ' + ', '.join(x_features_poly_combined[i] for i in pruned_columns))
+print(conditioning_df[['columns', 'n_columns', 'condition', 'max_VIF', 'lasso_path_iterations', 'lasso_CV_RMSE']])
+rstore.lap(run, 'conditioning')
+
+
+# %% [markdown]
+# #### Model selection from the cached paths <a name="selection"></a>
+# 
+# The one-standard-error rule takes the sparsest LASSO model whose mean error over the 100 folds is within one standard error of the minimum, read from the stored path without refitting. The elastic net l1 ratio is picked on the stored fold errors of ElasticNetCV instead of the single holdout, the 'min' rule is the exported [elastic net](#enet). Stability selection counts how often each descriptor (the intercept left out) enters LASSO paths fitted on random halves of the training set
+
+# %%
+#%% One-standard-error rule and stability selection
+
+# import customized selection functions
+import selection_tools as seltools
+
+selection_rows = []
+for rule in ['min', '1se']:
+    alpha_index = seltools.path_selection(lasso_path_results, rule)
+    coefs_i = lasso_path_results.full_coefs[alpha_index]
+    selection_rows.append({'model': 'LASSO', 'rule': rule, 'l1_ratio': 1.0, 'alpha': lasso_path_results.alphas[alpha_index],
+                           'n_nonzero': np.count_nonzero(coefs_i), 
+                           'CV_RMSE': np.sqrt(np.mean(lasso_path_results.RMSE_test[:, alpha_index]**2)),
+                           'RMSE_test': np.sqrt(mean_squared_error(y_test, np.dot(X_test, coefs_i)))})
+    
+    # one fit at the selected l1 ratio and alpha
+    l1_index, alpha_index = seltools.enet_selection(enet, rule)
+    alpha_i = enet[l1_index].alphas_[alpha_index]
+    enet_i = ElasticNet(alpha = alpha_i, l1_ratio = l1s[l1_index], max_iter = 1e7, tol = 0.001, 
+                        fit_intercept=fit_int_flag, random_state = random_state).fit(X_train, y_train)
+    selection_rows.append({'model': 'Enet', 'rule': rule, 'l1_ratio': l1s[l1_index], 'alpha': alpha_i,
+                           'n_nonzero': np.count_nonzero(enet_i.coef_),
+                           'CV_RMSE': np.sqrt(np.mean(enet[l1_index].mse_path_[alpha_index])),
+                           'RMSE_test': np.sqrt(mean_squared_error(y_test, enet_i.predict(X_test)))})
+
+selection_df = pd.DataFrame(selection_rows)
+selection_df.to_csv(os.path.join(output_dir, 'model_selection.csv'), index=False)
+print(selection_df)
+
+# Stability selection on the part of the path above the cross-validated alpha,
+# the intercept column is left out so it neither shows as stable nor counts in the bound
+stability_alphas = lasso_path_results.alphas[lasso_path_results.alphas >= lasso_alpha]
+stability_frequencies, stability_alphas = seltools.stability_selection(X_train, y_train, stability_alphas, intercept_index = 0,
+                                                                       random_state = seeds.spawn('stability'))
+stability_df = seltools.stability_table(stability_frequencies, stability_alphas, x_features_poly_combined[1:], threshold = 0.6)
+stability_df.to_csv(os.path.join(output_dir, 'stability_selection.csv'), index=False)
+print('Stable descriptors: ' + ', '.join(stability_df['feature'][stability_df['stable']]))
+print('Expected number of false selections <= {:.2f}'.format(seltools.expected_false_selections(stability_frequencies, 0.6)))
+rstore.lap(run, 'selection')
+
+
+# %% [markdown]
+# #### Out-of-core training from streamed row chunks <a name="streaming"></a>
+# 
+# The csv file is read in row chunks that are expanded on the fly and reduced to running means and Gram matrices, so the same models can be trained on datasets that do not fit in memory
+
+# %%
+#%% Streaming training
+
+# import customized streaming functions
+import streaming_tools as sttools
+
+stream_chunks = sttools.read_csv_chunks('Ea_data.csv', x_primary_feature_names, 'Ea', chunksize = 20)
+stream_stats = sttools.stream_stats(stream_chunks, orders, poly.powers_[poly_indices_nonrepeat])
+
+stream_DSL_coefs, stream_DSL_coefs_unnormalized, stream_DSL_RMSE = sttools.fit_from_stats(stream_stats, 'OLS', columns = [0, term_index])
+stream_ridge_coefs, stream_ridge_coefs_unnormalized, stream_ridge_RMSE = sttools.fit_from_stats(stream_stats, 'Ridge', alpha = ridge_alpha)
+stream_lasso_coefs, stream_lasso_coefs_unnormalized, stream_lasso_RMSE = sttools.fit_from_stats(stream_stats, 'LASSO', alpha = lasso_alpha)
+
+print('Streaming fits on all data, RMSE DSL: {:.3f}, Ridge: {:.3f}, LASSO: {:.3f}'.format(stream_DSL_RMSE, stream_ridge_RMSE, stream_lasso_RMSE))
+rstore.lap(run, 'streaming')
+
+
+# %% [markdown]
+# #### Hyperparameter search with successive halving <a name="search"></a>
+# 
+# Wider grids than the fixed ones above, trials are scored on a few folds first and only the promising ones on all 100 folds. Results are kept in a SQLite store, so rerunning the cell does not refit finished trials
+
+# %%
+#%% Hyperparameter search
+
+# import customized hyperparameter search functions
+import hyperparameter_search as hsearch
+
+# below alpha ~1e-3 the coordinate descent of small l1 ratios takes millions of iterations
+search_space = {'LASSO': {'alpha': np.logspace(1, -4, 50)},
+                'Ridge': {'alpha': np.logspace(3, -5, 80)},
+                'Enet': {'alpha': np.logspace(1, -3, 25), 'l1_ratio': l1s}}
+search_GP = False # genetic programming trials take minutes per fold
+if search_GP:
+    search_space['GP'] = {'population_size': [1000, 2000, 5000], 'generations': [20],
+                          'parsimony_coefficient': [0.001, 0.005, 0.01, 0.05]}
+
+# primary descriptors split the same way as X, for the GP trials
+X_primary_train = train_test_split(np.stack((Ec, Ebind), 1), test_size=0.2, random_state = random_state)[0]
+search_best = hsearch.run_search(search_space, X_train, y_train, list(rkf.split(X_train)), X_primary_train,
+                                 store = os.path.join(base_dir, 'hyperparameter_search.db'), 
+                                 random_state = seeds.spawn('search'))
+for family, (params, RMSE) in search_best.items():
+    print('{}: {}, CV RMSE = {:.3f}'.format(family, params, RMSE))
+rstore.lap(run, 'hyperparameter search')
+
 
 # %% [markdown]
 # ## Export coefficients into dataframes
 
 # %%
 #%% Export coefficients into dataframes
+
+# import customized screening functions
+import screening_tools as stools
+
 # Unnormalized Coefficients
 decimal_places = 2
 coef_unnormalized = {'Descriptors': x_features_poly_combined,
@@ -809,9 +1360,107 @@ coef = {'Descriptors': x_features_poly_combined,
 coef_df = pd.DataFrame(coef)
 # Save to a csv file
 coef_df.to_csv('coefficient_normalized.csv')
+
+# Full precision coefficients, exponent vectors and scaler statistics in a binary sidecar,
+# read by stools.load_coefficients instead of the rounded csv
+export_models = ['DSL', 'LASSO', 'Enet', 'Ridge', 'GP', 'OLS']
+stools.save_coefficients('coefficient_unnormalized.csv', x_features_poly_combined,
+                         dict(zip(export_models, [DSL_coefs_unnormalized, lasso_coefs_unnormalized, enet_min_coefs_unnormalized,
+                                                  ridge_coefs_unnormalized, GP_coefs_unnormalized, OLS_coefs_unnormalized])),
+                         x_primary_feature_names,
+                         normalized_coefs = dict(zip(export_models, [DSL_coefs, lasso_coefs, enet_min_coefs, ridge_coefs, GP_coefs, OLS_coefs])),
+                         scaler_mean = mv, scaler_scale = sv)
+export_error = np.max(np.abs(stools.predict_from_exponents({'Ec': Ec, 'Ebind': Ebind}, *stools.descriptor_exponents(x_features_poly_combined, x_primary_feature_names),
+                                                           lasso_coefs_unnormalized, x_primary_feature_names) - lasso_prediction))
+print('LASSO predictions from the sidecar differ from training by {:.2e} eV'.format(export_error))
                     
+rstore.lap(run, 'export')
+
+
+# %% [markdown]
+# #### Reduced precision <a name="precision"></a>
+# 
+# The streamed expansion and Gram accumulation and the screening predictions are repeated in float32 and compared with float64. Fits with an ill-conditioned system are refined from float64 statistics. Exported models whose float32 predictions drift by more than 1 meV on a batch of candidates are flagged (keep_float64) and should be screened in float64. Timing float32 against float64 screening on one million candidates needs several GB of memory and is only run with benchmark_precision = True
+
+# %%
+#%% float32 against float64
+
+benchmark_precision = False # time the screening of one million candidates
+precision_rows = []
+
+stream_powers = poly.powers_[poly_indices_nonrepeat]
+stream_stats32 = sttools.stream_stats(sttools.read_csv_chunks('Ea_data.csv', x_primary_feature_names, 'Ea', chunksize = 20), 
+                                      orders, stream_powers, dtype = np.float32)
+# float64 statistics, accumulated again only if a fit needs them
+stream_stats64 = lambda: sttools.stream_stats(sttools.read_csv_chunks('Ea_data.csv', x_primary_feature_names, 'Ea', chunksize = 20),
+                                              orders, stream_powers)
+G32 = sttools.scaled_gram(stream_stats32)[0]
+
+for mi, family, alpha_i, columns_i, coefs64 in [('DSL', 'OLS', 0.0, [0, term_index], stream_DSL_coefs),
+                                                ('Ridge', 'Ridge', ridge_alpha, None, stream_ridge_coefs),
+                                                ('LASSO', 'LASSO', lasso_alpha, None, stream_lasso_coefs)]:
+    coefs32, _, RMSE32 = sttools.fit_from_stats(stream_stats32, family, alpha = alpha_i, columns = columns_i, stats64 = stream_stats64)
+    active = columns_i if family != 'LASSO' else np.flatnonzero(coefs32)
+    condition = sttools.system_condition(G32, stream_stats32['n'], family, alpha_i, columns = active)
+    precision_rows.append({'model': mi, 'step': 'fit', 'condition': condition,
+                           'refined': condition * np.finfo(np.float32).eps > 1e-3,
+                           'max_abs_diff': np.max(np.abs(coefs32 - coefs64))})
+
+# screening batch of candidates within the range of the data
+n_screen = 1000000 if benchmark_precision else 10000
+rs_precision = seeds.rng('precision')
+screen_inputs = {pi: rs_precision.uniform(data[pi].min(), data[pi].max(), n_screen) for pi in x_primary_feature_names}
+for mi, (descriptors, coefs) in stools.load_coefficients('coefficient_unnormalized.csv').items():
+    max_error = stools.float32_error(screen_inputs, descriptors, coefs, x_primary_feature_names)
+    row = {'model': mi, 'step': 'screening', 'keep_float64': max_error > 1e-3, 'max_abs_diff': max_error}
+    if benchmark_precision:
+        t0 = time.perf_counter()
+        stools.predict_from_coefficients(screen_inputs, descriptors, coefs, x_primary_feature_names)
+        row['seconds_float64'] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        stools.predict_from_coefficients(screen_inputs, descriptors, coefs, x_primary_feature_names, np.float32)
+        row['seconds_float32'] = time.perf_counter() - t0
+    precision_rows.append(row)
+
+precision_df = pd.DataFrame(precision_rows)
+precision_df.to_csv(os.path.join(output_dir, 'precision_report.csv'), index=False)
+print(precision_df)
+rstore.lap(run, 'precision')
+
 
 
 # %%
 
+# %% [markdown]
+# ## Record the run
+# 
+# The outputs are stored by content under runs/, use rstore.list_runs and rstore.compare_runs to look up past runs without retraining
 
+# %%
+#%% Record the run
+run['config'].update({'alphas_grid_ridge': alphas_grid_ridge, 'l1s': l1s, 'Ea_threshold': Ea_threshold})
+rstore.log_metrics(run, dict(zip([mi + '_RMSE_test' for mi in report_models], report_RMSE_test)))
+rstore.log_metrics(run, dict(zip([mi + '_r2' for mi in report_models], report_metrics['r2'])))
+rstore.log_metrics(run, {'lasso_alpha': lasso_alpha, 'ridge_alpha': ridge_alpha,
+                         'enet_alpha': enet_min_alpha, 'enet_l1_ratio': l1s_min, 'DSL_u0': u0, 'DSL_u1': u1,
+                         'GPR_noise_ratio': GPR_noise_ratio, 'GPR_log_marginal_likelihood': GPR.log_marginal_likelihood()})
+rstore.log_metrics(run, {'DSL_LOO_RMSE': DSL_LOO_RMSE, 'ridge_LOO_RMSE': ridge_LOO_path.min(),
+                         'lasso_ALO_RMSE': lasso_ALO_path.min(), 'enet_ALO_RMSE': enet_ALO_path.min()})
+lasso_1se = selection_df[(selection_df['model'] == 'LASSO') & (selection_df['rule'] == '1se')].iloc[0]
+rstore.log_metrics(run, {'lasso_1se_alpha': lasso_1se['alpha'], 'lasso_1se_n_nonzero': lasso_1se['n_nonzero'],
+                         'lasso_1se_RMSE_test': lasso_1se['RMSE_test'], 'n_stable_descriptors': stability_df['stable'].sum()})
+
+for mi, coefs_i in zip(['DSL', 'LASSO', 'Enet', 'Ridge', 'GP', 'OLS'], 
+                       [DSL_coefs_unnormalized, lasso_coefs_unnormalized, enet_min_coefs_unnormalized, 
+                        ridge_coefs_unnormalized, GP_coefs_unnormalized, OLS_coefs_unnormalized]):
+    rstore.add_array(run, mi + '_coefs_unnormalized', coefs_i)
+for output_i in ['lasso', 'ridge', 'enet', 'OLS', 'GP', 'GPR', 'nonlinear', 'DSL']:
+    for filename in sorted(os.listdir(os.path.join(base_dir, output_i))):
+        # files only, directories such as an older screening index are skipped
+        if os.path.isfile(os.path.join(base_dir, output_i, filename)):
+            rstore.add_file(run, os.path.join(base_dir, output_i, filename), os.path.join(output_i, filename))
+for filename in ['coefficient_unnormalized.csv', 'coefficient_unnormalized.npy', 'coefficient_unnormalized.json', 'coefficient_normalized.csv']:
+    rstore.add_file(run, filename)
+
+run_id = rstore.finish_run(run)
+print('Run recorded as {}'.format(run_id))
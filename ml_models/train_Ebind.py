@@ -45,6 +45,9 @@ from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import PolynomialFeatures, StandardScaler
 
 import regression_tools as rtools
+# the path and coefficient heatmap figures are only saved as data (*.fig.npz),
+# render them on demand with render_plots.py or set to True to draw them here
+rtools.render_figures = False
 
 font = {'size'   : 20}
 
@@ -179,7 +182,7 @@ X_train, X_test, y_train, y_test, X_before_train, X_before_test = train_test_spl
 alphas_grid = np.logspace(0, -3, 20)
 
 # Cross-validation scheme                                  
-rkf = RepeatedKFold(n_splits = 10, n_repeats = 10 , random_state =rs)
+rkf = RepeatedKFold(n_splits = 10, n_repeats = 10 , random_state = random_state)
 
 
 # Explicitly take out the train/test set
@@ -207,19 +210,21 @@ base_dir = os.getcwd()
 output_dir = os.path.join(base_dir, model_name)
 if not os.path.exists(output_dir): os.makedirs(output_dir)    
 
-lasso_cv  = LassoCV(cv = rkf,  max_iter = 1e7, tol = 0.001, fit_intercept=fit_int_flag, random_state=random_state)
-lasso_cv.fit(X_train, y_train)
-
-# the optimal alpha from lassocv
-lasso_alpha = lasso_cv.alpha_
+# One path on the alpha grid of LassoCV holds the folds and the whole training set, 
+# the optimal alpha and its model are read from it, as LassoCV would select and refit them
+lasso_path_results = rtools.cal_path(rtools.alpha_grid(X_train, y_train), Lasso, X_cv_train, y_cv_train, X_cv_test, y_cv_test, 
+                                     fit_int_flag, X_train, y_train)
+lasso_alpha_index = lasso_path_results.best_index()
+# the optimal alpha
+lasso_alpha = lasso_path_results.alphas[lasso_alpha_index]
 # Coefficients for each term
-lasso_coefs = lasso_cv.coef_
+lasso_coefs = lasso_path_results.full_coefs[lasso_alpha_index]
 # The original intercepts 
-lasso_intercept = lasso_cv.intercept_
+lasso_intercept = lasso_path_results.full_intercepts[lasso_alpha_index]
 
 # Access the errors 
-y_predict_test = lasso_cv.predict(X_test)
-y_predict_train = lasso_cv.predict(X_train)
+y_predict_test = np.dot(X_test, lasso_coefs) + lasso_intercept
+y_predict_train = np.dot(X_train, lasso_coefs) + lasso_intercept
 
 
 lasso_RMSE_test = np.sqrt(mean_squared_error(y_test, y_predict_test))
@@ -227,11 +232,16 @@ lasso_RMSE_train = np.sqrt(mean_squared_error(y_train, y_predict_train))
 lasso_r2_train = r2_score(y_train, y_predict_train)
 
 
-##Use alpha grid prepare for lassopath
-lasso_RMSE_path, lasso_coef_path = rtools.cal_path(alphas_grid, Lasso, X_cv_train, y_cv_train, X_cv_test, y_cv_test, fit_int_flag)
-rtools.plot_path(X, y, lasso_alpha, alphas_grid, lasso_RMSE_path, lasso_coef_path, lasso_cv, model_name, output_dir)
+# Plot the path from the stored results
+lasso_RMSE_path, lasso_coef_path = lasso_path_results.RMSE_path, lasso_path_results.coef_path
+lasso_path_results.save(os.path.join(output_dir, model_name + '_path.npz'))
+rtools.plot_path(X, y, lasso_alpha, lasso_path_results.alphas, lasso_RMSE_path, lasso_coef_path, None, model_name, output_dir)
 # Plot parity plot
-lasso_RMSE, lasso_r2 = rtools.parity_plot(y, lasso_cv.predict(X), model_name, output_dir, lasso_RMSE_test)
+lasso_prediction = np.dot(X, lasso_coefs) + lasso_intercept
+lasso_RMSE, lasso_r2 = rtools.parity_plot(y, lasso_prediction, model_name, output_dir, lasso_RMSE_test)
+# Residual sigma of Ebind, used to propagate the uncertainty in screening
+lasso_sigma = rtools.error_distribution(y, lasso_prediction, model_name, output_dir)
+np.savetxt(os.path.join(output_dir, model_name + '_sigma.txt'), [lasso_sigma])
 
 
 # The indices for non-zero coefficients/significant cluster interactions 
@@ -266,30 +276,32 @@ output_dir = os.path.join(base_dir, model_name)
 if not os.path.exists(output_dir): os.makedirs(output_dir)    
 
 alphas_grid_ridge = np.logspace(0, -3, 20)
-ridgeCV = RidgeCV(alphas = alphas_grid_ridge,  cv = rkf, fit_intercept=fit_int_flag)
-ridgeCV.fit(X_train, y_train)
-ridge_alpha = ridgeCV.alpha_ 
-ridge_intercept = ridgeCV.intercept_ 
-ridge_coefs = ridgeCV.coef_
+# the alpha is selected from the stored path as RidgeCV would, by the mean test MSE over the folds
+ridge_path_results = rtools.cal_path(alphas_grid_ridge, Ridge, X_cv_train, y_cv_train, X_cv_test, y_cv_test, fit_int_flag, X_train, y_train)
+ridge_alpha_index = ridge_path_results.best_index()
+ridge_alpha = ridge_path_results.alphas[ridge_alpha_index]
+ridge_intercept = ridge_path_results.full_intercepts[ridge_alpha_index]
+ridge_coefs = ridge_path_results.full_coefs[ridge_alpha_index]
 
 # Access the errors 
-y_predict_test = ridgeCV.predict(X_test)
-y_predict_train = ridgeCV.predict(X_train)
+y_predict_test = np.dot(X_test, ridge_coefs) + ridge_intercept
+y_predict_train = np.dot(X_train, ridge_coefs) + ridge_intercept
 
 ridge_RMSE_test = np.sqrt(mean_squared_error(y_test, y_predict_test))
 ridge_RMSE_train = np.sqrt(mean_squared_error(y_train, y_predict_train))
 ridge_r2_train = r2_score(y_train, y_predict_train)   
 
 # plot the rigde path
-ridge_RMSE_path, ridge_coef_path = rtools.cal_path(alphas_grid_ridge, Ridge, X_cv_train, y_cv_train, X_cv_test, y_cv_test, fit_int_flag)
+ridge_RMSE_path, ridge_coef_path = ridge_path_results.RMSE_path, ridge_path_results.coef_path
+ridge_path_results.save(os.path.join(output_dir, model_name + '_path.npz'))
 rtools.plot_RMSE_path(ridge_alpha, alphas_grid_ridge, ridge_RMSE_path, model_name, output_dir)
 # plot the parity plot
-ridge_RMSE, ridge_r2 = rtools.parity_plot(y, ridgeCV.predict(X), model_name, output_dir, ridge_RMSE_test)
+ridge_RMSE, ridge_r2 = rtools.parity_plot(y, np.dot(X, ridge_coefs) + ridge_intercept, model_name, output_dir, ridge_RMSE_test)
 
 # Unnormalized coefficients
 ridge_coefs_unnormailized = np.zeros_like(ridge_coefs)
 ridge_coefs_unnormailized[1:] = ridge_coefs[1:]/sv
-ridge_coefs_unnormailized[0] = ridge_coefs[0] - np.sum(mv/sv*lasso_coefs[1:])
+ridge_coefs_unnormailized[0] = ridge_coefs[0] - np.sum(mv/sv*ridge_coefs[1:])
 
 
 # %% [markdown]
@@ -309,7 +321,7 @@ def l1_enet(ratio):
     input l1 ratio and return the model, non zero coefficients and cv scores
     training elastic net properly
     '''
-    enet_cv  = ElasticNetCV(cv = rkf, l1_ratio=ratio,  max_iter = 1e7, tol = 0.001, fit_intercept=fit_int_flag, random_state= rs)
+    enet_cv  = ElasticNetCV(cv = rkf, l1_ratio=ratio,  max_iter = 1e7, tol = 0.001, fit_intercept=fit_int_flag, random_state = random_state)
     enet_cv.fit(X_train, y_train)
     
     # the optimal alpha
@@ -391,7 +403,8 @@ fig.savefig(os.path.join(output_dir, 'elastic_net.png'))
 '''
 #Use alpha grid prepare for enet_path when RMSE is mininal 
 '''
-enet_RMSE_path, enet_coef_path = rtools.cal_path(alphas_grid, ElasticNet, X_cv_train, y_cv_train, X_cv_test, y_cv_test, fit_int_flag)    
+enet_path_results = rtools.cal_path(alphas_grid, ElasticNet, X_cv_train, y_cv_train, X_cv_test, y_cv_test, fit_int_flag)
+enet_RMSE_path, enet_coef_path = enet_path_results.RMSE_path, enet_path_results.coef_path
 enet_min_index = np.argmin(enet_RMSE_test)
 l1s_min = l1s[enet_min_index] 
 enet_min = enet[enet_min_index]
@@ -455,6 +468,22 @@ OLS_coefs_unnormailized = np.zeros_like(OLS_coefs)
 OLS_coefs_unnormailized[1:] = OLS_coefs[1:]/sv
 OLS_coefs_unnormailized[0] = OLS_coefs[0] - np.sum(mv/sv*OLS_coefs[1:])
 
+# %% [markdown]
+# #### Exact leave-one-out validation <a name="loo"></a>
+# 
+# The LOO residuals of Ridge follow from one SVD of the training descriptors for the whole alpha grid, LASSO uses the approximate LOO (ALO) on the active set of one path
+
+# %%
+#%% Leave one out
+
+# import customized validation functions
+import validation_tools as vtools
+
+ridge_LOO_path, _ = vtools.loo_ridge_path(X_train, y_train, alphas_grid_ridge)
+lasso_ALO_path, lasso_ALO_alphas, _ = vtools.alo_enet_path(X_train, y_train, alphas_grid)
+print('LOO RMSE Ridge: {:.3f} (alpha {:.4f}), LASSO (ALO): {:.3f} (alpha {:.4f})'.format(
+      ridge_LOO_path.min(), alphas_grid_ridge[np.argmin(ridge_LOO_path)], lasso_ALO_path.min(), lasso_ALO_alphas[np.argmin(lasso_ALO_path)]))
+
 # %% [markdown]
 # #### Evaluate the performance of LASSO model 
 
@@ -473,7 +502,7 @@ color_set = cm.jet(np.linspace(0,1,len(types)))
 for type_i, ci in zip(types, color_set):
     indices = np.where(np.array(category) == type_i)[0]
     ax.scatter(y[indices],
-                    lasso_cv.predict(X)[indices],
+                    lasso_prediction[indices],
                     label=type_i,
                     facecolor = ci, 
                     alpha = 0.8,
@@ -499,7 +528,7 @@ color_set = cm.jet(np.linspace(0,1,len(types)))
 for type_i, ci in zip(types, color_set):
     indices = np.where(np.array(category) == type_i)[0]
     ax.scatter(y[indices],
-                    lasso_cv.predict(X)[indices],
+                    lasso_prediction[indices],
                     label=type_i,
                     facecolor = ci, 
                     alpha = 0.8,
@@ -511,3 +540,37 @@ plt.legend(bbox_to_anchor = (1.02, 1),loc= 'upper left', frameon=False)
 plt.text(3, 1, '$RMSE_{test}$ = ' + str(np.around(lasso_RMSE_test, decimals = 3)))
 plt.text(4,0.4, '$R^2$ = ' + str(np.around(lasso_r2, decimals = 3)) )
 
+
+# %% [markdown]
+# ## Export coefficients into dataframes
+
+# %%
+#%% Export coefficients into dataframes
+# Descriptor names in the same format as train_Ea.py, e.g. Ec_-1Evac_2
+x_features_poly_combined = ['1']
+for powers in poly.powers_[1:]:
+    x_features_poly_combined.append(''.join([x_secondary_feature_names[pi] for pi in np.nonzero(powers)[0]]))
+
+# Unnormalized Coefficients
+decimal_places = 2
+coef_unnormalized = {'Descriptors': x_features_poly_combined,
+                     'LASSO': np.around(lasso_coefs_unnormailized, decimals = decimal_places), 
+                     'Enet': np.around(enet_min_coefs_unnormailized, decimals = decimal_places), 
+                     'Ridge': np.around(ridge_coefs_unnormailized, decimals = decimal_places),
+                     'OLS': np.around(OLS_coefs_unnormailized, decimals =decimal_places)}
+
+coef_unnormalized_df = pd.DataFrame(coef_unnormalized)
+# Save to a csv file
+coef_unnormalized_df.to_csv('coefficient_Ebind_unnormalized.csv')
+
+# Full precision coefficients, exponent vectors and scaler statistics in a binary sidecar,
+# read by stools.load_coefficients instead of the rounded csv
+import screening_tools as stools
+
+export_models = ['LASSO', 'Enet', 'Ridge', 'OLS']
+stools.save_coefficients('coefficient_Ebind_unnormalized.csv', x_features_poly_combined,
+                         dict(zip(export_models, [lasso_coefs_unnormailized, enet_min_coefs_unnormailized,
+                                                  ridge_coefs_unnormailized, OLS_coefs_unnormailized])),
+                         x_primary_feature_names,
+                         normalized_coefs = dict(zip(export_models, [lasso_coefs, enet_min_coefs, ridge_coefs, OLS_coefs])),
+                         scaler_mean = mv, scaler_scale = sv)
@@ -0,0 +1,138 @@
+# To add a new cell, type '# %%'
+# To add a new markdown cell, type '# %% [markdown]'
+# %% [markdown]
+# ## Joint Training of the Ebind and Ea Scaling Laws in Python
+#
+# Both targets are trained on one feature pipeline: the union of the descriptors of [train_Ebind](train_Ebind.py) and [train_Ea](train_Ea.py) is expanded, scaled and split into folds once, so both models use identical splits
+#
+# - $ E_{bind} $ uses the descriptors built from 'Ec', 'Evac', 'delta X', 'CN', 'angle'
+#
+# - $ E_a $ uses the descriptors built from $ E_c $ and $ E_{bind} $, the same as train_Ea
+#
+# The two targets keep their own descriptors, so each one has its own solve on the shared Gram matrix
+#
+# In the [chained mode](#chained) the $ E_a $ model is fed with the predicted $ E_{bind} $ instead of the DFT value, as in screening
+#
+
+# %%
+#%% Import all necessary libraries
+
+import os
+import numpy as np
+import pandas as pd
+
+from sklearn.model_selection import RepeatedKFold, train_test_split
+
+# import customized joint training functions
+import joint_tools as jtools
+
+# %% [markdown]
+# ### Step 1 - Import Data and expand the union of descriptors once
+
+# %%
+#%% Import data, expand, scale
+
+data = pd.read_csv('Ea_data.csv', header = 0)
+
+# Numerical orders
+orders = [1, -1, 0.5, -0.5, 2, -2]
+
+target_names = ['Ebind', 'Ea']
+primary_names = ['Ec', 'Evac', 'delta X', 'CN', 'angle', 'Ebind']
+# primary descriptors (indices in primary_names) used by each target
+target_primaries = {'Ebind': [0, 1, 2, 3, 4], 'Ea': [0, 5]}
+
+X_poly, powers, secondary_names, secondary_primary = jtools.expand_union(data, primary_names, orders)
+x_features_poly_combined = jtools.feature_names(powers, secondary_names)
+column_sets = [jtools.target_columns(X_poly, powers, secondary_primary, target_primaries[ti]) for ti in target_names]
+# Ea takes the descriptors exported by train_Ea.py by name, so the joint and standalone Ea models are comparable
+Ea_descriptors = list(pd.read_csv('coefficient_unnormalized.csv', index_col = 0)['Descriptors'])
+column_sets[target_names.index('Ea')] = jtools.columns_by_name(x_features_poly_combined, Ea_descriptors)
+
+X, mv, sv = jtools.scale_union(X_poly)
+Y = np.array(data[target_names], dtype = float)
+
+# %% [markdown]
+# ### Step 2 - Set the cross-validation scheme once for both targets
+
+# %%
+#%% Cross validation setting
+
+random_state = 0
+train_index, test_index = train_test_split(np.arange(len(Y)), test_size=0.2, random_state = random_state)
+X_train, X_test, Y_train, Y_test = X[train_index], X[test_index], Y[train_index], Y[test_index]
+
+alphas_grid = np.logspace(0, -3, 20)
+rkf = RepeatedKFold(n_splits = 10, n_repeats = 10 , random_state = random_state)
+folds = list(rkf.split(X_train))
+
+# %% [markdown]
+# ### Step 3 - Train both targets with shared factorizations
+
+# %%
+#%% Ridge and OLS, one eigendecomposition per fold for all alphas
+
+base_dir = os.getcwd()
+output_dir = os.path.join(base_dir, 'joint')
+if not os.path.exists(output_dir): os.makedirs(output_dir)
+
+results = []
+
+def record(model_name, coefs, alphas, CV_RMSE):
+
+    '''
+    Test RMSE of each target from the coefficients (features x targets)
+    '''
+    for ti, target in enumerate(target_names):
+        RMSE_test = np.sqrt(np.mean((np.dot(X_test, coefs[:, ti]) - Y_test[:, ti])**2))
+        results.append({'target': target, 'model': model_name, 'alpha': alphas[ti],
+                        'n_nonzero': np.count_nonzero(coefs[:, ti]), 'CV RMSE': CV_RMSE[ti], 'test RMSE': RMSE_test})
+
+ridge_RMSE_path = jtools.joint_ridge_cv(X_train, Y_train, column_sets, alphas_grid, folds)
+ridge_alphas = alphas_grid[np.argmin(ridge_RMSE_path.mean(axis = 2), axis = 1)]
+ridge_coefs = jtools.joint_ridge_fit(X_train, Y_train, column_sets, ridge_alphas)
+record('Ridge', ridge_coefs, ridge_alphas, ridge_RMSE_path.mean(axis = 2).min(axis = 1))
+
+OLS_RMSE_path = jtools.joint_ridge_cv(X_train, Y_train, column_sets, [0.0], folds)
+OLS_coefs = jtools.joint_ridge_fit(X_train, Y_train, column_sets, [0.0, 0.0])
+record('OLS', OLS_coefs, [0.0, 0.0], OLS_RMSE_path.mean(axis = 2)[:, 0])
+
+
+# %%
+#%% LASSO and elastic net, one Gram matrix per fold
+
+lasso_RMSE_path, lasso_alphas_grid = jtools.joint_enet_cv(X_train, Y_train, column_sets, alphas_grid, folds, l1_ratio = 1.0)
+lasso_alphas = lasso_alphas_grid[np.argmin(lasso_RMSE_path.mean(axis = 2), axis = 1)]
+lasso_coefs = jtools.joint_enet_fit(X_train, Y_train, column_sets, lasso_alphas, l1_ratio = 1.0)
+record('LASSO', lasso_coefs, lasso_alphas, lasso_RMSE_path.mean(axis = 2).min(axis = 1))
+
+l1_ratio = 0.5
+enet_RMSE_path, enet_alphas_grid = jtools.joint_enet_cv(X_train, Y_train, column_sets, alphas_grid, folds, l1_ratio = l1_ratio)
+enet_alphas = enet_alphas_grid[np.argmin(enet_RMSE_path.mean(axis = 2), axis = 1)]
+enet_coefs = jtools.joint_enet_fit(X_train, Y_train, column_sets, enet_alphas, l1_ratio = l1_ratio)
+record('Enet', enet_coefs, enet_alphas, enet_RMSE_path.mean(axis = 2).min(axis = 1))
+
+# %% [markdown]
+# ### Step 4 - Chained mode: predicted Ebind feeds the Ea model <a name="chained"></a>
+
+# %%
+#%% Chained prediction
+
+Ebind_index = target_names.index('Ebind')
+Ea_index = target_names.index('Ea')
+# keep the predicted Ebind within the range the Ea model was trained on
+Ebind_bounds = (data['Ebind'].min(), data['Ebind'].max())
+
+for model_name, coefs in [('LASSO', lasso_coefs), ('Ridge', ridge_coefs), ('Enet', enet_coefs)]:
+
+    Ebind_predicted = np.dot(X, coefs[:, Ebind_index])
+    X_chained = jtools.chained_features(data, Ebind_predicted, primary_names, orders, mv, sv, column_sets[Ea_index], Ebind_bounds = Ebind_bounds)
+    Ea_chained = np.dot(X_chained, coefs[column_sets[Ea_index], Ea_index])
+
+    results.append({'target': 'Ea (chained)', 'model': model_name, 'alpha': np.nan,
+                    'n_nonzero': np.count_nonzero(coefs[:, Ea_index]), 'CV RMSE': np.nan,
+                    'test RMSE': np.sqrt(np.mean((Ea_chained[test_index] - Y_test[:, Ea_index])**2))})
+
+results_df = pd.DataFrame(results)
+results_df.to_csv(os.path.join(output_dir, 'joint_results.csv'), index=False)
+print(results_df)
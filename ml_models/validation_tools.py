@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Utility functions to validate the regression models
+"""
+
+'''
+Cross validation schemes beyond the RepeatedKFold used in training,
+kept free of plotting imports so that they run cheaply in worker processes
+'''
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from scipy import linalg
+from sklearn.linear_model import ElasticNet, Lasso, enet_path
+
+
+def gram_solve(G, b, family, alpha = 0.0):
+
+    '''
+    Solve OLS/Ridge from the Gram matrix G = X^T X and b = X^T y
+    Ridge minimizes ||y - Xw||^2 + alpha*||w||^2 as sklearn Ridge does
+    OLS returns the minimum norm solution as sklearn LinearRegression does
+    '''
+    if family == 'Ridge' and alpha > 0:
+        A = G + alpha * np.eye(len(G))
+        return linalg.solve(A, b, assume_a = 'pos')
+
+    return linalg.lstsq(G, b, lapack_driver = 'gelsd')[0]
+
+
+def _fit_group(X, y, G, b, test_mask, models):
+
+    '''
+    Fit every model without the held-out group
+    The training Gram is a rank-k downdate of the full Gram matrix,
+    k being the size of the held-out group
+    '''
+    X_test, y_test = X[test_mask], y[test_mask]
+    G_train = G - np.dot(X_test.T, X_test)
+    b_train = b - np.dot(X_test.T, y_test)
+
+    y_predict = {}
+    for name, spec in models.items():
+
+        family = spec['family']
+        columns = spec.get('columns', None)
+        if columns is None: columns = np.arange(X.shape[1])
+        columns = np.asarray(columns)
+
+        coefs = np.zeros(X.shape[1])
+
+        if family == 'fixed':
+            # model trained elsewhere, e.g. the GP constant
+            coefs = np.asarray(spec['coefs'], dtype = float)
+
+        elif family in ['OLS', 'Ridge']:
+            G_sub = G_train[np.ix_(columns, columns)]
+            coefs[columns] = gram_solve(G_sub, b_train[columns], family, spec.get('alpha', 0.0))
+
+        elif family in ['LASSO', 'Enet']:
+            G_sub = np.ascontiguousarray(G_train[np.ix_(columns, columns)])
+            if family == 'LASSO':
+                estimator = Lasso(alpha = spec['alpha'], precompute = G_sub, max_iter = int(1e7), tol = 0.001,
+                                  fit_intercept = False, random_state = 0)
+            else:
+                estimator = ElasticNet(alpha = spec['alpha'], l1_ratio = spec['l1_ratio'], precompute = G_sub,
+                                       max_iter = int(1e7), tol = 0.001, fit_intercept = False, random_state = 0)
+            estimator.fit(X[~test_mask][:, columns], y[~test_mask])
+            coefs[columns] = estimator.coef_
+
+        else:
+            raise ValueError('Unknown model family {}'.format(family))
+
+        y_predict[name] = np.dot(X_test, coefs)
+
+    return y_predict
+
+
+def group_cv(X, y, groups, models, n_jobs = 1):
+
+    '''
+    Leave-one-group-out cross validation, e.g. leave one support or one metal out
+    models: dictionary of model name -> specification, with the keys
+        family: 'OLS', 'Ridge', 'LASSO', 'Enet' or 'fixed'
+        alpha, l1_ratio: regularization (Ridge, LASSO, Enet)
+        columns: indices of the descriptors used, e.g. [0, term_index] for DSL
+        coefs: coefficients of a fixed model trained elsewhere (GP)
+    The intercept is the first column of X, as fit_int_flag = False in training
+    Groups are fitted in parallel and share one Gram matrix of the full data
+    return a tidy dataframe with one row per (group, model)
+    '''
+    X = np.asarray(X, dtype = float)
+    y = np.asarray(y, dtype = float)
+    groups = np.asarray(groups)
+    group_types = np.unique(groups)
+
+    G = np.dot(X.T, X)
+    b = np.dot(X.T, y)
+
+    predictions = Parallel(n_jobs = n_jobs)(
+        delayed(_fit_group)(X, y, G, b, groups == gi, models) for gi in group_types)
+
+    rows = []
+    for gi, y_predict in zip(group_types, predictions):
+        y_test = y[groups == gi]
+        for name, y_pred in y_predict.items():
+            error = y_pred - y_test
+            ss_tot = np.sum((y_test - y_test.mean())**2)
+            rows.append({'group': gi,
+                         'model': name,
+                         'n_test': len(y_test),
+                         'RMSE': np.sqrt(np.mean(error**2)),
+                         'MAE': np.mean(np.abs(error)),
+                         'max_error': np.max(np.abs(error)),
+                         'r2': 1 - np.sum(error**2)/ss_tot if ss_tot > 0 else np.nan})
+
+    return pd.DataFrame(rows, columns = ['group', 'model', 'n_test', 'RMSE', 'MAE', 'max_error', 'r2'])
+
+
+def loo_ridge_path(X, y, alphas, columns = None, rcond = None):
+
+    '''
+    Exact leave-one-out Ridge path from one SVD, alpha = 0 gives OLS
+    (minimum norm, as sklearn LinearRegression) and columns = [0, term_index] the DSL
+    The LOO residual of sample i is e_i/(1 - h_ii) with the hat matrix
+    H = U diag(s^2/(s^2 + alpha)) U^T, written with the weights
+    alpha/(s^2 + alpha) of I - H so that it also holds when OLS interpolates
+    rcond: singular values below rcond*max are zero, by default eps as lstsq
+    return the LOO RMSE of each alpha and the LOO residuals (samples x alphas)
+    '''
+    X = np.asarray(X, dtype = float)
+    y = np.asarray(y, dtype = float)
+    if columns is not None: X = X[:, columns]
+    alphas = np.atleast_1d(np.asarray(alphas, dtype = float))
+    if rcond is None: rcond = np.finfo(float).eps
+
+    U, s, _ = linalg.svd(X, full_matrices = True, lapack_driver = 'gesdd')
+    s2 = np.zeros(len(y))
+    s2[:len(s)] = s**2
+    s2[s2 <= (rcond * s.max())**2] = 0.0
+    Uy = np.dot(U.T, y)
+    U2 = U**2
+
+    residuals = np.zeros((len(y), len(alphas)))
+    for ai, alpha in enumerate(alphas):
+        if alpha > 0:
+            w = alpha / (s2 + alpha)
+        elif np.any(s2 == 0):
+            # I - H projects on the null space of X^T
+            w = (s2 == 0).astype(float)
+        else:
+            # more descriptors than samples, limit of alpha/(s^2 + alpha) up to the factor alpha
+            w = 1 / s2
+        denominator = np.dot(U2, w)
+        residuals[:, ai] = np.dot(U, w * Uy) / np.maximum(denominator, np.finfo(float).tiny)
+
+        if alpha == 0 and np.any(s2 == 0):
+            # samples with h_ii = 1 lower the rank when held out, refit them exactly
+            for i in np.flatnonzero(denominator < 1e-8):
+                train = np.arange(len(y)) != i
+                coefs_i = linalg.lstsq(X[train], y[train], cond = rcond, lapack_driver = 'gelsd')[0]
+                residuals[i, ai] = y[i] - np.dot(X[i], coefs_i)
+
+    return np.sqrt(np.mean(residuals**2, axis = 0)), residuals
+
+
+def alo_enet(X, y, coefs, alpha, l1_ratio = 1.0):
+
+    '''
+    Approximate leave-one-out (ALO) residuals of a LASSO/Enet fit on all samples
+    The hat matrix is taken on the active set A,
+    H = X_A (X_A^T X_A + n*alpha*(1 - l1_ratio) I)^-1 X_A^T,
+    exact as long as a held-out sample does not change the active set
+    return the ALO residuals and the leverages h_ii
+    '''
+    X = np.asarray(X, dtype = float)
+    y = np.asarray(y, dtype = float)
+    active = np.flatnonzero(coefs)
+    error = y - np.dot(X, coefs)
+    if len(active) == 0: return error, np.zeros(len(y))
+
+    X_A = X[:, active]
+    A = np.dot(X_A.T, X_A) + len(y) * alpha * (1 - l1_ratio) * np.eye(len(active))
+    h = np.sum(X_A * linalg.lstsq(A, X_A.T, lapack_driver = 'gelsd')[0].T, axis = 1)
+
+    return error / (1 - h), h
+
+
+def alo_enet_path(X, y, alphas, l1_ratio = 1.0, max_leverage = 0.9):
+
+    '''
+    ALO path of LASSO (l1_ratio = 1) or Enet, from one warm-started path on all
+    samples instead of one path per held-out sample
+    Samples with a leverage above max_leverage are where the active set is most
+    likely to change, their LOO residuals are refitted exactly, warm-started
+    from the fit on all samples with a rank-1 downdate of the Gram matrix
+    return the ALO RMSE of each alpha, the alphas (descending) and the coefficient path
+    '''
+    X = np.asarray(X, dtype = float)
+    y = np.asarray(y, dtype = float)
+    alphas = np.sort(np.asarray(alphas, dtype = float))[::-1]
+    G = np.dot(X.T, X)
+
+    _, coef_path, _ = enet_path(X, y, l1_ratio = l1_ratio, alphas = alphas, precompute = G,
+                                Xy = np.dot(X.T, y), max_iter = int(1e7), tol = 0.001)
+
+    RMSE_path = np.zeros(len(alphas))
+    for ai, alpha in enumerate(alphas):
+        residuals, h = alo_enet(X, y, coef_path[:, ai], alpha, l1_ratio)
+        for i in np.flatnonzero(h > max_leverage):
+            train = np.arange(len(y)) != i
+            _, coefs_i, _ = enet_path(X[train], y[train], l1_ratio = l1_ratio, alphas = [alpha],
+                                      precompute = G - np.outer(X[i], X[i]), Xy = np.dot(X[train].T, y[train]),
+                                      coef_init = coef_path[:, ai], max_iter = int(1e7), tol = 0.001)
+            residuals[i] = y[i] - np.dot(X[i], coefs_i[:, 0])
+        RMSE_path[ai] = np.sqrt(np.mean(residuals**2))
+
+    return RMSE_path, alphas, coef_path